@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from toolshop.agent.batch import read_tasks, run_batch
+
+
+def write_answer(task, options):
+    "Stands in for an agent: writes the instructions to a file in the working directory."
+    if task["instructions"] == "fail":
+        raise RuntimeError("task failed")
+
+    with open("answer.txt", "w") as f:
+        f.write(task["instructions"] + options["suffix"])
+    return os.listdir(".")
+
+
+def test_run_batch(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "README.md").write_text("hello\n")
+
+    tasks_file = tmp_path / "tasks.jsonl"
+    tasks_file.write_text(
+        json.dumps({"id": "a", "instructions": "first", "source": str(source)}) + "\n"
+        + json.dumps({"instructions": "second"}) + "\n\n"
+        + json.dumps({"id": "c", "instructions": "fail"}) + "\n"
+    )
+    tasks = read_tasks(str(tasks_file))
+    assert [t["id"] for t in tasks] == ["a", "2", "c"]
+
+    output = tmp_path / "results.jsonl"
+    workdir = tmp_path / "work"
+    results = list(run_batch(tasks, str(output), str(workdir), workers=2, options={"suffix": "!"}, runner=write_answer))
+
+    with open(output) as f:
+        written = {r["id"]: r for r in map(json.loads, f)}
+    assert written == {r["id"]: r for r in results}
+
+    assert written["a"]["status"] == "ok"
+    assert sorted(written["a"]["output"]) == ["README.md", "answer.txt"]
+    assert (workdir / "a" / "answer.txt").read_text() == "first!"
+    assert (workdir / "2" / "answer.txt").read_text() == "second!"
+    assert written["c"]["status"] == "error"
+    assert written["c"]["error"] == "RuntimeError: task failed"
+    assert all(r["duration_s"] >= 0 for r in results)
+
+
+def test_read_tasks_requires_instructions(tmp_path):
+    tasks_file = tmp_path / "tasks.jsonl"
+    tasks_file.write_text(json.dumps({"id": "a"}) + "\n")
+
+    with pytest.raises(ValueError, match="no 'instructions'"):
+        read_tasks(str(tasks_file))
+
+
+@pytest.mark.parametrize("task_id", ["../x", "/etc/foo", "a/b", "..", ""])
+def test_run_batch_rejects_unsafe_task_ids(tmp_path, task_id):
+    tasks = [{"id": task_id, "instructions": "escape"}]
+
+    with pytest.raises(ValueError, match="Invalid task id"):
+        list(run_batch(tasks, str(tmp_path / "results.jsonl"), str(tmp_path / "work")))
+    assert not (tmp_path / "x").exists()
+
+
+def test_task_ids_must_be_unique_as_directory_names(tmp_path):
+    tasks_file = tmp_path / "tasks.jsonl"
+    tasks_file.write_text(
+        json.dumps({"id": 1, "instructions": "first"}) + "\n"
+        + json.dumps({"id": "1", "instructions": "second"}) + "\n"
+    )
+    with pytest.raises(ValueError, match="must be unique"):
+        read_tasks(str(tasks_file))
+
+    tasks = [{"id": 1, "instructions": "first"}, {"id": "1", "instructions": "second"}]
+    with pytest.raises(ValueError, match="must be unique"):
+        list(run_batch(tasks, str(tmp_path / "results.jsonl"), str(tmp_path / "work"), runner=write_answer))
+    assert not (tmp_path / "results.jsonl").exists()
@@ -0,0 +1,48 @@
+import os
+
+from toolshop.agent.context import load_context
+
+
+def test_load_context_inline(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.md").write_text("# A  \n\n\n\nAlpha\nline break  \nend\n")
+    (tmp_path / "docs" / "b.md").write_text("Beta\n")
+    (tmp_path / "docs" / "copy.md").write_text("Beta\n")
+    (tmp_path / "docs" / ".hidden").write_text("secret\n")
+    (tmp_path / "notes.txt").write_text("Notes\n")
+
+    context = load_context([str(tmp_path / "docs"), str(tmp_path / "*.txt"), str(tmp_path / "docs" / "a.md")])
+
+    assert context.reference_path is None
+    assert context.files == [
+        str(tmp_path / "docs" / "a.md"),
+        str(tmp_path / "docs" / "b.md"),
+        str(tmp_path / "notes.txt"),
+    ]
+    assert context.text == (
+        f"===== File: {tmp_path / 'docs' / 'a.md'} =====\n# A  \n\nAlpha\nline break  \nend\n\n"
+        f"===== File: {tmp_path / 'docs' / 'b.md'} =====\nBeta\n\n"
+        f"===== File: {tmp_path / 'notes.txt'} =====\nNotes\n\n"
+    )
+
+    # A single file is inlined as is
+    assert load_context(str(tmp_path / "notes.txt")).text == "Notes\n"
+
+
+def test_load_context_reference(tmp_path):
+    (tmp_path / "big.txt").write_text("".join(f"line {i}\n" for i in range(1000)))
+    (tmp_path / "small.txt").write_text("small\n")
+
+    context = load_context([str(tmp_path / "big.txt"), str(tmp_path / "small.txt")], budget_tokens=100)
+
+    assert os.path.exists(context.reference_path)
+    assert f"- {tmp_path / 'big.txt'}: lines 2-1001" in context.text
+    assert f"- {tmp_path / 'small.txt'}: lines 1003-1003" in context.text
+
+    with open(context.reference_path) as f:
+        lines = f.read().splitlines()
+    assert lines[1] == "line 0"
+    assert lines[1002] == "small"
+
+    # Loaded from the cache
+    assert load_context([str(tmp_path / "big.txt"), str(tmp_path / "small.txt")], budget_tokens=100) == context
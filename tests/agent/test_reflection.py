@@ -0,0 +1,90 @@
+from toolshop.agent.reflection import ReflectionController
+from toolshop.tools.file import make_file_tools
+
+
+def test_reflection_stops_without_edits(test_file):
+    read_file, insert_lines = make_file_tools(["read_file", "insert_lines"])
+    state = read_file._state
+
+    prompts = []
+    def say(prompt):
+        prompts.append(prompt)
+        return "I made fixes"
+
+    # The first pass runs even if the task made no edits through the file
+    # tools, since it may have changed files otherwise
+    controller = ReflectionController(state)
+    passes = controller.run(say)
+    assert len(passes) == 1
+    assert len(prompts) == 1
+
+    read_file(test_file)
+    insert_lines(test_file, "Line 0\n", 1)
+
+    # The agent claims fixes but edits nothing
+    controller = ReflectionController(state)
+    passes = controller.run(say)
+    assert len(passes) == 1
+    assert passes[0].files_updated == []
+    assert controller.stop_reason == "no files were modified"
+
+
+def test_reflection_counts_created_files(tmp_path):
+    create_file, = make_file_tools(["create_file"])
+    path = str(tmp_path / "new.py")
+
+    def say(prompt):
+        if not (tmp_path / "new.py").exists():
+            create_file(path, "x = 1\n")
+        return "made fixes"
+
+    controller = ReflectionController(create_file._state, max_iterations=3)
+    passes = controller.run(say)
+    assert passes[0].files_updated == [path]
+    assert len(passes) == 2
+    assert controller.stop_reason == "no files were modified"
+
+
+def test_reflection_max_iterations(test_file):
+    read_file, insert_lines = make_file_tools(["read_file", "insert_lines"])
+    read_file(test_file)
+    insert_lines(test_file, "Line 0\n", 1)
+
+    def say(prompt):
+        insert_lines(test_file, "Another line\n", 1)
+        return "made fixes"
+
+    controller = ReflectionController(read_file._state, max_iterations=3)
+    passes = controller.run(say)
+    assert [p.iteration for p in passes] == [1, 2, 3]
+    assert all(p.files_updated for p in passes)
+    assert controller.stop_reason == "reached 3 passes"
+
+    controller = ReflectionController(read_file._state, time_budget=0)
+    assert controller.run(say) == []
+    assert "time budget" in controller.stop_reason
+
+
+def test_reflection_undoes_pass_failing_check(test_file):
+    read_file, insert_lines = make_file_tools(["read_file", "insert_lines"])
+    read_file(test_file)
+    insert_lines(test_file, "Line 0\n", 1)
+    with open(test_file) as f:
+        before = f.read()
+
+    def say(prompt):
+        insert_lines(test_file, "Broken line\n", 1)
+        insert_lines(test_file, "Another broken line\n", 3)
+        return "made fixes"
+
+    def check():
+        with open(test_file) as f:
+            return "Broken" not in f.read()
+
+    controller = ReflectionController(read_file._state, check=check)
+    passes = controller.run(say)
+    assert len(passes) == 1
+    assert passes[0].rolled_back
+    assert controller.stop_reason == "pass 1 failed the check, so its edits were undone"
+    with open(test_file) as f:
+        assert f.read() == before
@@ -10,3 +10,11 @@ def test_file():
     
     yield tmp_path
     os.remove(tmp_path)
+
+
+@pytest.fixture(autouse=True)
+def toolshop_cache_dir(tmp_path_factory, monkeypatch):
+    """Keep on-disk tool caches out of the user's home directory."""
+    cache_dir = tmp_path_factory.mktemp("toolshop_cache")
+    monkeypatch.setenv("TOOLSHOP_CACHE_DIR", str(cache_dir))
+    return cache_dir
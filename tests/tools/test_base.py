@@ -1,3 +1,4 @@
+import os
 import pytest
 from toolshop.core.base import Tool
 
@@ -36,3 +37,240 @@ def test_noop_when_state_missing():
 
     with pytest.raises(AttributeError):
         Hammer(state=[1,2,3])('Ned')
+
+
+def test_trace_and_replay(tmp_path):
+    from toolshop.core.trace import configure_tracing, stop_tracing, read_trace, replay_trace
+
+    class Hammer(Tool):
+        def call(self, nail):
+            """Hammers a nail.
+            Args:
+                nail (str): Name of the nail to hammer.
+            """
+            return f"hammered {nail}"
+
+    trace_path = tmp_path / "trace.jsonl"
+    configure_tracing(str(trace_path))
+    try:
+        Hammer()("Ned")
+        Hammer()(nail="Fred")
+    finally:
+        stop_tracing()
+
+    records = read_trace(str(trace_path))
+    assert [r["tool"] for r in records] == ["hammer", "hammer"]
+    assert records[0]["args"] == ["Ned"]
+    assert records[1]["kwargs"] == {"nail": "Fred"}
+    assert records[0]["result_size"] == len("hammered Ned")
+
+    outcomes = list(replay_trace(records, [Hammer()]))
+    assert all(o["result_match"] for o in outcomes)
+
+    # Tools with side effects are only replayed when allowed
+    nails = []
+
+    class Nailgun(Hammer):
+        _run_exclusively = True
+
+        def call(self, nail):
+            """Drives a nail.
+            Args:
+                nail (str): Name of the nail to drive.
+            """
+            nails.append(nail)
+            return f"hammered {nail}"
+
+    records = [dict(r, tool="nailgun") for r in records]
+    outcomes = list(replay_trace(records, [Nailgun()], repeat=3))
+    assert [o["skipped"] for o in outcomes] == ["tool has side effects"] * 2
+    assert nails == []
+
+    outcomes = list(replay_trace(records, [Nailgun()], allow_side_effects=True))
+    assert all(o["result_match"] for o in outcomes)
+    assert nails == ["Ned", "Fred"]
+
+
+def test_profile_tool_calls(tmp_path):
+    import pstats
+    from toolshop.core.profiling import configure_profiling, stop_profiling
+
+    class Hammer(Tool):
+        def call(self, nail):
+            """Hammers a nail.
+            Args:
+                nail (str): Name of the nail to hammer.
+            """
+            return "".join(str(i) for i in range(10_000)) + nail
+
+    class Saw(Tool):
+        def call(self, board):
+            """Saws a board.
+            Args:
+                board (str): Name of the board to saw.
+            """
+            return f"sawed {board}"
+
+    configure_profiling(str(tmp_path), tools=["hammer"])
+    try:
+        Hammer()("Ned")
+        Saw()("Fred")
+    finally:
+        stop_profiling()
+    Hammer()("Ted")
+
+    assert sorted(os.listdir(tmp_path)) == ["00001-hammer.pstats", "00001-hammer.txt"]
+    summary = (tmp_path / "00001-hammer.txt").read_text()
+    assert summary.startswith("tool: hammer('Ned')\nwall time: ")
+    assert "peak traced memory:" in summary
+    assert "test_base.py" in summary
+    assert pstats.Stats(str(tmp_path / "00001-hammer.pstats")).total_calls > 0
+
+
+def test_profile_async_tool_calls(tmp_path):
+    import asyncio
+    from toolshop.core.profiling import configure_profiling, stop_profiling
+
+    class Fetch(Tool):
+        def call(self, url):
+            """Fetches a page.
+            Args:
+                url (str): The URL of the page.
+            """
+            return url
+
+        async def acall(self, url):
+            await asyncio.sleep(0)
+            return "".join(str(i) for i in range(10_000)) + url
+
+    configure_profiling(str(tmp_path), tools=["fetch"])
+    try:
+        assert asyncio.run(Fetch().call_async("example.com")).endswith("example.com")
+    finally:
+        stop_profiling()
+
+    assert sorted(os.listdir(tmp_path)) == ["00001-fetch.pstats", "00001-fetch.txt"]
+    summary = (tmp_path / "00001-fetch.txt").read_text()
+    assert summary.startswith("tool: fetch('example.com')\nwall time: ")
+    assert "test_base.py" in summary
+
+
+def test_dispatch_tool_calls():
+    import asyncio
+    import time
+    from toolshop.core.dispatch import dispatch_tool_calls
+
+    events = []
+
+    class Nap(Tool):
+        def call(self, name, key=None):
+            """Naps for a bit.
+            Args:
+                name (str): Name of the nap.
+                key (str): Naps with the same key never overlap.
+            """
+            events.append(("start", name))
+            time.sleep(0.2)
+            events.append(("end", name))
+            return name
+
+        def concurrency_key(self, name, key=None):
+            return key
+
+    class Alarm(Nap):
+        _run_exclusively = True
+
+    nap, alarm = Nap(), Alarm()
+    calls = [
+        (nap, dict(name="a")),
+        (nap, dict(name="b")),
+        (nap, dict(name="c", key="k")),
+        (nap, dict(name="d", key="k")),
+        (alarm, dict(name="e")),
+        (nap, dict(name="f")),
+    ]
+
+    start = time.perf_counter()
+    results = asyncio.run(dispatch_tool_calls(calls))
+    elapsed = time.perf_counter() - start
+
+    assert results == ["a", "b", "c", "d", "e", "f"]
+    # a, b and c overlap, then d, then e alone, then f
+    assert elapsed < 1.1
+    assert events.index(("end", "c")) < events.index(("start", "d"))
+    assert events.index(("start", "e")) > max(events.index(("end", n)) for n in "abcd")
+    assert events.index(("start", "f")) > events.index(("end", "e"))
+
+
+def test_confirmation_policies():
+    import asyncio
+    from toolshop.core.base import State
+    from toolshop.core.confirmation import RulesPolicy, ChainPolicy, DenyPolicy
+    from toolshop.core.dispatch import dispatch_tool_calls
+
+    class Hammer(Tool):
+        _require_confirmation = True
+
+        def call(self, nail):
+            """Hammers a nail.
+            Args:
+                nail (str): Name of the nail to hammer.
+            """
+            return nail
+
+    # Without a terminal, the default policy denies instead of blocking
+    with pytest.raises(Exception, match="denied"):
+        asyncio.run(Hammer().call_async("Ned"))
+
+    state = State()
+    state.set_confirmation_policy(
+        ChainPolicy([RulesPolicy(rules=["deny hammer nail=F*", "allow ham*"]), DenyPolicy()])
+    )
+    hammer = Hammer(state=state)
+
+    assert hammer(nail="Ned") == "Ned"
+    assert asyncio.run(hammer.get_partial(use_async=True)(nail="Ned")) == "Ned"
+    with pytest.raises(Exception, match="denied"):
+        hammer(nail="Fred")
+
+    results = asyncio.run(dispatch_tool_calls([(hammer, dict(nail="Ned")), (hammer, dict(nail="Fred"))]))
+    assert results[0] == "Ned"
+    assert isinstance(results[1], Exception)
+
+
+def test_result_budget():
+    from toolshop.core.budget import ResultBudget
+
+    class Counter(Tool):
+        def call(self, n):
+            """Counts to n.
+            Args:
+                n (int): Number to count to.
+            """
+            for i in range(n):
+                yield f"line {i}\n"
+
+    assert Counter()(10) == "".join(f"line {i}\n" for i in range(10))
+
+    output = Counter(result_budget=ResultBudget(max_tokens=100))(10_000)
+    assert output.startswith("line 0\n")
+    assert output.endswith("line 9999\n")
+    assert "dropped from the middle" in output
+    assert len(output) < 1000
+
+    output = Counter(result_budget=ResultBudget(max_tokens=100, strategy="spill"))(10_000)
+    path = output.split("written to ")[1].split(". ")[0]
+    with open(path) as f:
+        assert f.read() == "".join(f"line {i}\n" for i in range(10_000))
+
+    # Undecodable bytes read from files are written back as they were
+    spilled = ResultBudget(max_tokens=100, strategy="spill").apply("caf\udce9\n" * 1000, "read_file")
+    with open(spilled.split("written to ")[1].split(". ")[0], "rb") as f:
+        assert f.read() == b"caf\xe9\n" * 1000
+
+    # Spilled results are removed at exit
+    from toolshop.core.budget import _remove_spill_dir
+    _remove_spill_dir()
+    assert not os.path.exists(os.path.dirname(path))
+
+    assert Counter(result_budget=ResultBudget(max_tokens=None))(10_000).count("\n") == 10_000
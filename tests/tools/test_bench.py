@@ -0,0 +1,15 @@
+from toolshop.core.bench import run_benchmarks, save_baseline, compare_to_baseline
+
+
+def test_benchmarks_run_and_compare(tmp_path):
+    results = list(run_benchmarks(["read_helper", "sql"], scale=0.001, repeat=2))
+
+    assert [r["name"] for r in results] == ["read_helper", "sql"]
+    assert all(r["p50_ms"] > 0 and r["peak_rss_kb"] > 0 for r in results)
+
+    baseline_path = str(tmp_path / "baseline.json")
+    save_baseline(results, baseline_path)
+    assert compare_to_baseline(results, baseline_path) == []
+
+    slower = [dict(r, p50_ms=r["p50_ms"] * 2) for r in results]
+    assert len(compare_to_baseline(slower, baseline_path)) == 2
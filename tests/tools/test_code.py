@@ -0,0 +1,119 @@
+import os
+import pytest
+
+from toolshop.tools.code import SearchCode, TrigramIndex, Outline, FindSymbol, _required_literals
+from toolshop.tools.file import make_file_tools
+from toolshop.tools.code import make_code_tools
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("def hello_world():\n    return 'Hello'\n")
+    (tmp_path / "pkg" / "b.py").write_text("import a\n\nprint(a.hello_world())\n")
+    (tmp_path / "data.bin").write_bytes(b"\0hello_world\0")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "config").write_text("hello_world\n")
+    return tmp_path
+
+
+def test_search_code_literal(tree):
+    output = SearchCode()("hello_world", path=str(tree))
+
+    assert output.splitlines() == [
+        os.path.join(str(tree), "pkg", "a.py") + ":1:def hello_world():",
+        os.path.join(str(tree), "pkg", "b.py") + ":3:print(a.hello_world())",
+    ]
+
+
+def test_search_code_regex_and_case(tree):
+    output = SearchCode()(r"return '\w+'", path=str(tree), regex=True)
+    assert output.endswith("a.py:2:    return 'Hello'\n")
+
+    assert "a.py:2:" in SearchCode()("HELLO", path=str(tree), case_sensitive=False)
+    assert "No matches" in SearchCode()("HELLO", path=str(tree))
+
+
+def test_search_code_incremental(tree):
+    state_tools = make_file_tools(["read_file", "insert_lines"])
+    read_file, insert_lines = state_tools
+    search_code, = make_code_tools(["search_code"], state=read_file._state)
+
+    assert "No matches" in search_code("goodbye", path=str(tree))
+
+    path = str(tree / "pkg" / "a.py")
+    read_file(path)
+    insert_lines(path, "def goodbye():\n    pass\n", -1)
+    assert "a.py:3:def goodbye():" in search_code("goodbye", path=str(tree))
+
+    os.remove(path)
+    assert "No matches" in search_code("goodbye", path=str(tree))
+
+    # A fresh index is loaded from disk
+    index = TrigramIndex.load(str(tree))
+    assert set(index.files) == {os.path.join("pkg", "b.py"), "data.bin"}
+
+
+def test_required_literals():
+    assert _required_literals(r"def \w+_world\(") == ["def ", "_world("]
+    assert _required_literals(r"foo|bar") == []
+
+
+SOURCE = """\
+import functools
+
+
+class Greeter(Base, metaclass=Meta):
+    @functools.cache
+    def greet(self, name: str = "world") -> str:
+        return f"Hello {name}"
+
+    async def wait(self):
+        def inner():
+            pass
+
+
+def hello_world():
+    return Greeter().greet()
+"""
+
+
+def test_outline(tmp_path):
+    path = tmp_path / "greeter.py"
+    path.write_text(SOURCE)
+
+    assert Outline()(str(path)).splitlines() == [
+        "    4-11    class Greeter(Base, metaclass=Meta)",
+        "    5-7         def greet(self, name: str='world') -> str",
+        "    9-11        async def wait(self)",
+        "   10-11            def inner()",
+        "   14-15    def hello_world()",
+    ]
+
+    (tmp_path / "broken.py").write_text("def broken(:\n")
+    assert Outline()(str(tmp_path / "broken.py")).startswith("Could not parse")
+
+
+def test_find_symbol(tree):
+    (tree / "pkg" / "greeter.py").write_text(SOURCE)
+    greeter_path = os.path.join(str(tree), "pkg", "greeter.py")
+
+    assert FindSymbol()("greet", path=str(tree)) == (
+        f"{greeter_path}:5-7: def greet(self, name: str='world') -> str  [Greeter.greet]\n"
+    )
+    assert "[hello_world]" in FindSymbol()("hello_*", path=str(tree))
+    assert FindSymbol()("Greeter.*", path=str(tree)).count("Greeter.") == 3
+    assert "No definitions" in FindSymbol()("goodbye", path=str(tree))
+
+
+def test_find_symbol_after_edit(tree):
+    read_file, insert_lines = make_file_tools(["read_file", "insert_lines"])
+    outline, find_symbol = make_code_tools(["outline", "find_symbol"], state=read_file._state)
+
+    path = str(tree / "pkg" / "a.py")
+    assert "No definitions" in find_symbol("goodbye", path=str(tree))
+    assert "def hello_world()" in outline(path)
+
+    read_file(path)
+    insert_lines(path, "def goodbye():\n    pass\n", -1)
+    assert "a.py:3-4: def goodbye()" in find_symbol("goodbye", path=str(tree))
@@ -1,3 +1,7 @@
+import sqlite3
+
+import pytest
+
 from toolshop.tools.data import Sql
 from toolshop.tools.gcp import AuthenticateToGCP
 
@@ -16,3 +20,178 @@ def test_bq_sql_query():
     assert "word_count" in res 
 
 
+
+
+def test_sql_result_to_file(tmp_path):
+    import sqlite3
+    from toolshop.core.base import State
+    from toolshop.core.meta import EnableResultToFile
+
+    db_path = tmp_path / "test.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE t (id INTEGER, name TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, f"name{i}") for i in range(2500)])
+
+    state = State()
+    sql = Sql(state=state)
+    uri = f"sqlite:///{db_path}"
+
+    res = sql(sql_query="SELECT * FROM t", database_uri=uri)
+    assert res.splitlines()[:2] == ["id,name", "0,name0"]
+    assert len(res.splitlines()) == 2501
+
+    out_path = tmp_path / "out.csv"
+    EnableResultToFile(state=state)(str(out_path))
+    summary = sql(sql_query="SELECT * FROM t", database_uri=uri)
+
+    assert str(out_path) in summary
+    with open(out_path, newline="") as f:
+        assert f.read() == res
+
+
+def test_load_table(tmp_path):
+    from toolshop.tools.data import LoadTable
+
+    csv_path = tmp_path / "sales data.csv"
+    with open(csv_path, "w") as f:
+        f.write("id,price,region,\n")
+        f.writelines(f"{i},{i * 1.5},r{i % 3},\n" for i in range(25_000))
+        f.write("oops,,r0\n")
+
+    jsonl_path = tmp_path / "regions.jsonl"
+    with open(jsonl_path, "w") as f:
+        f.writelines(f'{{"region": "r{i}", "name": "Region {i}", "tags": ["a"]}}\n' for i in range(3))
+
+    db_path = tmp_path / "tables.db"
+    res = LoadTable()(path=str(csv_path), database_path=str(db_path))
+    assert "25001 rows into table sales_data" in res
+    assert "id INTEGER, price REAL, region TEXT, column_4 INTEGER" in res
+    assert f'sql(database_uri="sqlite:///{db_path}")' in res
+
+    res = LoadTable()(path=str(jsonl_path), table="regions", database_path=str(db_path))
+    assert "region TEXT, name TEXT, tags TEXT" in res
+
+    res = Sql()(
+        sql_query=(
+            "SELECT r.name, count(*) AS n, max(s.price) AS top FROM sales_data s "
+            "JOIN regions r USING (region) GROUP BY r.name ORDER BY r.name"
+        ),
+        database_uri=f"sqlite:///{db_path}",
+    )
+    assert res.splitlines()[:2] == ["name,n,top", "Region 0,8335,37498.5"]
+
+    # Values that do not match the inferred type are kept as text
+    res = Sql()(sql_query="SELECT id FROM sales_data WHERE typeof(id) = 'text'", database_uri=f"sqlite:///{db_path}")
+    assert res.splitlines() == ["id", "oops"]
+
+
+def test_load_table_keeps_leading_zeros(tmp_path, monkeypatch):
+    from toolshop.tools import data
+    from toolshop.tools.data import LoadTable
+
+    monkeypatch.setattr(data, "SCHEMA_SAMPLE_ROWS", 2)
+
+    csv_path = tmp_path / "zips.csv"
+    csv_path.write_text("zip,n,ratio\n00501,1,0.5\n02134,0,0.25\n90210,10,1\n")
+    db_path = tmp_path / "tables.db"
+
+    res = LoadTable()(path=str(csv_path), database_path=str(db_path))
+    assert "zip TEXT, n INTEGER, ratio REAL" in res
+
+    res = Sql()(sql_query="SELECT zip FROM zips", database_uri=f"sqlite:///{db_path}")
+    assert res.splitlines() == ["zip", "00501", "02134", "90210"]
+
+    # A leading zero after the sample makes the column TEXT too
+    csv_path.write_text("zip,n\n90210,1\n10001,2\n00501,3\n")
+    res = LoadTable()(path=str(csv_path), database_path=str(db_path))
+    assert "zip TEXT, n INTEGER" in res
+    res = Sql()(sql_query="SELECT zip, typeof(zip) AS type FROM zips", database_uri=f"sqlite:///{db_path}")
+    assert res.splitlines() == ["zip,type", "90210,text", "10001,text", "00501,text"]
+
+
+def test_load_table_without_columns(tmp_path):
+    from toolshop.tools.data import LoadTable
+
+    for name, contents in [("empty.csv", ""), ("empty.jsonl", "")]:
+        path = tmp_path / name
+        path.write_text(contents)
+        with pytest.raises(ValueError, match="has no columns"):
+            LoadTable()(path=str(path), database_path=str(tmp_path / "tables.db"))
+
+    # A header without rows makes an empty table
+    path = tmp_path / "header.csv"
+    path.write_text("a,b\n")
+    assert "Loaded 0 rows into table header" in LoadTable()(path=str(path), database_path=str(tmp_path / "tables.db"))
+
+
+def test_load_table_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from toolshop.tools.data import LoadTable
+
+    path = tmp_path / "points.parquet"
+    pq.write_table(pa.table({"x": [1, 2, 3], "label": ["a", "b", None]}), str(path))
+    db_path = tmp_path / "tables.db"
+
+    res = LoadTable()(path=str(path), database_path=str(db_path))
+    assert "Loaded 3 rows into table points (x INTEGER, label TEXT)" in res
+    res = Sql()(sql_query="SELECT sum(x) AS total FROM points", database_uri=f"sqlite:///{db_path}")
+    assert res.splitlines() == ["total", "6"]
+
+
+def test_load_table_duckdb(tmp_path):
+    duckdb = pytest.importorskip("duckdb")
+    from toolshop.tools.data import LoadTable
+
+    csv_path = tmp_path / "sales.csv"
+    csv_path.write_text("id,price\n1,2.5\n2,3.5\n")
+    db_path = tmp_path / "tables.duckdb"
+
+    res = LoadTable()(path=str(csv_path), database_path=str(db_path))
+    assert "Loaded 2 rows into table sales" in res
+    assert f"duckdb:///{db_path}" in res
+
+    connection = duckdb.connect(str(db_path))
+    try:
+        assert connection.execute("SELECT sum(price) FROM sales").fetchone()[0] == 6.0
+    finally:
+        connection.close()
+
+
+def test_get_table_schema(tmp_path):
+    from toolshop.tools.data import make_data_tools
+
+    db_path = tmp_path / "shop.db"
+    uri = f"sqlite:///{db_path}"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+        conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER REFERENCES customers(id), total REAL)")
+        conn.execute("CREATE INDEX ix_orders_customer ON orders (customer_id)")
+        conn.execute("CREATE VIEW big_orders AS SELECT * FROM orders WHERE total > 100")
+        conn.executemany("INSERT INTO orders (customer_id, total) VALUES (?, ?)", [(1, 5.0)] * 40)
+
+    sql, load_table, get_table_schema = make_data_tools(["sql", "load_table", "get_table_schema"])
+
+    res = get_table_schema(database_uri=uri)
+    assert "big_orders (view)" in res
+    assert "    name TEXT NOT NULL" in res
+    assert "orders  ~40 rows" in res
+    assert "    foreign key (customer_id) -> customers (id)" in res
+    assert "    index ix_orders_customer (customer_id)" in res
+
+    res = get_table_schema(database_uri=uri, tables=["cust*"])
+    assert res.startswith("customers  ~0 rows\n    id INTEGER PRIMARY KEY\n")
+    assert "orders" not in res
+
+    # `sql` only runs queries, so its statements do not change the schema
+    with pytest.raises(ValueError, match="returned no rows"):
+        list(sql(sql_query="CREATE TABLE refunds (order_id INTEGER)", database_uri=uri))
+    with pytest.raises(ValueError, match="returned no rows"):
+        list(sql(sql_query="INSERT INTO customers (name) VALUES ('Ned')", database_uri=uri))
+    assert get_table_schema(database_uri=uri, tables=["refunds"]).startswith("No tables match")
+    assert sql(sql_query="SELECT count(*) AS n FROM customers", database_uri=uri) == "n\r\n0\r\n"
+
+    # Loading a table refreshes the cached schema
+    (tmp_path / "refunds.csv").write_text("order_id\n1\n")
+    load_table(path=str(tmp_path / "refunds.csv"), database_path=str(db_path))
+    assert get_table_schema(database_uri=uri, tables=["refunds"]).startswith("refunds  ~1 rows")
@@ -6,6 +6,7 @@ from toolshop.tools.file import (
     DeleteLines, 
     ReplaceLines, 
     ReadDirectory,
+    ReadFiles,
     make_file_tools
 )
 import tempfile
@@ -146,3 +147,370 @@ def test_read_directory_on_toolshop():
     output = ReadDirectory()(root)
     print(output)
 
+
+
+def test_edit_outside_of_tools_requires_reread(test_file):
+    read_file, delete_lines = make_file_tools(["read_file", "delete_lines"])
+
+    read_file(test_file)
+    with open(test_file, 'a') as f:
+        f.write("Line 4\n")
+
+    with pytest.raises(ValueError, match="modified outside"):
+        delete_lines(test_file, 1, 1)
+
+    read_file(test_file)
+    delete_lines(test_file, 1, 1)
+
+
+def test_edit_returns_diff(test_file):
+    read_file, replace_lines, insert_lines, delete_lines = make_file_tools(
+        ["read_file", "replace_lines", "insert_lines", "delete_lines"]
+    )
+
+    read_file(test_file)
+    assert replace_lines(test_file, 'New Line 2\nNew Line 3\n', 2, 2) == (
+        f"--- {test_file}\n"
+        f"+++ {test_file}\n"
+        "@@ -1,3 +1,4 @@\n"
+        " 1   |Line 1\n"
+        "-    |Line 2\n"
+        "+2   |New Line 2\n"
+        "+3   |New Line 3\n"
+        " 4   |Line 3\n"
+    )
+
+    # The diff shows the new line numbers, so the file can be edited again
+    # without re-reading it
+    assert "+5   |Line 4\n" in insert_lines(test_file, 'Line 4\n', -1)
+    assert delete_lines(test_file, 1, 1).splitlines()[3:5] == ["-    |Line 1", " 1   |New Line 2"]
+
+    with open(test_file) as f:
+        assert f.read() == "New Line 2\nNew Line 3\nLine 3\nLine 4\n"
+
+
+def test_file_cache_shared_by_read_and_edit(test_file):
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    cache = read_file._state.file_cache
+
+    read_file(test_file)
+    replace_lines(test_file, 'Replaced Line\n', 2, 2)
+    assert read_file(test_file, include_line_numbers=False) == "Line 1\nReplaced Line\nLine 3\n"
+    assert (cache.misses, cache.hits) == (1, 2)
+
+    # Changes made outside of the tools are picked up
+    with open(test_file, 'a') as f:
+        f.write("Line 4\n")
+    assert read_file(test_file, include_line_numbers=False).endswith("Line 3\nLine 4\n")
+    assert cache.misses == 2
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    from toolshop.core.filecache import FileCache
+
+    paths = []
+    for name in "abc":
+        path = tmp_path / f"{name}.txt"
+        path.write_text(name * 9 + "\n")
+        paths.append(str(path))
+
+    cache = FileCache(max_bytes=25)
+    cache.get_lines(paths[0])
+    cache.get_lines(paths[1])
+    cache.get_lines(paths[0])
+    cache.get_lines(paths[2])
+    assert len(cache) == 2
+
+    cache.get_lines(paths[0])
+    assert cache.hits == 2
+    cache.get_lines(paths[1])
+    assert cache.misses == 4
+
+
+def test_read_non_utf8_and_binary_files(tmp_path):
+    latin1_path = tmp_path / "latin1.txt"
+    latin1_path.write_bytes("café\nnaïve\n".encode("latin-1"))
+    binary_path = tmp_path / "data.bin"
+    binary_path.write_bytes(b"\x00\x01\x02" * 100)
+
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    assert read_file(str(latin1_path), include_line_numbers=False) == "caf\ufffd\nna\ufffdve\n"
+    assert "binary file of 300 bytes" in read_file(str(binary_path))
+
+    # Edits keep the bytes of the lines they do not replace
+    replace_lines(str(latin1_path), "tea\n", 1, 1)
+    assert latin1_path.read_bytes() == b"tea\nna\xefve\n"
+
+    output = ReadDirectory()(str(tmp_path))
+    assert "binary file of 300 bytes" in output
+    assert "na\ufffdve" in output
+
+
+def test_edit_binary_file(tmp_path):
+    binary_path = tmp_path / "data.bin"
+    binary_path.write_bytes(b"\x00\x01\x02" * 100)
+
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    read_file(str(binary_path))
+    with pytest.raises(ValueError, match="binary"):
+        replace_lines(str(binary_path), "text\n", 1, 1)
+    assert binary_path.read_bytes() == b"\x00\x01\x02" * 100
+
+
+def test_edit_with_text_the_encoding_cannot_represent(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"caf\xe9\nline2\n")
+
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    read_file(str(path))
+    with pytest.raises(ValueError, match="cannot represent"):
+        replace_lines(str(path), "lone surrogate \ud800\n", 2, 2)
+
+    # The file is left as it was
+    assert path.read_bytes() == b"caf\xe9\nline2\n"
+
+
+def test_read_text_lines_range(tmp_path):
+    from toolshop.core.textfile import read_text_lines, write_text_lines
+
+    path = tmp_path / "mixed.txt"
+    path.write_bytes(b"\xef\xbb\xbfline 1\r\nline 2\nbad \xff byte\nline 4")
+
+    # Invalid bytes are kept, so that edits can write the file back unchanged
+    lines, encoding = read_text_lines(str(path))
+    assert encoding == "utf-8-sig"
+    assert lines[2] == "bad \udcff byte\n"
+    write_text_lines(str(tmp_path / "copy.txt"), lines, encoding)
+    assert (tmp_path / "copy.txt").read_bytes() == path.read_bytes().replace(b"\r\n", b"\n")
+
+    # Ranges are decoded the same way
+    assert read_text_lines(str(path), 0, 1) == (["line 1\n"], "utf-8-sig")
+    assert read_text_lines(str(path), 2, 10) == (lines[2:], "utf-8-sig")
+
+
+def test_utf8_file_with_invalid_byte(tmp_path):
+    path = tmp_path / "notes.txt"
+    data = b"x" * 9000 + b"\nna\xc3\xafve \xe2\x86\x92 ok\nbad \xff\n"
+    path.write_bytes(data)
+
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    assert read_file(str(path), start_line=2, include_line_numbers=False) == "naïve → ok\nbad \ufffd\n"
+    assert read_file(str(path), include_line_numbers=False).endswith("naïve → ok\nbad \ufffd\n")
+
+    # Editing other lines keeps the invalid byte
+    replace_lines(str(path), "naïve → fine\n", 2, 2)
+    assert path.read_bytes() == data.replace(b"ok", b"fine")
+
+
+def test_utf8_file_with_invalid_byte_in_first_block(tmp_path):
+    from toolshop.core.textfile import read_text_lines
+
+    path = tmp_path / "notes.txt"
+    data = b"stray \xff\nna\xc3\xafve \xe2\x86\x92 ok\n"
+    path.write_bytes(data)
+
+    # One invalid byte does not make the whole file decode as another encoding
+    assert read_text_lines(str(path)) == (["stray \udcff\n", "naïve → ok\n"], "utf-8")
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"])
+    assert read_file(str(path), include_line_numbers=False) == "stray \ufffd\nnaïve → ok\n"
+
+    replace_lines(str(path), "naïve → fine\n", 2, 2)
+    assert path.read_bytes() == data.replace(b"ok", b"fine")
+
+
+def test_read_files(tmp_path):
+    a = tmp_path / "a.txt"
+    a.write_text("A1\nA2\nA3\n")
+    b = tmp_path / "b.txt"
+    b.write_text("".join(f"B{i}\n" for i in range(1, 101)))
+
+    read_files, replace_lines = make_file_tools(["read_files", "replace_lines"])
+    output = read_files([
+        {"path": str(a)},
+        {"path": str(b), "start_line": 1, "end_line": 2},
+        {"path": str(tmp_path / "missing.txt")},
+    ])
+    assert output == (
+        f"===== File: {a} =====\n1   |A1\n2   |A2\n3   |A3\n\n"
+        f"===== File: {b} (lines 1-2) =====\n1   |B1\n2   |B2\n\n"
+        f"===== File: {tmp_path / 'missing.txt'} =====\n"
+        f"Error reading file: The file \"{tmp_path / 'missing.txt'}\" does not exist\n\n"
+    )
+
+    # Both files were recorded as read
+    replace_lines(str(a), "A\n", 1, 1)
+    replace_lines(str(b), "B\n", 1, 1)
+
+
+def test_read_files_shares_budget(tmp_path):
+    from toolshop.core.budget import ResultBudget
+    from toolshop.tools.file import _share_budget
+
+    assert _share_budget([10, 500, 1000], 610) == [10, 300, 300]
+    assert _share_budget([10, 20], 100) == [10, 20]
+
+    small = tmp_path / "small.txt"
+    small.write_text("small\n")
+    big = tmp_path / "big.txt"
+    big.write_text("".join(f"line {i}\n" for i in range(10_000)))
+
+    output = ReadFiles(result_budget=ResultBudget(max_tokens=500))(
+        [{"path": str(big)}, {"path": str(small)}], include_line_numbers=False
+    )
+    assert output.endswith(f"===== File: {small} =====\nsmall\n\n")
+    assert "dropped from the end" in output
+    assert len(output) < 3000
+
+
+def test_repeated_reads_are_deduplicated(tmp_path):
+    path = str(tmp_path / "module.py")
+    with open(path, "w") as f:
+        f.writelines(f"value_{i} = {i}\n" for i in range(100))
+
+    from toolshop.core.base import State
+
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"], state=State(dedup_results=True))
+
+    first = read_file(path)
+    assert first.startswith("1   |value_0 = 0\n")
+
+    assert read_file(path) == (
+        f"[The result of read_file({path!r}) did not change since it was last returned. It is not repeated.]\n"
+    )
+    assert read_file(path, start_line=1) == (
+        f"[The result of read_file({path!r}, start_line=1) is identical to the result of read_file({path!r}). "
+        "It is not repeated.]\n"
+    )
+    # References point at a call whose full result was returned, not at another reference
+    assert read_file(path, end_line=100) == (
+        f"[The result of read_file({path!r}, end_line=100) is identical to the result of read_file({path!r}). "
+        "It is not repeated.]\n"
+    )
+
+    # After an edit, only the changes since the last identical call are returned
+    replace_lines(path, "value_10 = 'ten'\n", 11, 11)
+    res = read_file(path)
+    assert res.startswith(f"[The result of read_file({path!r}) changed since it was last returned. Only the changes are shown.]\n")
+    assert "-11  |value_10 = 10\n+11  |value_10 = 'ten'\n" in res
+    assert len(res) < len(first) / 4
+
+    # Results are returned in full by default
+    assert make_file_tools(["read_file"])[0](path).startswith("1   |value_0")
+
+
+def test_checkpoint_and_undo(tmp_path):
+    read_file, create_file, replace_lines, insert_lines, delete_lines, checkpoint, undo = make_file_tools(
+        ["read_file", "create_file", "replace_lines", "insert_lines", "delete_lines", "checkpoint", "undo"]
+    )
+    a = str(tmp_path / "a.txt")
+    b = str(tmp_path / "b.txt")
+    with open(a, "w") as f:
+        f.write("Line 1\nLine 2\nLine 3\n")
+
+    assert undo() == "There are no edits to undo."
+
+    read_file(a)
+    replace_lines(a, "Line one\n", 1, 1)
+    assert checkpoint("before") == 'Created checkpoint "before".'
+
+    insert_lines(a, "Line 2.5\n", 3)
+    delete_lines(a, 1, 1)
+    replace_lines(a, "Line two\nLine two and a half\n", 1, 2)
+    create_file(b, "New file\n")
+
+    # Only the last edit
+    assert undo() == f"- {b}: deleted\nRead the files again before editing them.\n"
+    assert not os.path.exists(b)
+
+    assert undo("before") == f"- {a}: 3 edit(s) undone\nRead the files again before editing them.\n"
+    with open(a) as f:
+        assert f.read() == "Line one\nLine 2\nLine 3\n"
+    with pytest.raises(ValueError, match="must be re-read"):
+        replace_lines(a, "x\n", 1, 1)
+
+    # Edits made outside of the tools are never overwritten
+    read_file(a)
+    replace_lines(a, "Line 1\n", 1, 1)
+    with open(a, "a") as f:
+        f.write("Line 4\n")
+    with pytest.raises(ValueError, match="changed outside of the file tools"):
+        undo(paths=[a])
+    with pytest.raises(ValueError, match="no checkpoint"):
+        undo("after")
+
+
+def test_undo_checks_every_file_first(tmp_path, monkeypatch):
+    from toolshop.core import journal
+    from toolshop.core.base import State
+
+    state = State()
+    read_file, create_file, replace_lines, checkpoint, undo = make_file_tools(
+        ["read_file", "create_file", "replace_lines", "checkpoint", "undo"], state=state
+    )
+    a = tmp_path / "a.txt"
+    c = tmp_path / "c.txt"
+    a.write_text("Line 1\n")
+    c.write_text("Line 1\n")
+
+    checkpoint("start")
+    for path in (a, c):
+        read_file(str(path))
+        replace_lines(str(path), "Line one\n", 1, 1)
+
+    # c turns binary without its size or mtime changing: nothing is undone
+    stat = c.stat()
+    c.write_bytes(b"\0" * stat.st_size)
+    os.utime(c, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with pytest.raises(ValueError, match="binary"):
+        state.journal.undo("start")
+    assert a.read_text() == "Line one\n"
+
+    # A failure while restoring keeps the edits of the files restored before it
+    # out of the journal, so they are not undone twice
+    c.write_text("Line one\n")
+    os.utime(c, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    b = str(tmp_path / "b.txt")
+    create_file(b, "New file\n")
+    monkeypatch.setattr(journal.os, "remove", lambda path: (_ for _ in ()).throw(PermissionError(path)))
+    with pytest.raises(PermissionError):
+        undo("start")
+    assert a.read_text() == "Line 1\n"
+
+    monkeypatch.undo()
+    assert undo("start") == f"- {b}: deleted\nRead the files again before editing them.\n"
+    assert a.read_text() == "Line 1\n"
+
+def test_find_files(tmp_path):
+    from toolshop.core.base import State
+
+    state = State()
+    find_files, create_file = make_file_tools(["find_files", "create_file"], state=state)
+
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "src" / "pkg" / "a.py").write_text("a = 1\n")
+    (tmp_path / "src" / "pkg" / "big.py").write_text("b = 2\n" * 1000)
+    (tmp_path / "src" / "test_a.py").write_text("")
+    (tmp_path / "README.md").write_text("")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "config.py").write_text("")
+    root = str(tmp_path)
+
+    def find(*args, **kwargs):
+        output = find_files(*args, path=root, **kwargs)
+        return [os.path.relpath(line.split("  ")[0], root) for line in output.splitlines()]
+
+    assert find(["*.py"]) == ["src/pkg/a.py", "src/pkg/big.py", "src/test_a.py"]
+    assert find(["src/*.py"]) == ["src/test_a.py"]
+    assert find(["src/**/*.py", "*.md"], exclude=["test_*"]) == ["README.md", "src/pkg/a.py", "src/pkg/big.py"]
+    assert find(["**"], min_size=100) == ["src/pkg/big.py"]
+    assert find(["*.py"], sort="size")[0] == "src/pkg/big.py"
+    assert find(["*"], max_age=10) == find(["*"])
+    assert "No files under" in find_files(["*"], path=root, min_age=10)
+
+    output = find_files(["*.py"], path=root, limit=1)
+    assert "[Showing 1 of 3 matching files." in output
+
+    # The tree is refreshed for files created through the tools or not
+    create_file(str(tmp_path / "src" / "pkg" / "b.py"), "b = 1\n")
+    os.remove(tmp_path / "src" / "pkg" / "a.py")
+    assert find(["src/pkg/*.py"]) == ["src/pkg/b.py", "src/pkg/big.py"]
@@ -17,3 +17,108 @@ def test_shell():
     output = Shell()("echo hi")
 
     assert output[:2] == 'hi'
+
+
+def test_shell_result_to_file(tmp_path):
+    from toolshop.core.base import State
+    from toolshop.core.meta import EnableResultToFile
+
+    state = State()
+    out_path = tmp_path / "out.txt"
+    EnableResultToFile(state=state)(str(out_path))
+    summary = Shell(state=state)("seq 1 1000")
+
+    assert str(out_path) in summary
+    assert out_path.read_text().splitlines()[-2:] == ["1000", "[exit code 0]"]
+
+
+def test_shell_output_stopped_early(tmp_path):
+    import os
+    import pytest
+    from toolshop.tools.terminal import iter_shell_output
+
+    pid_path = tmp_path / "pid"
+    output = iter_shell_output(f"echo $$ > {pid_path}; echo first; sleep 60; echo last")
+    assert next(output) == "first\n"
+    output.close()
+
+    # The process was killed and reaped, not left running
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_path.read_text()), 0)
+
+def test_jobs(tmp_path):
+    from toolshop.tools.terminal import make_job_tools
+
+    start_job, poll_job, tail_job, kill_job = make_job_tools()
+
+    assert "Started job 1" in start_job("seq 1 3; echo done > out.txt", cwd=str(tmp_path))
+    assert "Started job 2" in start_job("echo start; sleep 60")
+
+    res = poll_job(1, wait=10)
+    assert res.splitlines()[0].startswith("[job 1] exited with code 0 after")
+    assert "max rss" in res
+    assert res.splitlines()[1:] == ["1", "2", "3"]
+    assert (tmp_path / "out.txt").read_text() == "done\n"
+
+    # Only new output is returned by later polls
+    assert poll_job(1).splitlines()[1:] == []
+    assert tail_job(1, lines=2).splitlines()[1:] == ["2", "3"]
+
+    res = poll_job(2, wait=0.5)
+    assert res.startswith("[job 2] running")
+
+    res = kill_job(2)
+    assert "exited with code -15" in res
+    assert "already exited" in kill_job(2)
+
+    res = poll_job()
+    assert len(res.splitlines()) == 2
+
+
+def test_kill_job_stops_background_processes():
+    from toolshop.tools.terminal import make_job_tools
+
+    start_job, poll_job, kill_job = make_job_tools(["start_job", "poll_job", "kill_job"])
+    job_manager = start_job._job_manager
+
+    # The shell exits right away and leaves the sleep running in its process group
+    start_job("sleep 60 > /dev/null & echo started")
+    assert poll_job(1, wait=10).startswith("[job 1] exited with code 0")
+    job = job_manager.get(1)
+    assert job.has_processes
+
+    assert "Stopped the processes the job left running" in kill_job(1)
+    assert not job.has_processes
+    assert "already exited" in kill_job(1)
+
+    start_job("sleep 60 > /dev/null &")
+    job_manager.get(2).finished.wait(10)
+    job_manager.kill_all()
+    assert not job_manager.get(2).has_processes
+
+
+def test_job_output_ring_buffer():
+    from toolshop.tools.terminal import JOB_OUTPUT_LINES, JOB_POLL_LINES, make_job_tools
+
+    start_job, poll_job, tail_job = make_job_tools(["start_job", "poll_job", "tail_job"])
+    start_job(f"seq 1 {JOB_OUTPUT_LINES + 10}")
+
+    res = poll_job(1, wait=10).splitlines()
+    assert f"[{JOB_OUTPUT_LINES + 10 - JOB_POLL_LINES} lines of new output not shown." in res[1]
+    assert res[-1] == str(JOB_OUTPUT_LINES + 10)
+    assert len(tail_job(1, lines=JOB_OUTPUT_LINES + 10).splitlines()) == JOB_OUTPUT_LINES + 1
+
+
+def test_browse_sync_and_async(monkeypatch):
+    import asyncio
+    import httpx
+    from toolshop.tools.terminal import Browse
+
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, text=f"page at {request.url.path}"))
+    monkeypatch.setattr(httpx, "get", lambda url: httpx.Client(transport=transport).get(url))
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(httpx, "AsyncClient", lambda: async_client(transport=transport))
+
+    browse = Browse()
+    assert browse("https://example.com/a") == "page at /a"
+    assert asyncio.run(browse.call_async("https://example.com/a")) == "page at /a"
@@ -0,0 +1,100 @@
+import pytest
+
+from toolshop.core.base import State
+from toolshop.tools.file import make_file_tools
+from toolshop.tools.testing import RunTests, TestRunner
+
+
+@pytest.fixture
+def repo(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("")
+    (tmp_path / "pkg" / "shapes.py").write_text("def area(w, h):\n    return w * h\n")
+    (tmp_path / "pkg" / "rooms.py").write_text("from .shapes import area\n\ndef floor(room):\n    return area(*room)\n")
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_shapes.py").write_text(
+        "from pkg.shapes import area\n\ndef test_area():\n    assert area(2, 3) == 6\n"
+    )
+    (tmp_path / "tests" / "test_rooms.py").write_text(
+        "from pkg import rooms\n\ndef test_floor():\n    assert rooms.floor((2, 3)) == 6\n"
+    )
+    (tmp_path / "tests" / "test_misc.py").write_text("def test_truth():\n    assert True\n")
+    return tmp_path
+
+
+def test_affected_test_selection(repo):
+    runner = TestRunner(str(repo))
+    runner.refresh()
+
+    assert runner.dependencies("tests/test_rooms.py") == {
+        "tests/test_rooms.py", "pkg/__init__.py", "pkg/rooms.py", "pkg/shapes.py"
+    }
+    assert runner.dependencies("tests/test_misc.py") == {"tests/test_misc.py"}
+    assert runner.test_files([str(repo / "tests" / "test_misc.py")]) == ["tests/test_misc.py"]
+
+
+def test_run_tests(repo):
+    state = State()
+    run_tests = RunTests(state=state)
+    read_file, replace_lines = [
+        t for t in make_file_tools(state=state) if t.__name__ in ("read_file", "replace_lines")
+    ]
+
+    output = run_tests(root=str(repo))
+    assert output.startswith("Ran 3 of 3 test files (3 tests)")
+    assert ": 0 failed." in output
+
+    assert "No test files are affected" in run_tests(root=str(repo))
+
+    # Only the tests importing the edited file, directly or not, run again
+    shapes = str(repo / "pkg" / "shapes.py")
+    read_file(shapes)
+    replace_lines(shapes, "    return w * h + 1\n", 2, 2)
+    output = run_tests(root=str(repo))
+    assert output.startswith("Ran 2 of 3 test files (2 tests)")
+    assert "FAILED tests/test_rooms.py::test_floor" in output
+    assert "FAILED tests/test_shapes.py::test_area" in output
+    assert "assert 7 == 6" in output
+
+    # Failures whose dependencies did not change are reported from the cache
+    output = run_tests(root=str(repo))
+    assert "2 test files that failed before were not run again" in output
+
+    # Results are kept between sessions
+    assert TestRunner(str(repo)).run().still_failing
+
+    assert run_tests(root=str(repo), run_all=True).startswith("Ran 3 of 3 test files")
+
+
+def test_pytest_command(repo, monkeypatch):
+    import os
+    from toolshop.tools.testing import pytest_command
+
+    monkeypatch.delenv("TOOLSHOP_PYTEST", raising=False)
+    monkeypatch.delenv("VIRTUAL_ENV", raising=False)
+
+    # The project's virtual environment is preferred to toolshop's interpreter
+    python = repo / ".venv" / "bin" / "python"
+    python.parent.mkdir(parents=True)
+    python.write_text("#!/bin/sh\n")
+    os.chmod(python, 0o755)
+    assert pytest_command(str(repo)) == [str(python), "-m", "pytest"]
+
+    monkeypatch.setenv("TOOLSHOP_PYTEST", "uv run --frozen pytest")
+    assert pytest_command(str(repo)) == ["uv", "run", "--frozen", "pytest"]
+
+
+def test_worker_that_cannot_start_is_not_cached(repo, monkeypatch):
+    import sys
+
+    monkeypatch.setenv("TOOLSHOP_PYTEST", f"{sys.executable} -c \"raise SystemExit('No module named pytest')\"")
+    output = RunTests()(root=str(repo))
+    assert "No module named pytest" in output
+    assert "TOOLSHOP_PYTEST" in output
+
+    monkeypatch.setenv("TOOLSHOP_PYTEST", str(repo / "missing-pytest"))
+    assert "could not be run" in RunTests()(root=str(repo))
+    assert TestRunner(str(repo)).results == {}
+
+    monkeypatch.delenv("TOOLSHOP_PYTEST")
+    assert RunTests()(root=str(repo)).startswith("Ran 3 of 3 test files (3 tests)")
@@ -0,0 +1,80 @@
+import os
+import shutil
+import time
+
+import pytest
+
+from toolshop.core.base import State
+from toolshop.core.watcher import PollingWatcher, inotify_available
+from toolshop.tools.code import make_code_tools
+from toolshop.tools.file import make_file_tools
+
+
+requires_inotify = pytest.mark.skipif(not inotify_available(), reason="inotify is not available")
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = State()
+    state.watch(str(tmp_path))
+    yield state
+    state.stop_watching()
+
+
+@requires_inotify
+def test_watcher_detects_changes_made_outside_of_tools(tmp_path, state):
+    path = tmp_path / "a.txt"
+    path.write_text("Line 1\nLine 2\n")
+    read_file, replace_lines = make_file_tools(["read_file", "replace_lines"], state=state)
+
+    read_file(str(path))
+    replace_lines(str(path), "Line one\n", 1, 1)
+    version = state.version
+    replace_lines(str(path), "Line two\n", 2, 2)
+    assert state.changed_paths_since(0, str(tmp_path)) is None
+    assert state.changed_paths_since(version, str(tmp_path)) == {str(path)}
+
+    # Same size, so a stat could easily miss it
+    with open(path, "w") as f:
+        f.write("Line ONE\nLine TWO\n")
+
+    with pytest.raises(ValueError, match="modified outside"):
+        replace_lines(str(path), "Line 1\n", 1, 1)
+
+    assert read_file(str(path), include_line_numbers=False) == "Line ONE\nLine TWO\n"
+    replace_lines(str(path), "Line 1\n", 1, 1)
+
+
+@requires_inotify
+def test_search_code_uses_watcher(tmp_path, state):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "a.py").write_text("def hello():\n    pass\n")
+    search_code, = make_code_tools(["search_code"], state=state)
+
+    assert "a.py:1:" in search_code("hello", path=str(tmp_path))
+
+    (tmp_path / "pkg" / "b.py").write_text("hello()\n")
+    assert "b.py:1:" in search_code("hello", path=str(tmp_path))
+
+    shutil.move(str(tmp_path / "pkg"), str(tmp_path / "moved"))
+    output = search_code("hello", path=str(tmp_path))
+    assert os.path.join("moved", "a.py") + ":1:" in output
+    assert os.path.join("pkg", "a.py") not in output
+
+
+def test_polling_watcher(tmp_path):
+    changes = []
+    watcher = PollingWatcher(str(tmp_path), changes.append, interval=0.01).start()
+    try:
+        (tmp_path / "a.txt").write_text("a")
+        (tmp_path / ".git").mkdir()
+        (tmp_path / ".git" / "HEAD").write_text("ref")
+
+        deadline = time.monotonic() + 5
+        while not changes and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+
+    assert changes == [str(tmp_path / "a.txt")]
+    assert not watcher.precise
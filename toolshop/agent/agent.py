@@ -1,29 +1,105 @@
 
 from pathlib import Path
 from prompt_toolkit import PromptSession
+from pydantic import PrivateAttr
 from rich.prompt import Confirm
 from marvin.beta import Application
-from marvin.utilities.asyncio import run_async, run_sync
-from marvin.beta.assistants import Run
+from marvin.utilities.asyncio import run_async, run_sync, expose_sync_method
+from marvin.beta.assistants import Run, EndRun, ENDRUN_TOKEN
+from marvin.beta.assistants.assistants import NOT_PROVIDED, default_run_handler_class
 from typing import Union
+import json
+import os
+import subprocess
 import marvin
 
 from toolshop.agent.instructions import get_coder_instructions
+from toolshop.agent.context import load_context
+from toolshop.agent.reflection import (
+    ReflectionController,
+    DEFAULT_MAX_REFLECTIONS,
+    DEFAULT_REFLECTION_TIME_BUDGET,
+)
+from toolshop.core.base import State
+from toolshop.core.dispatch import dispatch_tool_calls
 from toolshop.tools.terminal import shell_helper
 from toolshop.tools.misc import all_tools
+from toolshop.tools.testing import TestRunner
 
 marvin.settings.openai.assistants.model = "gpt-4o"
 
 
+class ConcurrentToolRun(Run):
+    """A run that dispatches the Toolshop tool calls of each model turn
+    concurrently. Calls to other tools are made through marvin, one at a time."""
+
+    async def get_tool_outputs(self, run):
+        if run.status != "requires_action":
+            return None, None
+        if run.required_action.type != "submit_tool_outputs":
+            return await super().get_tool_outputs(run)
+
+        toolshop_tools = self.assistant._toolshop_tools
+        tool_calls = run.required_action.submit_tool_outputs.tool_calls
+        outputs = [None] * len(tool_calls)
+
+        dispatched = []
+        for i, tool_call in enumerate(tool_calls):
+            if tool_call.function.name in toolshop_tools:
+                try:
+                    kwargs = json.loads(tool_call.function.arguments)
+                except json.JSONDecodeError as e:
+                    outputs[i] = e
+                else:
+                    dispatched.append((i, toolshop_tools[tool_call.function.name], kwargs))
+            else:
+                try:
+                    outputs[i] = marvin.utilities.tools.call_function_tool(
+                        tools=self._get_tools(),
+                        function_name=tool_call.function.name,
+                        function_arguments_json=tool_call.function.arguments,
+                    )
+                except EndRun:
+                    raise
+                except Exception as e:
+                    outputs[i] = e
+
+        results = await dispatch_tool_calls([(tool, kwargs) for _, tool, kwargs in dispatched])
+        for (i, _, _), result in zip(dispatched, results):
+            outputs[i] = result
+
+        tool_outputs = []
+        for tool_call, output in zip(tool_calls, outputs):
+            if isinstance(output, EndRun):
+                raise output
+            elif output == ENDRUN_TOKEN:
+                raise EndRun()
+            elif isinstance(output, Exception):
+                output = f"Error calling tool {tool_call.function.name}: {output}"
+
+            tool_outputs.append(
+                dict(
+                    tool_call_id=tool_call.id,
+                    output=marvin.utilities.tools.output_to_string(output),
+                )
+            )
+
+        return tool_outputs
+
+
 class Agent(Application):
+    _toolshop_tools: dict = PrivateAttr(default_factory=dict)
+    _toolshop_state: State = PrivateAttr(default=None)
+
     def __init__(
         self, 
         coder_is_interactive: bool = True,
-        context_path = None
+        context_path = None,
+        confirmation_policy = None,
+        watch_files: bool = False
     ):
         if context_path:
-            with open(context_path, 'r') as f:
-                user_context = f.read()
+            user_context = load_context(context_path).text
         else:
             user_context = ""
 
@@ -32,25 +108,89 @@ class Agent(Application):
             user_context=user_context
         )
 
+        # The conversation keeps every result, so repeated ones are not sent again
+        state = State(dedup_results=True)
+        if confirmation_policy:
+            state.set_confirmation_policy(confirmation_policy)
+        if watch_files:
+            state.watch(os.getcwd())
+
+        tools = all_tools(framework=None, state=state)
+
         super().__init__(
             name="Agent",
             instructions=instructions,
-            tools=all_tools(),  
+            tools=[t.to_marvin(use_async=True) for t in tools],  
+        )
+
+        self._toolshop_tools = {t.__name__: t for t in tools}
+        self._toolshop_state = state
+
+    @expose_sync_method("say")
+    async def say_async(
+        self,
+        message: str,
+        thread=None,
+        event_handler_class=NOT_PROVIDED,
+        **run_kwargs,
+    ) -> Run:
+        """Same as `Application.say_async`, but tool calls made in the same
+        model turn are dispatched concurrently."""
+        thread = thread or self.default_thread
+
+        if event_handler_class is NOT_PROVIDED:
+            event_handler_class = default_run_handler_class()
+
+        user_message = await thread.add_async(message)
+
+        run = ConcurrentToolRun(
+            messages=[user_message],
+            assistant=self,
+            thread=thread,
+            event_handler_class=event_handler_class,
+            **run_kwargs,
         )
+        return await run.run_async()
 
-    def do(self, message: str = None, use_reflection: bool = True):
+    def do(
+        self,
+        message: str = None,
+        use_reflection: bool = True,
+        max_reflections: int = DEFAULT_MAX_REFLECTIONS,
+        reflection_time_budget: float = DEFAULT_REFLECTION_TIME_BUDGET,
+        check_command: str = None,
+        check_tests: bool = False,
+    ):
+        """Executes the instructions in `message`, then reviews the changes in
+        reflection passes. With a `check_command`, e.g. the test suite, a pass
+        whose edits make the command fail is undone. With `check_tests`, the
+        check runs the tests affected by the edits instead."""
         self.say(message)
         
         if use_reflection:
-            response = "made fixes"
-
-            while "made fixes" in response.lower():
-                thread = self.say(
-                    "Re-read the files you have modified and fix any issues. If " 
-                    "you had to fix any issues, respond 'made fixes'."
-                )
-
-                response = thread.messages[-1].content[0].text.value
+            def say(prompt):
+                run = self.say(prompt)
+                return run.messages[-1].content[0].text.value
+
+            check = None
+            if check_command:
+                def check():
+                    return subprocess.run(check_command, shell=True).returncode == 0
+            elif check_tests:
+                runner = TestRunner(state=self._toolshop_state)
+
+                def check():
+                    # Tests that still fail because of earlier changes are not run again
+                    return all(r.passed for r in runner.run().results)
+
+            controller = ReflectionController(
+                self._toolshop_state,
+                max_iterations=max_reflections,
+                time_budget=reflection_time_budget,
+                check=check,
+            )
+            controller.run(say)
+            return controller.passes
 
 
     # for better type hinting
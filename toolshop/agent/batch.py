@@ -0,0 +1,161 @@
+"""Runs many independent `ts do` tasks concurrently.
+
+Tasks are read from a JSONL file, one JSON object per line:
+
+    {"id": "fix-readme", "instructions": "Fix the typos in README.md", "source": "~/repos/app"}
+
+`instructions` is required. `id` defaults to the line number. When `source`
+is given, the directory is copied into the task's working directory first.
+
+Each task runs in its own working directory with its own `Agent` and `State`,
+in a pool of worker processes that are reused between tasks, so imports and
+client setup are paid once per worker rather than once per task. A result
+line is appended to the output file as soon as each task finishes.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+
+
+def read_tasks(path: str) -> list:
+    tasks = []
+    with open(os.path.expanduser(path), "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            task = json.loads(line)
+            if "instructions" not in task:
+                raise ValueError(f"Task on line {line_number} of {path} has no 'instructions'.")
+            task.setdefault("id", str(line_number))
+            tasks.append(task)
+
+    # Ids name the working directories, so 1 and "1" are the same id
+    ids = [str(task["id"]) for task in tasks]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Task ids in {path} must be unique.")
+
+    return tasks
+
+
+def task_workdir(workdir_root: str, task_id) -> str:
+    """The working directory of the task with `task_id` under `workdir_root`.
+    Raises ValueError for ids that are not a single path component, since
+    they would make the task run outside of `workdir_root`."""
+    name = str(task_id)
+    if (
+        name in ("", ".", "..")
+        or os.sep in name
+        or (os.altsep and os.altsep in name)
+        or "\0" in name
+    ):
+        raise ValueError(f"Invalid task id {name!r}: ids are used as directory names and cannot contain path separators.")
+
+    workdir = os.path.abspath(os.path.join(workdir_root, name))
+    if os.path.commonpath([workdir, workdir_root]) != workdir_root or workdir == workdir_root:
+        raise ValueError(f"Invalid task id {name!r}: its directory is outside of {workdir_root}.")
+    return workdir
+
+
+def run_agent_task(task: dict, options: dict):
+    """Runs a task with an `Agent` in the current directory and returns the
+    metrics of its reflection passes."""
+    from toolshop.agent.agent import Agent
+    from toolshop.core.confirmation import ChainPolicy, DenyPolicy, RulesPolicy
+
+    # Nobody can answer a prompt in a batch, so calls that are not
+    # pre-approved are denied
+    policies = []
+    if options.get("rules"):
+        policies.append(RulesPolicy.from_file(options["rules"]))
+    if options.get("allow"):
+        policies.append(RulesPolicy(allow=options["allow"]))
+    policies.append(DenyPolicy())
+
+    agent = Agent(coder_is_interactive=False, confirmation_policy=ChainPolicy(policies))
+
+    max_reflections = task.get("max_reflections", options.get("max_reflections", 3))
+    passes = agent.do(
+        task["instructions"],
+        use_reflection=max_reflections > 0,
+        max_reflections=max_reflections,
+        reflection_time_budget=options.get("reflection_time_budget", 600),
+    )
+    return [p._asdict() for p in passes or []]
+
+
+def _run_task(task: dict, workdir: str, options: dict, runner) -> dict:
+    "Runs a single task. Called in a worker process."
+    result = {"id": task["id"], "workdir": workdir, "pid": os.getpid()}
+    start = time.monotonic()
+    cwd = os.getcwd()
+
+    try:
+        if task.get("source"):
+            shutil.copytree(os.path.expanduser(task["source"]), workdir, symlinks=True, dirs_exist_ok=True)
+        else:
+            os.makedirs(workdir, exist_ok=True)
+
+        os.chdir(workdir)
+        result["output"] = runner(task, options)
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+
+    result["duration_s"] = time.monotonic() - start
+    return result
+
+
+def run_batch(
+    tasks: list,
+    output_path: str,
+    workdir_root: str,
+    workers: int = 4,
+    options: dict = None,
+    runner=run_agent_task,
+):
+    """Runs `tasks` in `workers` processes and yields each result as it is
+    written to `output_path`.
+
+    Args:
+        tasks (list[dict]): Tasks as returned by `read_tasks`.
+        output_path (str): JSONL file the results are appended to.
+        workdir_root (str): Each task runs in `<workdir_root>/<task id>`.
+        workers (int): Number of tasks to run at the same time.
+        options (dict, optional): Options passed to `runner`, e.g. `allow`,
+            `rules` and `max_reflections`.
+        runner (callable, optional): Runs a task in its working directory.
+            Must be picklable. Defaults to running an `Agent`.
+    """
+    options = options or {}
+    workdir_root = os.path.abspath(os.path.expanduser(workdir_root))
+    # Checked before any task runs
+    workdirs = [task_workdir(workdir_root, task["id"]) for task in tasks]
+    duplicates = sorted({w for w in workdirs if workdirs.count(w) > 1})
+    if duplicates:
+        raise ValueError(
+            f"Task ids must be unique once used as directory names: {', '.join(map(os.path.basename, duplicates))}"
+        )
+
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor, \
+            open(output_path, "a") as output:
+        futures = [
+            executor.submit(_run_task, task, workdir, options, runner)
+            for task, workdir in zip(tasks, workdirs)
+        ]
+
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            output.write(json.dumps(result, default=str) + "\n")
+            output.flush()
+            yield result
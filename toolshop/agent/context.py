@@ -0,0 +1,163 @@
+"""Loads the user's context files into the agent's instructions.
+
+The instructions are sent with every run, so context is only inlined when it
+fits within a token budget. Larger context is written to a reference file
+with a table of contents, and the instructions tell the agent to read the
+parts it needs with `read_file` or query it with `search_code`.
+"""
+
+import glob
+import hashlib
+import os
+import re
+from typing import NamedTuple, Optional
+
+from toolshop.core.budget import estimate_tokens
+from toolshop.core.cache import cache_dir, cache_key, load_pickle, save_pickle
+from toolshop.core.logging import logger
+
+
+DEFAULT_CONTEXT_BUDGET_TOKENS = 4000
+
+# Context files larger than this are most likely not meant as context
+MAX_CONTEXT_FILE_SIZE = 4 * 1024 * 1024
+
+# Changes whenever the processing of the context changes, so that contexts
+# cached on disk are processed again
+CONTEXT_FORMAT_VERSION = 2
+
+
+class ContextFile(NamedTuple):
+    path: str
+    digest: str
+    text: str
+
+
+class LoadedContext(NamedTuple):
+    # Text to include in the instructions
+    text: str
+    # The file holding the full context when it is too large to inline
+    reference_path: Optional[str]
+    files: list
+
+
+def expand_context_paths(paths) -> list:
+    """Expands files, directories and glob patterns into a list of files,
+    without duplicates. Hidden files and directories are skipped when
+    expanding directories."""
+    if isinstance(paths, str):
+        paths = [paths]
+
+    files = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if glob.has_magic(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                raise FileNotFoundError(f'No files match the context pattern "{path}"')
+        elif os.path.exists(path):
+            matches = [path]
+        else:
+            raise FileNotFoundError(f'The context file "{path}" does not exist')
+
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                    files += [os.path.join(root, n) for n in sorted(names) if not n.startswith(".")]
+            else:
+                files.append(match)
+
+    seen = set()
+    unique = []
+    for path in files:
+        real_path = os.path.realpath(path)
+        if real_path not in seen:
+            seen.add(real_path)
+            unique.append(path)
+
+    return unique
+
+
+def _read_context_file(path: str) -> Optional[ContextFile]:
+    if os.path.getsize(path) > MAX_CONTEXT_FILE_SIZE:
+        logger.warning(f"Skipping context file {path}: larger than {MAX_CONTEXT_FILE_SIZE} bytes.")
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if b"\0" in data[:8192]:
+        logger.warning(f"Skipping binary context file {path}.")
+        return None
+
+    return ContextFile(path, hashlib.blake2b(data, digest_size=16).hexdigest(), data.decode("utf-8", errors="replace"))
+
+
+def _clean(text: str) -> str:
+    """Collapses runs of blank lines. Other whitespace is kept, since it can
+    be meaningful, e.g. in markdown line breaks or code."""
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip("\n") + "\n"
+
+
+def load_context(paths, budget_tokens: int = DEFAULT_CONTEXT_BUDGET_TOKENS) -> LoadedContext:
+    """Loads context files, directories or glob patterns.
+
+    Files with identical contents are included once. The processed context is
+    cached on disk, keyed by the contents of the files and the budget.
+
+    Args:
+        paths (str | list[str]): Files, directories or glob patterns.
+        budget_tokens (int): Context larger than this is not inlined.
+    """
+    files = []
+    seen_digests = set()
+    for path in expand_context_paths(paths):
+        context_file = _read_context_file(path)
+        if context_file and context_file.digest not in seen_digests:
+            seen_digests.add(context_file.digest)
+            files.append(context_file)
+
+    key = cache_key(CONTEXT_FORMAT_VERSION, budget_tokens, *((f.path, f.digest) for f in files))
+    cache_path = os.path.join(cache_dir("context"), f"{key}.pickle")
+    cached = load_pickle(cache_path)
+    if cached is not None and (cached.reference_path is None or os.path.exists(cached.reference_path)):
+        return cached
+
+    sections = [(f.path, _clean(f.text)) for f in files]
+
+    if len(sections) == 1:
+        inline_text = sections[0][1]
+    else:
+        inline_text = "".join(f"===== File: {path} =====\n{text}\n" for path, text in sections)
+
+    if estimate_tokens(inline_text) <= budget_tokens:
+        loaded = LoadedContext(inline_text, None, [f.path for f in files])
+    else:
+        loaded = _make_reference(key, sections, [f.path for f in files])
+
+    save_pickle(cache_path, loaded)
+    return loaded
+
+
+def _make_reference(key: str, sections: list, paths: list) -> LoadedContext:
+    reference_path = os.path.join(cache_dir("context", "reference"), f"{key}.txt")
+
+    table_of_contents = []
+    line = 1
+    with open(reference_path, "w") as f:
+        for path, text in sections:
+            header = f"===== File: {path} =====\n"
+            n_lines = text.count("\n")
+            f.write(header + text)
+            table_of_contents.append(f"- {path}: lines {line + 1}-{line + n_lines}")
+            line += n_lines + 1
+
+    text = (
+        f"The context is too large to include here. It was written to {reference_path}.\n"
+        f"Read the parts you need with `read_file` and the line ranges below, or "
+        f"find them with `search_code(query, path=\"{os.path.dirname(reference_path)}\")`.\n\n"
+        + "\n".join(table_of_contents) + "\n"
+    )
+    return LoadedContext(text, reference_path, paths)
@@ -15,9 +15,27 @@ TOOL_INSTRUCTIONS = """
 # Tools 
 Tool calls that modify files should be made one at a time, sequentially not in
 paralllel. Make file changes one at a time, instead of issuing multiple file
-changes as once. Always read files after modifying them to ensure that the
-modification is correct and to confirm the line numbers for the next
-modification.
+changes as once. The tools that modify files return a diff of the change with
+the new line numbers around it. Check the diff to ensure that the modification
+is correct and use its line numbers for the next modification, instead of
+reading the file again.
+
+To find code in Python files, use `find_symbol` and `outline` to get the line
+ranges of classes and functions, then read only those lines, instead of reading
+whole files or directories. When you need several files, read them with a
+single `read_files` call instead of one `read_file` call per file. To locate
+files by name, size or modification time, use `find_files` instead of `find`
+or `read_directory`.
+
+Before a risky change, create a `checkpoint`. To revert edits made with the
+file tools, use `undo` instead of git or rewriting the files.
+
+Run commands that take long, like test suites, builds and servers, with
+`start_job` instead of `shell`, and keep working while they run. Check on them
+with `poll_job`.
+
+To check a change, run the tests with `run_tests` instead of running pytest in
+the shell. It runs only the tests affected by your changes.
 """
 
 COLLABORATION_INSTRUCTIONS_INTERACTIVE = """
@@ -0,0 +1,151 @@
+"""Bounded reflection passes after the agent completes a task.
+
+After a non-interactive task, the agent is asked to re-read the files it
+modified and fix any issues. Each pass is a full model turn, so the passes are
+bounded by an iteration cap and a wall-clock budget, and they stop as soon as
+a pass makes no edits.
+
+A checkpoint is created in the edit journal before each pass. When a `check`
+is given, e.g. running the tests, a pass whose edits fail it is undone.
+"""
+
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+from toolshop.core.base import State
+from toolshop.core.logging import logger
+
+
+REFLECTION_PROMPT = (
+    "Re-read the files you have modified and fix any issues. If "
+    "you had to fix any issues, respond 'made fixes'."
+)
+
+DEFAULT_MAX_REFLECTIONS = 3
+DEFAULT_REFLECTION_TIME_BUDGET = 600.0
+
+
+class ReflectionPass(NamedTuple):
+    iteration: int
+    duration_s: float
+    files_updated: list
+    reported_fixes: bool
+    # The edit journal checkpoint created before the pass
+    checkpoint: Optional[str] = None
+    # Whether the edits of the pass failed the check and were undone
+    rolled_back: bool = False
+
+
+class ReflectionController:
+    """Runs reflection passes until one of these happens:
+
+    - the agent does not report fixes;
+    - a pass makes no edits through the file tools, as recorded in `state`;
+    - the edits of a pass fail `check`, in which case they are undone;
+    - `max_iterations` passes have run;
+    - `time_budget` seconds have passed since the controller started;
+    - `cancel()` is called, or the user presses Ctrl-C.
+
+    The budget is checked between passes, so a pass that is already running
+    is allowed to finish.
+    """
+
+    def __init__(
+        self,
+        state: State,
+        max_iterations: int = DEFAULT_MAX_REFLECTIONS,
+        time_budget: Optional[float] = DEFAULT_REFLECTION_TIME_BUDGET,
+        prompt: str = REFLECTION_PROMPT,
+        check: Optional[Callable[[], bool]] = None,
+    ):
+        self.state = state
+        self.max_iterations = max_iterations
+        self.time_budget = time_budget
+        self.prompt = prompt
+        self.check = check
+        self.passes = []
+        self.stop_reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _updated_since(self, version: int) -> list:
+        return sorted(path for path, v in self.state.file_updated_at.items() if v > version)
+
+    def run(self, say: Callable[[str], str]) -> list:
+        """Runs the passes and returns their metrics. The first pass always
+        runs, since the task may have changed files outside of the file
+        tools, e.g. with shell commands.
+
+        Args:
+            say (Callable[[str], str]): Sends a message to the agent and returns its reply.
+        """
+        start = time.monotonic()
+
+        try:
+            self.stop_reason = self._run(say, start)
+        except KeyboardInterrupt:
+            self.stop_reason = "interrupted"
+
+        total = time.monotonic() - start
+        logger.info(
+            f"Reflection stopped after {len(self.passes)} pass(es) in {total:.1f}s: {self.stop_reason}."
+        )
+        return self.passes
+
+    def _run(self, say, start) -> str:
+        for iteration in range(1, self.max_iterations + 1):
+            if self._cancelled.is_set():
+                return "cancelled"
+
+            if self.time_budget is not None and time.monotonic() - start >= self.time_budget:
+                return f"time budget of {self.time_budget}s exhausted"
+
+            version = self.state.version
+            checkpoint = self.state.journal.checkpoint(f"reflection-{iteration}")
+            pass_start = time.monotonic()
+            reply = say(self.prompt) or ""
+
+            files_updated = self._updated_since(version)
+            failed_check = bool(files_updated) and self.check is not None and not self.check()
+            rolled_back = False
+            if failed_check:
+                try:
+                    self._undo(checkpoint)
+                    rolled_back = True
+                except ValueError as e:
+                    logger.warning(f"Could not undo reflection pass {iteration}: {e}")
+
+            reflection_pass = ReflectionPass(
+                iteration=iteration,
+                duration_s=time.monotonic() - pass_start,
+                files_updated=files_updated,
+                reported_fixes="made fixes" in reply.lower(),
+                checkpoint=checkpoint,
+                rolled_back=rolled_back,
+            )
+            self.passes.append(reflection_pass)
+            logger.info(
+                f"Reflection pass {iteration}: {reflection_pass.duration_s:.1f}s, "
+                f"{len(reflection_pass.files_updated)} file(s) updated, "
+                f"reported fixes: {reflection_pass.reported_fixes}"
+            )
+
+            if failed_check:
+                if rolled_back:
+                    return f"pass {iteration} failed the check, so its edits were undone"
+                return f"pass {iteration} failed the check and could not be undone"
+            if not reflection_pass.reported_fixes:
+                return "no fixes reported"
+            if not reflection_pass.files_updated:
+                return "no files were modified"
+
+        return f"reached {self.max_iterations} passes"
+
+    def _undo(self, checkpoint: str):
+        restored = self.state.journal.undo(checkpoint, cache=self.state.file_cache)
+        for path in restored:
+            self.state.record_file_update(path)
+        logger.info(f"Undid the edits to {len(restored)} file(s) since {checkpoint}.")
@@ -1,5 +1,8 @@
 import click
 from toolshop.agent.agent import Agent
+from toolshop.core.trace import configure_tracing
+from toolshop.core.profiling import configure_profiling
+from toolshop.core.confirmation import ChainPolicy, PromptPolicy, RulesPolicy
 
 @click.group()
 @click.pass_context
@@ -8,16 +11,222 @@ def toolshop(ctx):
     if ctx.invoked_subcommand is None:
         click.echo("Welcome to Toolshop!")
 
+def confirmation_options(confirm_timeout=None):
+    """Options that configure how tool calls requiring confirmation are approved."""
+    def decorator(f):
+        f = click.option('--allow', multiple=True,
+                         help='Pre-approve calls to this tool (wildcards allowed). Can be repeated.')(f)
+        f = click.option('--rules', default=None,
+                         help='Path to a file of allow/deny confirmation rules')(f)
+        f = click.option('--confirm-timeout', type=float, default=confirm_timeout,
+                         help='Deny confirmations that are not answered within this many seconds')(f)
+        return f
+    return decorator
+
+def profiling_options(f):
+    """Options that enable profiling of tool calls."""
+    f = click.option('--profile-tools', multiple=True,
+                     help='Profile every call to this tool, or "all". Can be repeated.')(f)
+    f = click.option('--profile-sample-rate', type=float, default=0.0,
+                     help='Profile this fraction of the calls to other tools')(f)
+    f = click.option('--profile-dir', default='ts-profiles',
+                     help='Directory to write the profiles of tool calls to')(f)
+    f = click.option('--profile-memory/--no-profile-memory', default=True,
+                     help='Whether profiles include memory allocations')(f)
+    return f
+
+def start_profiling(profile_tools=(), profile_sample_rate=0.0, profile_dir='ts-profiles', profile_memory=True):
+    configure_profiling(
+        profile_dir if profile_tools or profile_sample_rate > 0 else None,
+        tools=profile_tools,
+        sample_rate=profile_sample_rate,
+        memory=profile_memory
+    )
+
+def make_confirmation_policy(allow=(), rules=None, confirm_timeout=None):
+    policies = []
+    if rules:
+        policies.append(RulesPolicy.from_file(rules))
+    if allow:
+        policies.append(RulesPolicy(allow=allow))
+    policies.append(PromptPolicy(timeout=confirm_timeout))
+    return ChainPolicy(policies)
+
 @toolshop.command()
-@click.option('--context', help='Path to context file', default=None)
-def chat(context: str = None):
+@click.option('--context', multiple=True,
+              help='Context file, directory or glob pattern. Can be repeated.')
+@click.option('--trace', help='Write a JSONL trace of tool calls to this file', default=None)
+@click.option('--watch', is_flag=True, help='Watch the working directory for changes made outside of the tools')
+@confirmation_options()
+@profiling_options
+def chat(context=(), trace: str = None, watch: bool = False, allow=(), rules=None, confirm_timeout=None, **profiling):
     """Start the chat with Agent."""
-    app = Agent(coder_is_interactive=True, context_path=context)
+    configure_tracing(trace)
+    start_profiling(**profiling)
+    app = Agent(
+        coder_is_interactive=True,
+        context_path=list(context),
+        confirmation_policy=make_confirmation_policy(allow, rules, confirm_timeout),
+        watch_files=watch
+    )
     app.chat()
 
 @toolshop.command()
 @click.argument('instructions')
-def do(instructions: str):
+@click.option('--trace', help='Write a JSONL trace of tool calls to this file', default=None)
+@click.option('--watch', is_flag=True, help='Watch the working directory for changes made outside of the tools')
+@confirmation_options(confirm_timeout=60)
+@click.option('--max-reflections', default=3, help='Maximum number of passes to review and fix the changes')
+@click.option('--reflection-time-budget', type=float, default=600, help='Stop reviewing the changes after this many seconds')
+@click.option('--check', default=None, help='Shell command, e.g. the tests, that must pass after each review. Failing reviews are undone.')
+@click.option('--check-tests', is_flag=True, default=False, help='Run the tests affected by each review, and undo the reviews that fail them.')
+@profiling_options
+def do(
+    instructions: str,
+    trace: str = None,
+    watch: bool = False,
+    allow=(),
+    rules=None,
+    confirm_timeout=None,
+    max_reflections: int = 3,
+    reflection_time_budget: float = 600,
+    check: str = None,
+    check_tests: bool = False,
+    **profiling
+):
     """Send instructions for Agent to execute non-interactively."""
-    app = Agent(coder_is_interactive=False)
-    app.do(instructions)
+    configure_tracing(trace)
+    start_profiling(**profiling)
+    app = Agent(
+        coder_is_interactive=False,
+        confirmation_policy=make_confirmation_policy(allow, rules, confirm_timeout),
+        watch_files=watch
+    )
+    app.do(
+        instructions,
+        use_reflection=max_reflections > 0,
+        max_reflections=max_reflections,
+        reflection_time_budget=reflection_time_budget,
+        check_command=check,
+        check_tests=check_tests,
+    )
+
+@toolshop.command()
+@click.argument('tasks_file')
+@click.option('--output', '-o', required=True, help='JSONL file to append the results to')
+@click.option('--workers', '-j', default=4, help='Number of tasks to run at the same time')
+@click.option('--workdir', default='ts-batch', help='Each task runs in a directory named after its id under this directory')
+@click.option('--allow', multiple=True,
+              help='Pre-approve calls to this tool (wildcards allowed). Can be repeated.')
+@click.option('--rules', default=None, help='Path to a file of allow/deny confirmation rules')
+@click.option('--max-reflections', default=3, help='Maximum number of passes to review and fix the changes')
+@click.option('--reflection-time-budget', type=float, default=600, help='Stop reviewing the changes after this many seconds')
+def batch(
+    tasks_file: str,
+    output: str,
+    workers: int = 4,
+    workdir: str = 'ts-batch',
+    allow=(),
+    rules=None,
+    max_reflections: int = 3,
+    reflection_time_budget: float = 600
+):
+    """Run the tasks in a JSONL file concurrently, each in its own directory."""
+    from toolshop.agent.batch import read_tasks, run_batch
+
+    tasks = read_tasks(tasks_file)
+    options = dict(
+        allow=list(allow),
+        rules=rules,
+        max_reflections=max_reflections,
+        reflection_time_budget=reflection_time_budget
+    )
+
+    failed = 0
+    for i, result in enumerate(run_batch(tasks, output, workdir, workers=workers, options=options), start=1):
+        failed += result["status"] != "ok"
+        message = f"[{i}/{len(tasks)}] {result['id']}: {result['status']} in {result['duration_s']:.1f}s"
+        if result["status"] != "ok":
+            message += f" ({result['error']})"
+        click.echo(message)
+
+    if failed:
+        raise click.ClickException(f"{failed} of {len(tasks)} tasks failed.")
+
+@toolshop.command()
+@click.argument('trace_files', nargs=-1, required=True)
+@click.option('--repeat', help='Run each call this many times and keep the fastest', default=1)
+@click.option('--skip', help='Name of a tool to skip. Can be repeated.', multiple=True)
+@click.option('--threshold', type=float, default=None,
+              help='Fail if total replay time exceeds the recorded time by more than this fraction')
+@click.option('--allow-side-effects', is_flag=True, default=False,
+              help='Also replay calls that change files, databases or processes, e.g. edits and shell commands')
+def replay(trace_files, repeat: int = 1, skip=(), threshold: float = None, allow_side_effects: bool = False):
+    """Re-execute a recorded tool trace and compare timings."""
+    from toolshop.core.trace import read_trace, replay_trace
+    from toolshop.tools.misc import all_tools
+
+    records = [r for r in read_trace(*trace_files) if r["tool"] not in skip]
+    tools = all_tools(framework=None)
+
+    totals = {}
+    mismatches = 0
+    for outcome in replay_trace(records, tools, repeat=repeat, allow_side_effects=allow_side_effects):
+        if outcome["skipped"]:
+            click.echo(f"#{outcome['seq']:<5} {outcome['tool']:<24} skipped: {outcome['skipped']}")
+            continue
+
+        status = "error" if outcome["error"] else {True: "same", False: "changed", None: "-"}[outcome["result_match"]]
+        mismatches += outcome["result_match"] is False
+        click.echo(
+            f"#{outcome['seq']:<5} {outcome['tool']:<24} "
+            f"recorded {outcome['recorded_ms']:>10.2f} ms  "
+            f"current {outcome['current_ms']:>10.2f} ms  {status}"
+        )
+
+        recorded, current = totals.get(outcome["tool"], (0.0, 0.0))
+        totals[outcome["tool"]] = (recorded + (outcome["recorded_ms"] or 0), current + outcome["current_ms"])
+
+    click.echo("")
+    for name, (recorded, current) in sorted(totals.items()):
+        click.echo(f"{name:<24} recorded {recorded:>10.2f} ms  current {current:>10.2f} ms")
+
+    recorded_total = sum(r for r, _ in totals.values())
+    current_total = sum(c for _, c in totals.values())
+    click.echo(f"{'total':<24} recorded {recorded_total:>10.2f} ms  current {current_total:>10.2f} ms")
+    if mismatches:
+        click.echo(f"{mismatches} call(s) returned a different result than recorded.")
+
+    if threshold is not None and current_total > recorded_total * (1 + threshold):
+        raise click.ClickException(
+            f"Replay took {current_total:.2f} ms, more than {threshold:.0%} over the recorded {recorded_total:.2f} ms."
+        )
+
+@toolshop.command()
+@click.argument('benchmarks', nargs=-1)
+@click.option('--scale', type=float, default=0.01, help='Workload size relative to the full (million-line) workloads')
+@click.option('--repeat', default=5, help='Number of timed runs per benchmark')
+@click.option('--baseline', default=None, help='Compare against the baseline in this file and fail on regressions')
+@click.option('--save-baseline', default=None, help='Save the results as a baseline to this file')
+@click.option('--tolerance', type=float, default=0.2, help='Allowed slowdown relative to the baseline')
+def bench(benchmarks, scale: float, repeat: int, baseline: str = None, save_baseline: str = None, tolerance: float = 0.2):
+    """Benchmark the built-in tools on synthetic workloads."""
+    from toolshop.core import bench as toolshop_bench
+
+    results = []
+    click.echo(f"{'benchmark':<20} {'p50 ms':>10} {'p95 ms':>10} {'items/s':>12} {'alloc KB':>10} {'RSS KB':>10}")
+    for r in toolshop_bench.run_benchmarks(list(benchmarks), scale=scale, repeat=repeat):
+        results.append(r)
+        click.echo(
+            f"{r['name']:<20} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} "
+            f"{r['items_per_s'] or 0:>12.0f} {r['peak_alloc_kb']:>10.0f} {r['peak_rss_kb']:>10.0f}"
+        )
+
+    if save_baseline:
+        toolshop_bench.save_baseline(results, save_baseline)
+
+    if baseline:
+        regressions = toolshop_bench.compare_to_baseline(results, baseline, tolerance=tolerance)
+        if regressions:
+            raise click.ClickException("Performance regressions:\n" + "\n".join(regressions))
+        click.echo("No regressions against the baseline.")
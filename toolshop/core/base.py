@@ -1,12 +1,23 @@
 from pydantic import BaseModel
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Iterator, NamedTuple
 from textwrap import dedent
-import datetime
+import asyncio
+import hashlib
+import os
+import threading
 
 import re
 
 from toolshop.core.logging import logger
+from toolshop.core.confirmation import ConfirmationRequest, default_confirmation_policy
+from toolshop.core.trace import tracing_enabled, ToolCallTrace
+from toolshop.core.profiling import profiling_enabled, profiled, profiled_async
+from toolshop.core.budget import ResultBudget
+from toolshop.core.dedup import ResultStore
+from toolshop.core.filecache import FileCache, DEFAULT_FILE_CACHE_BYTES
+from toolshop.core.journal import EditJournal
+from toolshop.core.watcher import make_watcher, DEFAULT_POLL_INTERVAL
 
 
 class Parameter(BaseModel):
@@ -50,8 +61,20 @@ class Documentation(BaseModel):
         return doc
 
 
+RESULT_TO_FILE_BUFFER_SIZE = 1024 * 1024
+
+
+def _is_stream(result) -> bool:
+    "Whether a tool returned its result as an iterator of chunks."
+    return isinstance(result, Iterator)
+
+
 class Tool(ABC):
-    def __init__(self, state = None, require_confirmation: bool = None):
+    # Limit on the size of results returned to the agent. Tools override this
+    # with a strategy that suits their output.
+    _result_budget = ResultBudget()
+
+    def __init__(self, state = None, require_confirmation: bool = None, result_budget: ResultBudget = None):
         self.__name__ = self._camel_to_snake(self.__class__.__name__)
         self._state = state
         
@@ -60,6 +83,9 @@ class Tool(ABC):
         
         if require_confirmation is not None:
             self.require_confirmation = require_confirmation
+
+        if result_budget is not None:
+            self._result_budget = result_budget
         
         if self.call.__doc__:
             self.__doc__ = self.call.__doc__  
@@ -104,6 +130,16 @@ class Tool(ABC):
         else:
             return True
     
+    def result_budget(self) -> ResultBudget:
+        return self._result_budget
+
+    def deduplicates_results(self) -> bool:
+        "Whether results the agent has already seen are replaced by a reference or a diff."
+        if hasattr(self, "_deduplicate_results"):
+            return self._deduplicate_results
+        else:
+            return True
+
     def log_header(self):
         logger.info(f"=== {self.__name__}() ===")
 
@@ -129,78 +165,434 @@ class Tool(ABC):
     def post_call_hook(self):
         pass
 
+    def needs_confirmation(self):
+        return hasattr(self, 'require_confirmation') and self.require_confirmation
+
+    def confirmation_policy(self):
+        return self.state.get_confirmation_policy() or default_confirmation_policy()
+
+    def confirmation_request(self, *args, **kwargs):
+        return ConfirmationRequest(self.__name__, args, kwargs)
+
+    def raise_if_denied(self, allowed: bool):
+        if not allowed:
+            raise Exception(f"Request to run {self.__name__} was denied.")
+
+    def confirm(self, *args, **kwargs):
+        "Asks the confirmation policy to allow this call if the tool requires confirmation. Raises if denied."
+        if self.needs_confirmation():
+            request = self.confirmation_request(*args, **kwargs)
+            self.raise_if_denied(self.confirmation_policy().confirm(request))
+
+    async def confirm_async(self, *args, **kwargs):
+        "Async counterpart of `confirm` that does not block the event loop."
+        if self.needs_confirmation():
+            request = self.confirmation_request(*args, **kwargs)
+            self.raise_if_denied(await self.confirmation_policy().confirm_async(request))
+
+    def runs_exclusively(self):
+        "Whether calls to this tool must not overlap with any other tool call."
+        if hasattr(self, "_run_exclusively"):
+            return self._run_exclusively
+        else:
+            return False
+
+    def has_side_effects(self) -> bool:
+        """Whether calls change files, databases or processes, so that they
+        must not be repeated, e.g. when replaying a trace. Defaults to tools
+        that run exclusively or require confirmation."""
+        if hasattr(self, "_has_side_effects"):
+            return self._has_side_effects
+        else:
+            return self.runs_exclusively() or self.needs_confirmation()
+
+    def concurrency_key(self, *args, **kwargs):
+        """Calls that return the same key are never run concurrently with each
+        other. None means the call is independent of other calls."""
+        return None
+
+    def concurrency_keys(self, *args, **kwargs) -> list:
+        """All the keys of a call, for tools whose calls touch several
+        resources, e.g. several files. Defaults to `concurrency_key`."""
+        key = self.concurrency_key(*args, **kwargs)
+        return [] if key is None else [key]
+
     def __call__(self, *args, **kwargs):
+        return self._call(args, kwargs)
+
+    def _call(self, args, kwargs, confirmed=False):
         self.log_header()
         self.log_params(*args, **kwargs)
 
-        if hasattr(self, 'require_confirmation') and self.require_confirmation:
-            confirmation = input(f"Do you want to allow agent to run {self.__name__}?  Type 'yes' to allow: ")
-            if confirmation != "yes":
-                raise Exception(f"Request to run {self.__name__} was denied by the user.")
+        if not confirmed:
+            self.confirm(*args, **kwargs)
+
+        run = self._run
+        if profiling_enabled():
+            run = profiled(self, run)
+
+        if not tracing_enabled():
+            return run(*args, **kwargs)
+
+        trace = ToolCallTrace(self, args, kwargs)
+        try:
+            result = run(*args, **kwargs)
+        except Exception as e:
+            trace.finish(error=e)
+            raise
+
+        trace.finish(result)
+        return result
+
+    def _run(self, *args, **kwargs):
+        return self._deduplicate(self._handle_result(self.call(*args, **kwargs)), args, kwargs)
+
+    def _deduplicate(self, result, args, kwargs):
+        if not isinstance(self._state, State) or self._state.results is None or not self.deduplicates_results():
+            return result
+        return self._state.results.deduplicate(self.__name__, args, kwargs, result)
+
+    async def acall(self, *args, **kwargs):
+        """Async implementation of `call`. Override this in tools that can do
+        their I/O natively with asyncio. By default, `call` is run in a worker
+        thread."""
+        return await asyncio.to_thread(self.call, *args, **kwargs)
+
+    async def call_async(self, *args, **kwargs):
+        "Async counterpart of `__call__`."
+        return await self._call_async(args, kwargs)
+
+    async def _call_async(self, args, kwargs, confirmed=False):
+        if not confirmed:
+            await self.confirm_async(*args, **kwargs)
+
+        # Tools without a native `acall` run their whole synchronous call in a
+        # worker thread, so blocking I/O never stalls the event loop.
+        if type(self).acall is Tool.acall:
+            return await asyncio.to_thread(self._call, args, kwargs, True)
+
+        self.log_header()
+        self.log_params(*args, **kwargs)
+
+        run = self._arun
+        if profiling_enabled():
+            run = profiled_async(self, run)
+
+        if not tracing_enabled():
+            return await run(*args, **kwargs)
+
+        trace = ToolCallTrace(self, args, kwargs)
+        try:
+            result = await run(*args, **kwargs)
+        except Exception as e:
+            trace.finish(error=e)
+            raise
+
+        trace.finish(result)
+        return result
+
+    async def _arun(self, *args, **kwargs):
+        return self._deduplicate(self._handle_result(await self.acall(*args, **kwargs)), args, kwargs)
+
+    def _handle_result(self, result):
+        result_to_file = self.state.get_result_to_file()
+        if result_to_file:
+            result = self.write_result_to_file(result, result_to_file)
+            self.state.disable_result_to_file()
+        else:
+            if _is_stream(result):
+                result = "".join(str(chunk) for chunk in result)
+            result = self.result_budget().apply(result, self.__name__)
 
-        result = self.call(*args, **kwargs)
         self.log_result(result)
         self.log_footer(result)
-    
-        if self.state.get_result_to_file():
-            with open(self.state.get_result_to_file(), 'w') as f:
-                f.write(str(result))
-            
-            self.state.disable_result_to_file()
         
         self.post_call_hook()
 
         if self.return_result_to_agent():
             return result
 
-    def get_partial(self):
+    def write_result_to_file(self, result, path: str) -> str:
+        """Writes the result to `path` and returns a short summary for the agent.
+        Results yielded in chunks are streamed to disk, so they are never held
+        in memory in full."""
+        chunks = result if _is_stream(result) else [result]
+
+        n_chars = 0
+        n_lines = 0
+        with open(path, 'w', buffering=RESULT_TO_FILE_BUFFER_SIZE) as f:
+            for chunk in chunks:
+                chunk = str(chunk)
+                f.write(chunk)
+                n_chars += len(chunk)
+                n_lines += chunk.count("\n")
+
+        return f"Wrote the output of {self.__name__} to {path} ({n_chars} characters, {n_lines} lines)."
+
+    def get_partial(self, use_async: bool = False):
         import inspect
 
         # Create a new function that wraps 'self.__call__' following the exact signature of 'call'
-        def partial_func(*args, **kwargs):
-            return self.__call__(*args, **kwargs)
+        if use_async:
+            async def partial_func(*args, **kwargs):
+                return await self.call_async(*args, **kwargs)
+        else:
+            def partial_func(*args, **kwargs):
+                return self.__call__(*args, **kwargs)
+
+        signature = inspect.signature(self.call)
+        annotations = dict(self.call.__annotations__)
 
-        partial_func.__signature__ = inspect.signature(self.call)
+        # Tools that yield their result in chunks still return a string to the agent
+        if inspect.isgeneratorfunction(self.call):
+            signature = signature.replace(return_annotation=str)
+            annotations["return"] = str
+
+        partial_func.__signature__ = signature
         partial_func.__doc__ = self.call.__doc__
-        partial_func.__annotations__ = self.call.__annotations__
+        partial_func.__annotations__ = annotations
         partial_func.__name__ = self.__name__
 
         return partial_func
 
-    def to_marvin(self):
-        return self.get_partial()
+    def to_marvin(self, use_async: bool = False):
+        return self.get_partial(use_async=use_async)
+
+
+class FileFingerprint(NamedTuple):
+    size: int
+    mtime_ns: int
+    digest: Optional[str] = None
 
 
 class State:
-    def __init__(self):
+    """State shared by a set of tools.
+
+    File reads and updates are stamped with a monotonically increasing
+    version number rather than a timestamp, so ordering checks are integer
+    compares that cannot be confused by clock resolution or clock changes.
+    A fingerprint of each file is kept alongside its version to detect edits
+    made outside of the tools. `file_cache` holds the contents of the files
+    the tools read and write, so an edit does not re-read what was just read.
+
+    With `watch`, a watcher reports changes made outside of the tools, e.g.
+    by shell commands, as they happen. They are stamped with versions too, so
+    caches can ask which paths changed instead of stat-ing every file.
+
+    `journal` records the edits made through the file tools, so they can be
+    undone.
+
+    With `dedup_results`, `results` holds the results returned to the agent,
+    so that repeated results are not sent again. Only enable it when the
+    agent keeps earlier results in its conversation.
+    """
+
+    __slots__ = (
+        "file_read_at",
+        "file_updated_at",
+        "coder_confirms",
+        "hash_contents",
+        "file_cache",
+        "results",
+        "journal",
+        "_version",
+        "_fingerprints",
+        "_result_to_file",
+        "_confirmation_policy",
+        "_watcher",
+        "_watching_since",
+        "_changed_at",
+        "_unknown_changes_at",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        hash_contents: bool = False,
+        file_cache_bytes: int = DEFAULT_FILE_CACHE_BYTES,
+        dedup_results: bool = False
+    ):
         self.file_read_at = {}
         self.file_updated_at = {}
         self.coder_confirms = 0
+        self.hash_contents = hash_contents
+        self.file_cache = FileCache(file_cache_bytes)
+        self.results = ResultStore() if dedup_results else None
+        self.journal = EditJournal()
+        self._version = 0
+        self._fingerprints = {}
+        self._result_to_file = None
+        self._confirmation_policy = None
+        self._watcher = None
+        self._watching_since = 0
+        self._changed_at = {}
+        self._unknown_changes_at = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_path(file_path: str) -> str:
+        return os.path.abspath(os.path.expanduser(file_path))
+
+    def next_version(self) -> int:
+        with self._lock:
+            self._version += 1
+            return self._version
+
+    @property
+    def version(self) -> int:
+        "The version of the most recent read or update."
+        return self._version
+
+    def fingerprint(self, file_path: str) -> Optional[FileFingerprint]:
+        "Fingerprint of the file as it currently is on disk, or None if it does not exist."
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+
+        digest = None
+        if self.hash_contents:
+            h = hashlib.blake2b(digest_size=16)
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+            digest = h.hexdigest()
+
+        return FileFingerprint(st.st_size, st.st_mtime_ns, digest)
     
     def record_file_read(self, file_path: str):
-        self.file_read_at[file_path] = datetime.datetime.now()
+        file_path = self.normalize_path(file_path)
+        self.file_read_at[file_path] = self.next_version()
+        self._fingerprints[file_path] = self.fingerprint(file_path)
     
+    def record_file_reads(self, file_paths: list):
+        "Records reads of several files, made together, with a single version."
+        version = self.next_version()
+        for file_path in file_paths:
+            file_path = self.normalize_path(file_path)
+            self.file_read_at[file_path] = version
+            self._fingerprints[file_path] = self.fingerprint(file_path)
+
     def record_file_update(self, file_path: str):
-        self.file_updated_at[file_path] = datetime.datetime.now()
+        file_path = self.normalize_path(file_path)
+        self.file_updated_at[file_path] = self.next_version()
+        self._fingerprints[file_path] = self.fingerprint(file_path)
     
+    def record_file_edit(self, file_path: str):
+        """Records an update whose diff, with the new line numbers, was returned
+        to the agent. The agent does not need to re-read the file before
+        editing it again."""
+        self.record_file_update(file_path)
+        self.file_read_at[self.normalize_path(file_path)] = self.next_version()
+
+    def last_update_version(self, file_path: str) -> int:
+        "Version of the most recent update of the file through the tools, or 0."
+        return self.file_updated_at.get(self.normalize_path(file_path), 0)
+    
+    def watch(self, root: str = ".", poll_interval: float = DEFAULT_POLL_INTERVAL):
+        "Starts watching the tree at `root` for changes made outside of the tools."
+        self.stop_watching()
+        self._watcher = make_watcher(root, self.record_external_change, poll_interval=poll_interval).start()
+        self._watching_since = self.next_version()
+        return self._watcher
+
+    def stop_watching(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def record_external_change(self, file_path: Optional[str]):
+        """Called by the watcher when a file or directory changes. None means
+        that any file may have changed."""
+        if file_path is None:
+            self._unknown_changes_at = self.next_version()
+            self.file_cache.invalidate()
+            return
+
+        # Changes made through the tools are reported by the watcher too
+        recorded = self._fingerprints.get(file_path)
+        if recorded is not None and recorded == self.fingerprint(file_path):
+            return
+
+        self._changed_at[file_path] = self.next_version()
+        self.file_cache.invalidate(file_path)
+
+    def _precisely_watched(self, file_path: str, since_version: int) -> bool:
+        "Whether every change to the file after `since_version` has been reported."
+        watcher = self._watcher
+        if (
+            watcher is None
+            or not watcher.precise
+            or since_version < self._watching_since
+            or not watcher.watches(file_path)
+        ):
+            return False
+        watcher.flush()
+        return True
+
+    def _external_change_version(self, file_path: str) -> int:
+        "Version of the last change to the file, or to a directory containing it, reported by the watcher."
+        version = max(self._changed_at.get(file_path, 0), self._unknown_changes_at)
+        root = self._watcher.root
+        directory = os.path.dirname(file_path)
+        while directory.startswith(root) and len(directory) >= len(root):
+            version = max(version, self._changed_at.get(directory, 0))
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+        return version
+
+    def changed_paths_since(self, version: int, root: str) -> Optional[set]:
+        """Paths under `root` that changed after `version`, through the tools
+        or otherwise. Returns None when this cannot be known without looking
+        at every file, i.e. when `root` is not watched precisely or changes
+        may have been missed. Changed directories are included as such."""
+        root = self.normalize_path(root)
+        if not self._precisely_watched(root, version) or self._unknown_changes_at > version:
+            return None
+
+        prefix = root.rstrip(os.sep) + os.sep
+        return {
+            path
+            for changes in (self._changed_at, self.file_updated_at)
+            for path, v in list(changes.items())
+            if v > version and (path == root or path.startswith(prefix))
+        }
+
     def record_confirm(self):
         self.coder_confirms += 1
     
     def raise_error_if_this_file_has_not_been_read_since_it_was_last_updated(self, file_path):
-        if file_path not in self.file_read_at:
+        normalized_path = self.normalize_path(file_path)
+
+        if normalized_path not in self.file_read_at:
             raise ValueError("You must read the file before writing to it.")
         
-        if file_path in self.file_updated_at and self.file_updated_at[file_path] > self.file_read_at[file_path]:
+        if self.file_updated_at.get(normalized_path, 0) > self.file_read_at[normalized_path]:
             raise ValueError(f"File {file_path} must be re-read first.")
 
+        if self._precisely_watched(normalized_path, self.file_read_at[normalized_path]):
+            modified_outside = self._external_change_version(normalized_path) > self.file_read_at[normalized_path]
+        else:
+            modified_outside = self._fingerprints.get(normalized_path) != self.fingerprint(normalized_path)
+
+        if modified_outside:
+            raise ValueError(
+                f"File {file_path} was modified outside of the file tools and must be re-read first."
+            )
+
     def enable_result_to_file(self, path):
         self._result_to_file = path
 
     def get_result_to_file(self):
-        if hasattr(self, "_result_to_file"):
-            return self._result_to_file
-        else:
-            return None
+        return self._result_to_file
 
     def disable_result_to_file(self):
-        self._result_to_file = None
\ No newline at end of file
+        self._result_to_file = None
+
+    def set_confirmation_policy(self, policy):
+        self._confirmation_policy = policy
+
+    def get_confirmation_policy(self):
+        return self._confirmation_policy
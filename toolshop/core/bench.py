@@ -0,0 +1,231 @@
+"""Benchmarks for the built-in tools.
+
+Each benchmark generates a synthetic workload, runs a tool against it several
+times and reports latency percentiles, throughput and peak memory. Every
+benchmark runs in a fresh process, so its peak RSS is not inflated by the
+benchmarks that ran before it.
+
+Results can be saved as a baseline and later runs compared against it, so
+that performance regressions fail the run.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+
+# Workload sizes at scale 1.0. The default scale used by `ts bench` is much
+# smaller so that a full run finishes in seconds.
+LARGE_FILE_LINES = 1_000_000
+TREE_DEPTH = 4
+TREE_FANOUT = 4
+TREE_FILES_PER_DIR = 8
+TREE_FILE_LINES = 200
+SQL_ROWS = 1_000_000
+SHELL_LINES = 1_000_000
+
+
+def _make_large_file(root, scale):
+    rng = random.Random(0)
+    path = os.path.join(root, "large.txt")
+    n_lines = max(int(LARGE_FILE_LINES * scale), 10)
+    with open(path, "w") as f:
+        for i in range(n_lines):
+            f.write(f"{i:08d} {rng.getrandbits(64):016x} lorem ipsum dolor sit amet\n")
+    return path, n_lines
+
+
+def _make_tree(root, scale):
+    rng = random.Random(0)
+    tree_root = os.path.join(root, "tree")
+    n_lines = max(int(TREE_FILE_LINES * scale), 1)
+    n_files = 0
+
+    def populate(path, depth):
+        nonlocal n_files
+        os.makedirs(path, exist_ok=True)
+        for i in range(TREE_FILES_PER_DIR):
+            with open(os.path.join(path, f"file_{i}.py"), "w") as f:
+                for j in range(n_lines):
+                    f.write(f"value_{j} = {rng.getrandbits(32)}\n")
+            n_files += 1
+        if depth > 0:
+            for i in range(TREE_FANOUT):
+                populate(os.path.join(path, f"dir_{i}"), depth - 1)
+
+    populate(tree_root, TREE_DEPTH)
+    return tree_root, n_files * n_lines
+
+
+def _make_database(root, scale):
+    rng = random.Random(0)
+    path = os.path.join(root, "bench.db")
+    n_rows = max(int(SQL_ROWS * scale), 10)
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT, value REAL)")
+        conn.executemany(
+            "INSERT INTO t VALUES (?, ?, ?)",
+            ((i, f"name_{i}", rng.random()) for i in range(n_rows))
+        )
+    conn.close()
+    return f"sqlite:///{path}", n_rows
+
+
+def _bench_read_helper(root, scale):
+    from toolshop.tools.file import _read_helper
+
+    path, n_lines = _make_large_file(root, scale)
+    return (lambda: _read_helper(path, include_line_numbers=True)), n_lines
+
+
+def _bench_read_helper_range(root, scale):
+    from toolshop.tools.file import _read_helper
+
+    path, n_lines = _make_large_file(root, scale)
+    start = n_lines // 2
+    return (lambda: _read_helper(path, start_line=start, end_line=start + 100)), 100
+
+
+def _bench_edit_helper(root, scale):
+    from toolshop.tools.file import _edit_helper
+
+    path, n_lines = _make_large_file(root, scale)
+    line = n_lines // 2
+    return (lambda: _edit_helper(path, "replaced line\n", line, line + 1)), n_lines
+
+
+def _bench_read_directory(root, scale):
+    from toolshop.tools.file import ReadDirectory
+
+    tree_root, n_lines = _make_tree(root, scale)
+    return (lambda: ReadDirectory()(tree_root)), n_lines
+
+
+def _bench_shell_helper(root, scale):
+    from toolshop.tools.terminal import shell_helper
+
+    n_lines = max(int(SHELL_LINES * scale), 10)
+    return (lambda: shell_helper(f"seq 1 {n_lines}")), n_lines
+
+
+def _bench_sql(root, scale):
+    from toolshop.tools.data import Sql
+
+    uri, n_rows = _make_database(root, scale)
+    return (lambda: Sql()(sql_query="SELECT * FROM t", database_uri=uri)), n_rows
+
+
+BENCHMARKS = {
+    "read_helper": _bench_read_helper,
+    "read_helper_range": _bench_read_helper_range,
+    "edit_helper": _bench_edit_helper,
+    "read_directory": _bench_read_directory,
+    "shell_helper": _bench_shell_helper,
+    "sql": _bench_sql,
+}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _run_benchmark(name, scale, repeat):
+    "Runs a single benchmark. Called in a fresh process."
+    with tempfile.TemporaryDirectory() as root:
+        fn, n_items = BENCHMARKS[name](root, scale)
+
+        # Warm up, then time the runs without tracemalloc, which slows
+        # allocation-heavy code down considerably.
+        fn()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        fn()
+        _, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    p50 = statistics.median(timings)
+    return {
+        "name": name,
+        "scale": scale,
+        "repeat": repeat,
+        "items": n_items,
+        "p50_ms": p50 * 1000,
+        "p95_ms": _percentile(timings, 95) * 1000,
+        "max_ms": max(timings) * 1000,
+        "items_per_s": n_items / p50 if p50 else None,
+        "peak_alloc_kb": peak_alloc / 1024,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_kb": max(usage.ru_maxrss, child_usage.ru_maxrss),
+    }
+
+
+def run_benchmarks(names=None, scale: float = 0.01, repeat: int = 5):
+    """Runs the benchmarks and yields one result dict per benchmark.
+
+    Args:
+        names (list[str], optional): Benchmarks to run. Defaults to all.
+        scale (float): Workload size relative to the full workloads (a
+            million-line file, a million-row table, etc.).
+        repeat (int): Number of timed runs per benchmark.
+    """
+    names = names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark: {name}. Choose from {', '.join(BENCHMARKS)}.")
+
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            yield executor.submit(_run_benchmark, name, scale, repeat).result()
+
+
+def save_baseline(results, path: str):
+    with open(path, "w") as f:
+        json.dump({r["name"]: r for r in results}, f, indent=2)
+
+
+def compare_to_baseline(results, path: str, tolerance: float = 0.2):
+    """Returns a list of regressions: benchmarks whose median latency or peak
+    memory grew by more than `tolerance` relative to the baseline."""
+    with open(path, "r") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if base is None:
+            continue
+
+        if base["scale"] != r["scale"]:
+            raise ValueError(
+                f"Baseline for {r['name']} was recorded at scale {base['scale']}, "
+                f"not {r['scale']}."
+            )
+
+        for metric in ("p50_ms", "peak_rss_kb"):
+            if r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{r['name']}: {metric} {r[metric]:.1f} vs baseline {base[metric]:.1f}"
+                )
+
+    return regressions
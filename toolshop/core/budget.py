@@ -0,0 +1,170 @@
+"""Limits on the size of the tool results that are sent to the agent.
+
+Every token of a tool result is read by the model, so oversized results make
+each turn slow and expensive. A `ResultBudget` cuts a result down to a token
+budget and says how much was dropped, so the agent can ask for the rest in a
+narrower call.
+"""
+
+import atexit
+import functools
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+from toolshop.core.logging import logger
+from toolshop.core.textfile import TEXT_ERRORS
+
+
+DEFAULT_RESULT_BUDGET_TOKENS = 10_000
+
+# Used to estimate token counts when tiktoken is unavailable, and to decide
+# without counting that a result is within budget.
+BYTES_PER_TOKEN = 4
+
+# Counting tokens exactly is linear in the size of the text, so results much
+# larger than the budget are only estimated.
+MAX_EXACT_COUNT_CHARS = 1024 * 1024
+
+STRATEGIES = ("head", "tail", "head_tail", "spill")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Not installed, or the encoding cannot be downloaded
+        logger.debug("tiktoken is unavailable. Estimating token counts from byte counts.")
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    "Number of tokens in `text`, counted with tiktoken when it is available."
+    encoding = _encoding()
+    if encoding is not None and len(text) <= MAX_EXACT_COUNT_CHARS:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text.encode("utf-8", errors="replace")) // BYTES_PER_TOKEN)
+
+
+_spill_dir = None
+_spill_lock = threading.Lock()
+_spill_count = 0
+
+
+def _spill_path(tool_name: str) -> str:
+    global _spill_dir, _spill_count
+    with _spill_lock:
+        if _spill_dir is None:
+            _spill_dir = tempfile.mkdtemp(prefix="toolshop-results-")
+        _spill_count += 1
+        return os.path.join(_spill_dir, f"{_spill_count:04d}-{tool_name}.txt")
+
+
+@atexit.register
+def _remove_spill_dir():
+    "Removes the results written in this session. They are only read by the agent during the session."
+    global _spill_dir
+    with _spill_lock:
+        if _spill_dir is not None:
+            shutil.rmtree(_spill_dir, ignore_errors=True)
+            _spill_dir = None
+
+
+class ResultBudget:
+    """Cuts tool results down to `max_tokens`.
+
+    Strategies:
+        head: keep the beginning of the result.
+        tail: keep the end of the result, e.g. for logs.
+        head_tail: keep the beginning and the end, dropping the middle.
+        spill: write the full result to a file and return its path with the
+            beginning and end of the result, so the agent can read the
+            parts it needs with `read_file`.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = DEFAULT_RESULT_BUDGET_TOKENS, strategy: str = "head_tail"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown result budget strategy: {strategy}. Choose from {', '.join(STRATEGIES)}.")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+
+    def __repr__(self):
+        return f"ResultBudget(max_tokens={self.max_tokens}, strategy={self.strategy!r})"
+
+    def apply(self, result, tool_name: str = "tool"):
+        "Returns `result` unchanged if it is within budget, otherwise a shortened copy."
+        if self.max_tokens is None or result is None:
+            return result
+
+        # Other results, e.g. the variables returned by python_exec, are only
+        # converted to text when they are over budget
+        original, result = result, result if isinstance(result, str) else str(result)
+
+        # Every token is at least one character
+        if len(result) <= self.max_tokens:
+            return original
+
+        n_tokens = estimate_tokens(result)
+        if n_tokens <= self.max_tokens:
+            return original
+
+        # Keep as many characters as the budget allows at this result's
+        # characters-per-token ratio
+        n_chars = int(len(result) * self.max_tokens / n_tokens)
+        n_lines = result.count("\n")
+
+        if self.strategy == "head":
+            kept = _head(result, n_chars)
+            return kept + _dropped_note(result, n_tokens, n_lines, len(kept), "end")
+
+        if self.strategy == "tail":
+            kept = _tail(result, n_chars)
+            return _dropped_note(result, n_tokens, n_lines, len(kept), "beginning") + kept
+
+        if self.strategy == "spill":
+            path = _spill_path(tool_name)
+            # Results may hold undecodable bytes of files, escaped by the file tools
+            with open(path, "w", encoding="utf-8", errors=TEXT_ERRORS) as f:
+                f.write(result)
+
+            head = _head(result, n_chars // 4)
+            tail = _tail(result, n_chars // 4)
+            return (
+                f"[The output of {tool_name} is {n_tokens} tokens ({n_lines} lines), over the "
+                f"budget of {self.max_tokens}. The full output was written to {path}. "
+                f"Read the parts you need with read_file. The beginning and end are shown below.]\n"
+                f"{head}\n[...]\n{tail}"
+            )
+
+        head = _head(result, n_chars // 2)
+        tail = _tail(result, n_chars // 2)
+        return head + _dropped_note(result, n_tokens, n_lines, len(head) + len(tail), "middle") + tail
+
+
+def _head(text: str, n_chars: int) -> str:
+    "The beginning of `text`, cut at a line break where possible."
+    head = text[:n_chars]
+    cut = head.rfind("\n")
+    return head[:cut + 1] if cut >= n_chars // 2 else head
+
+
+def _tail(text: str, n_chars: int) -> str:
+    "The end of `text`, cut at a line break where possible."
+    if n_chars <= 0:
+        return ""
+    tail = text[-n_chars:]
+    cut = tail.find("\n")
+    return tail[cut + 1:] if 0 <= cut < n_chars // 2 else tail
+
+
+def _dropped_note(text: str, n_tokens: int, n_lines: int, n_kept_chars: int, where: str) -> str:
+    dropped_fraction = 1 - n_kept_chars / len(text)
+    return (
+        f"\n[... {int(n_tokens * dropped_fraction)} of {n_tokens} tokens "
+        f"(about {int(n_lines * dropped_fraction)} of {n_lines} lines) dropped from the {where} "
+        f"of the output to stay within the result budget ...]\n"
+    )
@@ -0,0 +1,49 @@
+"""On-disk caches shared by tools that persist indexes between sessions."""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+def cache_dir(*parts) -> str:
+    """Returns (and creates) a directory under toolshop's cache root.
+
+    The cache root is `$TOOLSHOP_CACHE_DIR`, or `~/.cache/toolshop` if unset.
+    """
+    root = os.environ.get("TOOLSHOP_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "toolshop"
+    )
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_key(*values) -> str:
+    "Short hash of the given values, for use in cache file names."
+    h = hashlib.blake2b(digest_size=12)
+    for value in values:
+        h.update(str(value).encode("utf-8", errors="replace"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def load_pickle(path: str, default=None):
+    "Loads a pickled cache file, returning `default` if it is missing or unreadable."
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return default
+
+
+def save_pickle(path: str, obj):
+    "Atomically replaces the cache file at `path`."
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,264 @@
+"""Policies that decide whether a tool call requiring confirmation may run.
+
+A policy returns True to allow a call, False to deny it, or None when it has
+no opinion, which lets policies be chained. Policies are attached to a
+`State`, so every tool sharing the state uses the same policy.
+"""
+
+import asyncio
+import fnmatch
+import os
+import select
+import shlex
+import sys
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Optional
+
+
+class ConfirmationRequest(NamedTuple):
+    tool_name: str
+    args: tuple
+    kwargs: dict
+
+    def describe(self) -> str:
+        params = [repr(a) for a in self.args]
+        params += [f"{k}={v!r}" for k, v in self.kwargs.items()]
+        description = f"{self.tool_name}({', '.join(params)})"
+
+        MAX_DESCRIPTION_LENGTH = 200
+        if len(description) > MAX_DESCRIPTION_LENGTH:
+            description = description[:MAX_DESCRIPTION_LENGTH] + "...)"
+        return description
+
+
+class ConfirmationPolicy(ABC):
+    @abstractmethod
+    def confirm(self, request: ConfirmationRequest) -> Optional[bool]:
+        pass
+
+    async def confirm_async(self, request: ConfirmationRequest) -> Optional[bool]:
+        return await asyncio.to_thread(self.confirm, request)
+
+    def confirm_batch(self, requests: list) -> list:
+        return [self.confirm(r) for r in requests]
+
+    async def confirm_batch_async(self, requests: list) -> list:
+        return [await self.confirm_async(r) for r in requests]
+
+
+class DenyPolicy(ConfirmationPolicy):
+    "Denies every call. Used for unattended runs with nothing pre-approved."
+
+    def confirm(self, request):
+        return False
+
+    async def confirm_async(self, request):
+        return False
+
+
+class RulesPolicy(ConfirmationPolicy):
+    """Allows or denies calls using pre-approved rules. Calls no rule matches
+    are left undecided.
+
+    Each rule is a line of the form `<allow|deny> <tool> [<arg>=<value> ...]`.
+    The tool name and argument values are shell-style wildcards, e.g.
+
+        allow authenticate_to_gcp
+        deny shell command=*rm -rf*
+
+    Rules are checked in order and the first match wins.
+    """
+
+    def __init__(self, rules: list[str] = None, allow: list[str] = None, deny: list[str] = None):
+        self.rules = []
+        for line in rules or []:
+            self.add_rule(line)
+        for pattern in deny or []:
+            self.rules.append((False, pattern, {}))
+        for pattern in allow or []:
+            self.rules.append((True, pattern, {}))
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(os.path.expanduser(path), 'r') as f:
+            return cls(rules=f.readlines())
+
+    def add_rule(self, line: str):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+
+        action, pattern, *conditions = shlex.split(line)
+        if action not in ("allow", "deny"):
+            raise ValueError(f"Invalid confirmation rule: {line!r}. Rules must start with 'allow' or 'deny'.")
+
+        arg_patterns = {}
+        for condition in conditions:
+            name, sep, value = condition.partition("=")
+            if not sep:
+                raise ValueError(f"Invalid condition {condition!r} in confirmation rule: {line!r}")
+            arg_patterns[name] = value
+
+        self.rules.append((action == "allow", pattern, arg_patterns))
+
+    def confirm(self, request):
+        for allow, pattern, arg_patterns in self.rules:
+            if not fnmatch.fnmatchcase(request.tool_name, pattern):
+                continue
+
+            if all(
+                name in request.kwargs and fnmatch.fnmatchcase(str(request.kwargs[name]), value)
+                for name, value in arg_patterns.items()
+            ):
+                return allow
+
+        return None
+
+    async def confirm_async(self, request):
+        return self.confirm(request)
+
+
+class PromptPolicy(ConfirmationPolicy):
+    """Asks the user. The call is denied when nobody answers within `timeout`
+    seconds or when there is no terminal to ask on."""
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout
+
+    def confirm(self, request):
+        answer = _read_answer(
+            f"Do you want to allow agent to run {request.describe()}?  Type 'yes' to allow: ",
+            self.timeout
+        )
+        return answer == "yes"
+
+    async def confirm_async(self, request):
+        answer = await _read_answer_async(
+            f"Do you want to allow agent to run {request.describe()}?  Type 'yes' to allow: ",
+            self.timeout
+        )
+        return answer == "yes"
+
+    def confirm_batch(self, requests):
+        if len(requests) < 2:
+            return super().confirm_batch(requests)
+
+        answer = _read_answer(_batch_prompt(requests), self.timeout)
+        return _parse_batch_answer(answer, len(requests))
+
+    async def confirm_batch_async(self, requests):
+        if len(requests) < 2:
+            return await super().confirm_batch_async(requests)
+
+        answer = await _read_answer_async(_batch_prompt(requests), self.timeout)
+        return _parse_batch_answer(answer, len(requests))
+
+
+class ChainPolicy(ConfirmationPolicy):
+    """Asks each policy in turn until one decides. Calls that no policy
+    decides are denied."""
+
+    def __init__(self, policies: list):
+        self.policies = policies
+
+    def confirm(self, request):
+        return self.confirm_batch([request])[0]
+
+    async def confirm_async(self, request):
+        return (await self.confirm_batch_async([request]))[0]
+
+    def confirm_batch(self, requests):
+        decisions = [None] * len(requests)
+        for policy in self.policies:
+            pending = [i for i, d in enumerate(decisions) if d is None]
+            if not pending:
+                break
+            for i, d in zip(pending, policy.confirm_batch([requests[i] for i in pending])):
+                decisions[i] = d
+
+        return [bool(d) for d in decisions]
+
+    async def confirm_batch_async(self, requests):
+        decisions = [None] * len(requests)
+        for policy in self.policies:
+            pending = [i for i, d in enumerate(decisions) if d is None]
+            if not pending:
+                break
+            for i, d in zip(pending, await policy.confirm_batch_async([requests[i] for i in pending])):
+                decisions[i] = d
+
+        return [bool(d) for d in decisions]
+
+
+_prompt_policy = PromptPolicy()
+_deny_policy = DenyPolicy()
+
+
+def default_confirmation_policy() -> ConfirmationPolicy:
+    "Prompt the user when there is a terminal, otherwise deny."
+    if _stdin_is_interactive():
+        return _prompt_policy
+    else:
+        return _deny_policy
+
+
+def _stdin_is_interactive() -> bool:
+    try:
+        return sys.stdin is not None and sys.stdin.isatty()
+    except ValueError:
+        return False
+
+
+def _read_answer(prompt: str, timeout: float = None) -> Optional[str]:
+    if not _stdin_is_interactive():
+        return None
+
+    if timeout is None:
+        return input(prompt)
+
+    print(prompt, end="", flush=True)
+    ready, _, _ = select.select([sys.stdin], [], [], timeout)
+    if not ready:
+        print(f"\nNo answer after {timeout} seconds. Denying.")
+        return None
+
+    return sys.stdin.readline().rstrip("\n")
+
+
+async def _read_answer_async(prompt: str, timeout: float = None) -> Optional[str]:
+    if not _stdin_is_interactive():
+        return None
+
+    from prompt_toolkit import PromptSession
+
+    try:
+        return await asyncio.wait_for(PromptSession().prompt_async(prompt), timeout)
+    except asyncio.TimeoutError:
+        print(f"\nNo answer after {timeout} seconds. Denying.")
+        return None
+
+
+def _batch_prompt(requests) -> str:
+    lines = ["The agent wants to run:"]
+    lines += [f"  {i + 1}. {r.describe()}" for i, r in enumerate(requests)]
+    lines.append(
+        "Type 'yes' to allow all, 'no' to deny all, or the numbers of the calls "
+        "to allow (e.g. 1,3): "
+    )
+    return "\n".join(lines)
+
+
+def _parse_batch_answer(answer: Optional[str], n: int) -> list:
+    if answer is None:
+        return [False] * n
+
+    answer = answer.strip().lower()
+    if answer == "yes":
+        return [True] * n
+
+    allowed = set()
+    for part in answer.replace(" ", ",").split(","):
+        if part.isdigit():
+            allowed.add(int(part) - 1)
+
+    return [i in allowed for i in range(n)]
@@ -0,0 +1,150 @@
+"""Deduplication of the tool results returned to the agent.
+
+Agents often re-read files they have already seen, or rerun a command whose
+output has not changed. Sending the same text again costs tokens on every
+later turn, so a result identical to one already returned in the session is
+replaced by a short reference to the earlier call, named by its tool and
+arguments. A result that changed
+since the same call was last made, e.g. a file read again after an edit, is
+replaced by a diff against the earlier result when the diff is smaller.
+"""
+
+import difflib
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+# Results shorter than this are always returned in full
+DEDUP_MIN_CHARS = 200
+
+# Earlier results kept for diffing, by total size. Older ones are dropped.
+DEDUP_MAX_STORED_CHARS = 32 * 1024 * 1024
+
+# A diff is only returned when it is smaller than this fraction of the result
+MAX_DIFF_RATIO = 0.5
+
+# Results with more lines than this are not diffed, to bound the time spent
+MAX_DIFF_LINES = 20_000
+
+DIFF_CONTEXT_LINES = 3
+
+# Line numbers added by `read_file`, ignored when matching lines, so that
+# lines shifted by an insertion are not reported as changed
+_LINE_NUMBER_PREFIX = re.compile(r"^\d+ *\|")
+
+
+def result_digest(result: str) -> str:
+    return hashlib.blake2b(result.encode("utf-8", errors="surrogatepass"), digest_size=16).hexdigest()
+
+
+def describe_call(tool_name: str, args, kwargs, max_length: int = 120) -> str:
+    arguments = ", ".join([repr(a) for a in args] + [f"{k}={v!r}" for k, v in kwargs.items()])
+    if len(arguments) > max_length:
+        arguments = arguments[:max_length] + "..."
+    return f"{tool_name}({arguments})"
+
+
+def diff_results(old: str, new: str, context: int = DIFF_CONTEXT_LINES) -> str:
+    """A unified diff from `old` to `new`. Lines are compared without the line
+    numbers `read_file` adds, and shown with them."""
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+
+    def show(line):
+        return line if line.endswith("\n") else line + "\n"
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        [_LINE_NUMBER_PREFIX.sub("", line, count=1) for line in old_lines],
+        [_LINE_NUMBER_PREFIX.sub("", line, count=1) for line in new_lines],
+        autojunk=False,
+    )
+
+    output = []
+    for group in matcher.get_grouped_opcodes(context):
+        first, last = group[0], group[-1]
+        output.append(f"@@ -{first[1] + 1},{last[2] - first[1]} +{first[3] + 1},{last[4] - first[3]} @@\n")
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                output += [" " + show(line) for line in new_lines[j1:j2]]
+            else:
+                output += ["-" + show(line) for line in old_lines[i1:i2]]
+                output += ["+" + show(line) for line in new_lines[j1:j2]]
+
+    return "".join(output)
+
+
+class ResultStore:
+    """The results returned to the agent in a session.
+
+    Results are indexed by their digest, to find identical results of any
+    earlier call, and the latest result of each call (tool and arguments) is
+    kept to diff against when the call is made again.
+    """
+
+    def __init__(self, max_stored_chars: int = DEDUP_MAX_STORED_CHARS):
+        self.max_stored_chars = max_stored_chars
+        self._by_digest = {}
+        self._by_call = OrderedDict()
+        self._stored_chars = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        "Forgets every result, e.g. when the conversation is reset."
+        with self._lock:
+            self._by_digest.clear()
+            self._by_call.clear()
+            self._stored_chars = 0
+
+    def deduplicate(self, tool_name: str, args, kwargs, result):
+        "Records a result and returns what to send to the agent instead."
+        if not isinstance(result, str):
+            return result
+
+        if len(result) < DEDUP_MIN_CHARS:
+            return result
+
+        description = describe_call(tool_name, args, kwargs)
+        with self._lock:
+            digest = result_digest(result)
+            earlier = self._by_digest.get(digest)
+            call_key = (tool_name, repr(args), repr(sorted(kwargs.items())))
+            previous = self._by_call.pop(call_key, None)
+            if previous is not None:
+                self._stored_chars -= len(previous)
+
+            self._by_call[call_key] = result
+            self._stored_chars += len(result)
+            while self._stored_chars > self.max_stored_chars:
+                _, evicted = self._by_call.popitem(last=False)
+                self._stored_chars -= len(evicted)
+
+        if earlier == description:
+            return f"[The result of {description} did not change since it was last returned. It is not repeated.]\n"
+        if earlier is not None:
+            return f"[The result of {description} is identical to the result of {earlier}. It is not repeated.]\n"
+
+        if previous is not None:
+            diff = self._diff(previous, result)
+            if diff is not None:
+                return (
+                    f"[The result of {description} changed since it was last returned. "
+                    f"Only the changes are shown.]\n{diff}"
+                )
+
+        # Only calls whose full result was returned are referred to later
+        with self._lock:
+            self._by_digest.setdefault(digest, description)
+        return result
+
+    @staticmethod
+    def _diff(old: str, new: str) -> Optional[str]:
+        if old.count("\n") > MAX_DIFF_LINES or new.count("\n") > MAX_DIFF_LINES:
+            return None
+        diff = diff_results(old, new)
+        if not diff or len(diff) >= MAX_DIFF_RATIO * len(new):
+            return None
+        return diff
@@ -0,0 +1,218 @@
+"""An in-memory tree of directory listings, for finding files by name.
+
+The tree is built with `os.scandir` on first use and refreshed incrementally
+after that. When `State` watches the tree, only the directories containing
+the paths it reports as changed are listed again. Otherwise every directory
+is stat-ed, and listed again only if its mtime changed, which happens
+whenever an entry is created, removed or renamed in it.
+
+Sizes and mtimes of files are not kept, since writing to a file does not
+change the mtime of its directory. They are read for the files matching a
+query, and only when the query needs them.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from toolshop.core.watcher import is_ignored_dir
+
+
+# A directory modified this recently may be modified again within the
+# granularity of its mtime, so it is listed again at the next refresh
+RACY_MTIME_WINDOW_NS = 2 * 10**9
+
+
+class _Listing(NamedTuple):
+    # mtime of the directory when it was listed, or None to list it again
+    mtime_ns: Optional[int]
+    subdirs: tuple
+    # Names of the files in the directory, one per line, to match patterns
+    # against all of them at once
+    names: str
+
+
+class Glob(NamedTuple):
+    # Matches the relative paths of the directories the pattern applies to,
+    # or None for every directory
+    dirs: Optional[re.Pattern]
+    # Matches the lines of file names that the pattern matches
+    names: re.Pattern
+
+    def matches(self, rel_path: str) -> bool:
+        rel_dir, name = os.path.split(rel_path)
+        if self.dirs is not None and self.dirs.fullmatch(rel_dir) is None:
+            return False
+        return self.names.match(name) is not None
+
+
+def _translate(pattern: str) -> str:
+    "A regular expression for the glob `pattern`, in which `*` and `?` do not match `/`."
+    output = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            output.append("(?:[^\n]*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            output.append("[^\n]*")
+            i += 2
+        elif c == "*":
+            output.append("[^/\n]*")
+            i += 1
+        elif c == "?":
+            output.append("[^/\n]")
+            i += 1
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            chars = pattern[i + 1:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^/\n" + chars[1:]
+            output.append(f"[{chars}]")
+            i = end + 1
+        else:
+            output.append(re.escape(c))
+            i += 1
+    return "".join(output)
+
+
+def compile_glob(pattern: str, case_sensitive: bool = True) -> Glob:
+    """Compiles a glob for relative file paths. `**` matches any number of
+    directories, and a pattern without a `/` matches the file name in any
+    directory. Splitting the pattern into a directory part and a file name
+    part lets the file names of a directory be skipped when its path does
+    not match."""
+    flags = 0 if case_sensitive else re.IGNORECASE
+    dir_glob, _, name_glob = pattern.rpartition("/")
+    if name_glob == "**":
+        dir_glob = f"{dir_glob}/**" if dir_glob else "**"
+        name_glob = "*"
+
+    dirs = None
+    if "/" in pattern:
+        dir_glob = dir_glob.lstrip("/")
+        if dir_glob == "**":
+            dirs = None
+        elif dir_glob.endswith("/**"):
+            dirs = re.compile(_translate(dir_glob[:-3]) + "(?:/[^\n]*)?", flags)
+        else:
+            dirs = re.compile(_translate(dir_glob), flags)
+
+    names = re.compile(f"^{_translate(name_glob)}$", flags | re.MULTILINE)
+    return Glob(dirs, names)
+
+
+class DirectoryTree:
+    "The listings of the directories under `root`, except ignored ones."
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.dirs = {}
+        # State version of the last refresh in this session
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, state=None):
+        """Lists the directories that changed since the last refresh.
+
+        When `state` is watching the tree, only the directories of the paths
+        it reports as changed are listed again. Otherwise every directory is
+        stat-ed."""
+        with self._lock:
+            if state is not None and self.refreshed_at is not None:
+                version = state.version
+                changed_paths = state.changed_paths_since(self.refreshed_at, self.root)
+                if changed_paths is not None:
+                    self._refresh_paths(changed_paths)
+                    self.refreshed_at = version
+                    return
+
+            version = state.version if state is not None else None
+            self._walk("")
+            self.refreshed_at = version
+
+    def _refresh_paths(self, paths: set):
+        prefix = os.path.join(self.root, "")
+        stale = set()
+        for path in paths:
+            if path == self.root:
+                stale.add("")
+                continue
+            if not path.startswith(prefix):
+                continue
+
+            rel_path = path[len(prefix):]
+            parent = os.path.dirname(rel_path)
+            if any(is_ignored_dir(part) for part in parent.split(os.sep) if part):
+                continue
+            # The entry may have been created or removed, so its directory is
+            # listed again, and its own subtree if it is or was a directory
+            stale.add(parent)
+            if rel_path in self.dirs or (os.path.isdir(path) and not is_ignored_dir(os.path.basename(path))):
+                stale.add(rel_path)
+
+        for rel_dir in sorted(stale):
+            listing = self.dirs.get(rel_dir)
+            if listing is not None:
+                self.dirs[rel_dir] = listing._replace(mtime_ns=None)
+        for rel_dir in sorted(stale):
+            self._walk(rel_dir)
+
+    def _walk(self, start: str):
+        "Brings the listings of `start` and the directories under it up to date."
+        seen = set()
+        stack = [start]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                st = os.stat(os.path.join(self.root, rel_dir))
+            except OSError:
+                continue
+
+            listing = self.dirs.get(rel_dir)
+            if listing is None or listing.mtime_ns != st.st_mtime_ns:
+                listing = self._list(rel_dir, st)
+                if listing is None:
+                    continue
+            seen.add(rel_dir)
+            stack.extend(os.path.join(rel_dir, name) for name in listing.subdirs)
+
+        prefix = os.path.join(start, "") if start else ""
+        for rel_dir in [d for d in self.dirs if (d == start or d.startswith(prefix)) and d not in seen]:
+            del self.dirs[rel_dir]
+
+    def _list(self, rel_dir: str, st) -> Optional[_Listing]:
+        subdirs, names = [], []
+        try:
+            with os.scandir(os.path.join(self.root, rel_dir)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_ignored_dir(entry.name):
+                            subdirs.append(entry.name)
+                    else:
+                        names.append(entry.name)
+        except OSError:
+            return None
+
+        mtime_ns = st.st_mtime_ns
+        if time.time_ns() - mtime_ns < RACY_MTIME_WINDOW_NS:
+            mtime_ns = None
+        listing = self.dirs[rel_dir] = _Listing(mtime_ns, tuple(subdirs), "\n".join(names))
+        return listing
+
+    def match(self, globs: List[Glob]) -> list:
+        "The relative paths of the files that match any of the globs."
+        with self._lock:
+            listings = [(rel_dir, listing.names) for rel_dir, listing in self.dirs.items() if listing.names]
+
+        paths = []
+        for glob in globs:
+            for rel_dir, names in listings:
+                if glob.dirs is None or glob.dirs.fullmatch(rel_dir):
+                    prefix = rel_dir + os.sep if rel_dir else ""
+                    paths += [prefix + name for name in glob.names.findall(names)]
+
+        return list(dict.fromkeys(paths)) if len(globs) > 1 else paths
@@ -0,0 +1,88 @@
+"""Concurrent dispatch of the tool calls made in a single model turn."""
+
+import asyncio
+
+
+async def dispatch_tool_calls(calls):
+    """Runs independent tool calls concurrently and returns their results in
+    the order the calls were made.
+
+    Calls are ordered by these rules, so that confirmations and the
+    read-before-write constraints enforced through `State` behave exactly as
+    if the calls were made one at a time:
+
+    * Confirmations are requested as one batch, before anything runs.
+    * Calls that share a `Tool.concurrency_keys` key (e.g. the same file) run
+      in the order they were made.
+    * Tools that run exclusively (e.g. `Shell`) wait for every earlier call,
+      and every later call waits for them.
+
+    Args:
+        calls (list[tuple[Tool, dict]]): Tools and the keyword arguments to
+            call them with.
+
+    Returns:
+        list: The result of each call, or the exception it raised.
+    """
+    results = [None] * len(calls)
+    tasks = {}
+
+    # Ask for all pending confirmations at once, grouped by policy
+    pending = {}
+    for i, (tool, kwargs) in enumerate(calls):
+        if tool.needs_confirmation():
+            policy = tool.confirmation_policy()
+            pending.setdefault(id(policy), (policy, []))[1].append(i)
+
+    for policy, indices in pending.values():
+        requests = [calls[i][0].confirmation_request(**calls[i][1]) for i in indices]
+        for i, allowed in zip(indices, await policy.confirm_batch_async(requests)):
+            try:
+                calls[i][0].raise_if_denied(allowed)
+            except Exception as e:
+                results[i] = e
+
+    last_by_key = {}
+    barrier = None
+    since_barrier = []
+    exclusive_next = False
+
+    for i, (tool, kwargs) in enumerate(calls):
+        if results[i] is not None:
+            continue
+
+        exclusive = tool.runs_exclusively() or exclusive_next
+        exclusive_next = getattr(tool, "_applies_to_next_call", False)
+
+        if exclusive:
+            dependencies = since_barrier + [barrier]
+        else:
+            keys = tool.concurrency_keys(**kwargs)
+            dependencies = [barrier] + [last_by_key.get(key) for key in keys]
+
+        task = asyncio.ensure_future(
+            _run_after([d for d in dependencies if d is not None], tool, kwargs)
+        )
+        tasks[i] = task
+
+        if exclusive:
+            barrier = task
+            since_barrier = []
+            last_by_key = {}
+        else:
+            since_barrier.append(task)
+            for key in keys:
+                last_by_key[key] = task
+
+    outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    for i, outcome in zip(tasks.keys(), outcomes):
+        results[i] = outcome
+
+    return results
+
+
+async def _run_after(dependencies, tool, kwargs):
+    if dependencies:
+        await asyncio.wait(dependencies)
+
+    return await tool._call_async((), kwargs, confirmed=True)
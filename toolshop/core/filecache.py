@@ -0,0 +1,100 @@
+"""An in-memory cache of file contents shared by the file tools."""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from toolshop.core.textfile import read_text_lines
+
+
+DEFAULT_FILE_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class FileCache:
+    """Least-recently-used cache of the lines of text files and their
+    encodings, as read by `read_text_lines`.
+
+    An entry is valid while the file's mtime and size are unchanged, so edits
+    made outside of the tools are picked up on the next read. Edits made
+    through the tools write through the cache, so the file is not read again
+    after it is written. Cached line lists are shared and must not be
+    modified.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_FILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path: str):
+        """The lines and encoding of the file at `path`, read from disk only if
+        it changed. The lines are None if the file is binary."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+
+        entry = self._lookup(path, st)
+        if entry:
+            return entry[2], entry[3]
+
+        with self._lock:
+            self.misses += 1
+
+        lines, encoding = read_text_lines(path)
+        self._store(path, st, lines, encoding)
+        return lines, encoding
+
+    def get_lines(self, path: str) -> Optional[list]:
+        return self.get(path)[0]
+
+    def peek(self, path: str):
+        "Like `get`, but returns None instead of reading the file if it is not cached."
+        path = os.path.abspath(path)
+        entry = self._lookup(path, os.stat(path))
+        return (entry[2], entry[3]) if entry else None
+
+    def put_lines(self, path: str, lines: list, encoding: str = "utf-8"):
+        "Records `lines` as the contents of the file just written to `path`."
+        path = os.path.abspath(path)
+        self._store(path, os.stat(path), lines, encoding)
+
+    def _lookup(self, path, st):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+        return None
+
+    def invalidate(self, path: Optional[str] = None):
+        "Drops the entry for `path`, or every entry."
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._size = 0
+            else:
+                entry = self._entries.pop(os.path.abspath(path), None)
+                if entry:
+                    self._size -= entry[1]
+
+    def _store(self, path, st, lines, encoding):
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old:
+                self._size -= old[1]
+
+            if st.st_size > self.max_bytes:
+                return
+
+            self._entries[path] = (st.st_mtime_ns, st.st_size, lines, encoding)
+            self._size += st.st_size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted[1]
@@ -0,0 +1,190 @@
+"""A journal of the edits made through the file tools, for undoing them.
+
+Each edit is recorded as a reverse patch: the lines it removed and the
+number of lines it added at its position. Undoing an edit applies the patch
+to the current contents of the file, so the journal holds only the edited
+lines rather than copies of the files, and undoing is proportional to the
+size of the edits rather than the size of the tree.
+"""
+
+import os
+import threading
+from typing import List, NamedTuple, Optional
+
+from toolshop.core.textfile import encode_text_lines, read_text_lines
+
+
+class JournalEntry(NamedTuple):
+    seq: int
+    path: str
+    # Where the edit starts, as a 0-based line index
+    start_line: int
+    # The lines the edit replaced, restored by undoing it
+    removed_lines: list
+    # The number of lines the edit inserted, removed by undoing it
+    n_added: int
+    # Whether the edit created the file. Undoing it deletes the file.
+    created: bool
+    # (size, mtime_ns) of the file after the edit
+    signature: tuple
+
+
+def _signature(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class EditJournal:
+    """Journal of the edits made through the file tools, with named
+    checkpoints.
+
+    Entries are only ever appended, except by `undo`, which removes the
+    entries it reverts from the end of each file's history, so every
+    remaining entry still applies to the file as it is.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.checkpoints = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def record_edit(self, path: str, start_line: int, removed_lines: list, n_added: int):
+        "Records an edit of the file at `path`, just after it was written."
+        path = os.path.abspath(path)
+        with self._lock:
+            self.entries.append(JournalEntry(
+                self._next_seq(), path, start_line, list(removed_lines), n_added, False, _signature(path)
+            ))
+
+    def record_create(self, path: str):
+        "Records the creation of the file at `path`, just after it was written."
+        path = os.path.abspath(path)
+        with self._lock:
+            self.entries.append(JournalEntry(self._next_seq(), path, 0, [], 0, True, _signature(path)))
+
+    def checkpoint(self, name: str = None) -> str:
+        "Marks the current point in the journal, to undo the edits made after it."
+        with self._lock:
+            seq = self._next_seq()
+            name = name or f"checkpoint-{seq}"
+            self.checkpoints[name] = seq
+            return name
+
+    def edits_since(self, checkpoint: str = None, paths: List[str] = None) -> list:
+        """The entries after `checkpoint`, or the last entry if no checkpoint is
+        given, for the files in `paths` or every file."""
+        with self._lock:
+            if checkpoint is None:
+                since = self.entries[-1].seq - 1 if self.entries else 0
+            elif checkpoint in self.checkpoints:
+                since = self.checkpoints[checkpoint]
+            else:
+                raise ValueError(
+                    f"There is no checkpoint {checkpoint!r}. The checkpoints are: "
+                    f"{', '.join(self.checkpoints) or 'none'}"
+                )
+
+            if paths is not None:
+                paths = {os.path.abspath(os.path.expanduser(p)) for p in paths}
+            return [e for e in self.entries if e.seq > since and (paths is None or e.path in paths)]
+
+    def undo(self, checkpoint: str = None, paths: List[str] = None, cache=None) -> dict:
+        """Reverts the edits after `checkpoint` (or the last edit) to the files
+        in `paths` (or every file). Returns the number of edits undone per
+        file, with None for files that were deleted because an undone edit
+        created them.
+
+        Raises ValueError, without changing anything, if a file was changed
+        outside of the journal since its last recorded edit, or cannot be
+        restored. If writing a file fails, the files restored before it stay
+        restored and their edits are dropped from the journal.
+        """
+        undone = self.edits_since(checkpoint, paths)
+
+        by_path = {}
+        for entry in undone:
+            by_path.setdefault(entry.path, []).append(entry)
+
+        for path, entries in by_path.items():
+            latest = [e for e in self.entries if e.path == path][-1]
+            if _signature(path) != latest.signature:
+                raise ValueError(
+                    f"{path} was changed outside of the file tools since it was last edited, "
+                    f"so its edits cannot be undone. Edit it back instead."
+                )
+
+        # Every file is checked and patched in memory before any is written
+        reverted = {path: self._revert(path, entries, cache) for path, entries in by_path.items()}
+
+        restored = {}
+        try:
+            for path, entries in by_path.items():
+                restored[path] = self._restore(path, entries, reverted[path], cache)
+        finally:
+            self._drop(undone, restored, checkpoint if paths is None else None)
+
+        return restored
+
+    def _drop(self, undone: list, restored: dict, checkpoint: str = None):
+        "Removes the undone edits of the `restored` files from the journal."
+        undone_seqs = {e.seq for e in undone if e.path in restored}
+        with self._lock:
+            self.entries = [e for e in self.entries if e.seq not in undone_seqs]
+
+            # The files were rewritten, so the latest remaining edit of each
+            # gets its new signature
+            latest = {e.path: i for i, e in enumerate(self.entries) if e.path in restored}
+            for path, i in latest.items():
+                self.entries[i] = self.entries[i]._replace(signature=_signature(path))
+            if checkpoint is not None and len(restored) == len({e.path for e in undone}):
+                # Later checkpoints refer to edits that no longer exist
+                since = self.checkpoints[checkpoint]
+                self.checkpoints = {n: s for n, s in self.checkpoints.items() if s <= since}
+
+        return restored
+
+    @staticmethod
+    def _revert(path: str, entries: list, cache=None):
+        """The lines, encoding and encoded contents of `path` with `entries`
+        undone, or None if the file is to be deleted. Raises ValueError if
+        the file cannot be restored."""
+        if entries[0].created:
+            return None
+
+        if cache is not None:
+            lines, encoding = cache.get(path)
+        else:
+            lines, encoding = read_text_lines(path)
+        if lines is None:
+            raise ValueError(f"{path} is now a binary file, so its edits cannot be undone.")
+        lines = list(lines)
+
+        # Newest first, so each patch applies to the lines it produced
+        for entry in reversed(entries):
+            lines[entry.start_line:entry.start_line + entry.n_added] = entry.removed_lines
+
+        return lines, encoding, encode_text_lines(path, lines, encoding)
+
+    @staticmethod
+    def _restore(path: str, entries: list, reverted, cache=None) -> Optional[int]:
+        if reverted is None:
+            os.remove(path)
+            if cache is not None:
+                cache.invalidate(path)
+            return None
+
+        lines, encoding, data = reverted
+        with open(path, "wb") as f:
+            f.write(data)
+        if cache is not None:
+            cache.put_lines(path, lines, encoding)
+
+        return len(entries)
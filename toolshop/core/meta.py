@@ -1,13 +1,16 @@
 from toolshop.core.base import Tool
 
 class EnableResultToFile(Tool):
+    _run_exclusively = True
+    _applies_to_next_call = True
+
     def call(
             self,
             path: str
     ) -> str:
         """
         After this tool is called, the output of the following tool call will be written 
-            to the specified file.
+            to the specified file, and only a short summary is returned in its place.
 
         Args:
             path (str): The path to the file where the output will be written.
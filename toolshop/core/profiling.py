@@ -0,0 +1,229 @@
+"""Opt-in profiling of tool calls.
+
+When profiling is enabled for a tool, each of its calls runs under cProfile
+and, optionally, tracemalloc. Every profiled call writes two files to the
+profile directory: `<seq>-<tool>.pstats`, which can be loaded with `pstats`
+or a viewer like snakeviz, and `<seq>-<tool>.txt`, a summary with the wall
+time, the slowest functions, the peak traced memory and the top allocations.
+
+Tools can be profiled by name, and every other call by a sampling rate.
+While profiling is disabled, a tool call only pays for reading a module
+global.
+"""
+
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+
+from toolshop.core.logging import logger
+
+
+# Number of functions listed in a call's summary
+SUMMARY_FUNCTIONS = 25
+
+_enabled = False
+_output_dir = None
+_tools = frozenset()
+_sample_rate = 0.0
+_memory = True
+_top_allocations = 10
+_sequence = itertools.count(1)
+
+# cProfile and tracemalloc measure the whole process, so calls that overlap
+# with a profiled call are not profiled
+_lock = threading.Lock()
+
+
+def configure_profiling(
+    output_dir=None,
+    tools=(),
+    sample_rate: float = 0.0,
+    memory: bool = True,
+    top_allocations: int = 10
+):
+    """Profile the calls to `tools` and a `sample_rate` fraction of the calls
+    to other tools, writing the profiles to `output_dir`. Pass
+    `output_dir=None` to disable profiling.
+
+    Args:
+        output_dir (str, optional): The directory profiles are written to.
+        tools (list[str]): Names of the tools whose every call is profiled.
+            "all" profiles every tool.
+        sample_rate (float): Fraction of the calls to other tools to profile.
+        memory (bool): Whether to trace memory allocations with tracemalloc.
+            Tracing allocations slows down the call considerably.
+        top_allocations (int): Number of allocation sites in the summary.
+    """
+    global _enabled, _output_dir, _tools, _sample_rate, _memory, _top_allocations, _sequence
+
+    _enabled = False
+    if output_dir is None or (not tools and sample_rate <= 0):
+        return
+
+    _output_dir = os.path.expanduser(output_dir)
+    os.makedirs(_output_dir, exist_ok=True)
+    _tools = frozenset(tools)
+    _sample_rate = 1.0 if "all" in _tools else sample_rate
+    _memory = memory
+    _top_allocations = top_allocations
+    _sequence = itertools.count(1)
+    _enabled = True
+
+
+def stop_profiling():
+    global _enabled
+    _enabled = False
+
+
+def profiling_enabled() -> bool:
+    return _enabled
+
+
+def should_profile(tool_name: str) -> bool:
+    return tool_name in _tools or (_sample_rate > 0 and random.random() < _sample_rate)
+
+
+def profiled(tool, run):
+    """Returns `run` wrapped to profile the call if `tool` is selected for
+    profiling, otherwise `run` itself."""
+    if not _enabled or not should_profile(tool.__name__):
+        return run
+
+    def profiled_run(*args, **kwargs):
+        if not _lock.acquire(blocking=False):
+            logger.debug(f"Not profiling {tool.__name__}: another call is being profiled.")
+            return run(*args, **kwargs)
+
+        try:
+            profile = ToolCallProfile(tool, args, kwargs)
+            try:
+                result = profile.run(run, *args, **kwargs)
+            except Exception as e:
+                profile.finish(error=e)
+                raise
+            profile.finish()
+            return result
+        finally:
+            _lock.release()
+
+    return profiled_run
+
+
+def profiled_async(tool, run):
+    """Async counterpart of `profiled`, for tools with a native `acall`.
+
+    The profiler is enabled for the whole coroutine, so functions of other
+    tasks running on the event loop while the call awaits are profiled too,
+    and the wall time includes the time spent waiting."""
+    if not _enabled or not should_profile(tool.__name__):
+        return run
+
+    async def profiled_run(*args, **kwargs):
+        if not _lock.acquire(blocking=False):
+            logger.debug(f"Not profiling {tool.__name__}: another call is being profiled.")
+            return await run(*args, **kwargs)
+
+        try:
+            profile = ToolCallProfile(tool, args, kwargs)
+            try:
+                result = await profile.run_async(run, *args, **kwargs)
+            except Exception as e:
+                profile.finish(error=e)
+                raise
+            profile.finish()
+            return result
+        finally:
+            _lock.release()
+
+    return profiled_run
+
+
+class ToolCallProfile:
+    "Profiles a single tool call and writes its profile when finished."
+
+    def __init__(self, tool, args, kwargs):
+        self.tool = tool
+        self.args = args
+        self.kwargs = kwargs
+        self.seq = next(_sequence)
+        self.profiler = cProfile.Profile()
+        self.memory = _memory
+        self.started_tracemalloc = False
+        self.duration = None
+
+    def _start_tracing_memory(self):
+        if self.memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                self.started_tracemalloc = True
+            self.memory_at_start = tracemalloc.get_traced_memory()[0]
+            self.snapshot_at_start = tracemalloc.take_snapshot()
+
+    def run(self, run, *args, **kwargs):
+        self._start_tracing_memory()
+        start = time.perf_counter()
+        try:
+            return self.profiler.runcall(run, *args, **kwargs)
+        finally:
+            self.duration = time.perf_counter() - start
+
+    async def run_async(self, run, *args, **kwargs):
+        self._start_tracing_memory()
+        start = time.perf_counter()
+        self.profiler.enable()
+        try:
+            return await run(*args, **kwargs)
+        finally:
+            self.profiler.disable()
+            self.duration = time.perf_counter() - start
+
+    def finish(self, error: Exception = None):
+        peak = allocations = None
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] - self.memory_at_start
+            allocations = tracemalloc.take_snapshot().compare_to(self.snapshot_at_start, "lineno")
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+        base_path = os.path.join(_output_dir, f"{self.seq:05d}-{self.tool.__name__}")
+        self.profiler.dump_stats(base_path + ".pstats")
+        with open(base_path + ".txt", "w") as f:
+            f.write(self.summary(peak, allocations, error))
+
+        message = f"Profiled {self.tool.__name__} in {self.duration * 1000:.1f} ms"
+        if peak is not None:
+            message += f", peak memory {peak / 1024:.0f} KB"
+        logger.info(f"{message}: {base_path}.txt")
+
+    def summary(self, peak, allocations, error=None) -> str:
+        arguments = ", ".join(
+            [repr(a) for a in self.args] + [f"{k}={v!r}" for k, v in self.kwargs.items()]
+        )
+        if len(arguments) > 500:
+            arguments = arguments[:500] + "..."
+
+        lines = [
+            f"tool: {self.tool.__name__}({arguments})",
+            f"wall time: {self.duration * 1000:.1f} ms",
+        ]
+        if error is not None:
+            lines.append(f"error: {type(error).__name__}: {error}")
+
+        if peak is not None:
+            lines.append(f"peak traced memory: {peak / 1024:.1f} KB")
+            lines.append(f"top {_top_allocations} allocations:")
+            lines += [f"    {stat}" for stat in allocations[:_top_allocations]]
+
+        stats_output = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stats_output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(SUMMARY_FUNCTIONS)
+
+        return "\n".join(lines) + "\n\n" + stats_output.getvalue()
@@ -0,0 +1,140 @@
+"""Reading files that may be in any encoding, or not text at all."""
+
+import codecs
+import io
+import mmap
+import os
+import re
+from typing import Optional
+
+
+# Size of the block at the start of a file used to detect its encoding
+SNIFF_BYTES = 8192
+
+# Bytes that may appear in text files. A block with more than
+# BINARY_CONTROL_RATIO of other bytes is considered binary.
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+BINARY_CONTROL_RATIO = 0.3
+
+
+def sniff_encoding(block: bytes) -> Optional[str]:
+    "Guesses the encoding of a file from its first block. Returns None for binary files."
+    if block.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if block.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+
+    if b"\0" in block:
+        return None
+    if block and len(block.translate(None, _TEXT_BYTES)) / len(block) > BINARY_CONTROL_RATIO:
+        return None
+
+    # Invalid bytes are kept with TEXT_ERRORS rather than decoding the whole
+    # file as another encoding, which would garble every other character
+    return "utf-8"
+
+
+# Bytes that are invalid in the encoding of a file are decoded to lone
+# surrogates, and encoded back to the same bytes when the file is written
+TEXT_ERRORS = "surrogateescape"
+
+_ESCAPED_BYTES = re.compile("[\udc80-\udcff]")
+
+
+def display_text(text: str) -> str:
+    "Shows the bytes that could not be decoded, kept as lone surrogates, as U+FFFD."
+    return _ESCAPED_BYTES.sub("\ufffd", text)
+
+
+# Newlines are counted a block at a time when skipping to a line
+LINE_SCAN_BLOCK_BYTES = 1024 * 1024
+
+
+def _decode_lines(data: bytes, encoding: str, errors: str = "strict") -> list:
+    "Decodes and splits lines the way files opened in text mode do."
+    return io.TextIOWrapper(io.BytesIO(data), encoding=encoding, errors=errors, newline=None).readlines()
+
+
+def _line_offset(data, n_lines: int, offset: int = 0) -> int:
+    "Byte offset of the start of the line `n_lines` lines after `offset`."
+    while n_lines > 0 and offset < len(data):
+        block = data[offset:offset + LINE_SCAN_BLOCK_BYTES]
+        n_block_lines = block.count(b"\n")
+        if n_block_lines < n_lines:
+            n_lines -= n_block_lines
+            offset += len(block)
+            continue
+
+        i = -1
+        for _ in range(n_lines):
+            i = block.find(b"\n", i + 1)
+        return offset + i + 1
+
+    return min(offset, len(data))
+
+
+def read_text_lines(path: str, start_line: int = None, end_line: int = None):
+    """Reads the lines `start_line` to `end_line` of a file, using pythonic
+    indexing. Returns the lines and the encoding of the file, or (None, None)
+    if the file is binary.
+
+    The file is memory-mapped, and when a range is given, only the bytes of
+    those lines are decoded. Bytes that are invalid in the detected encoding
+    are decoded with `TEXT_ERRORS`, so the lines can be written back
+    unchanged with `write_text_lines`. Use `display_text` to show them.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], "utf-8"
+
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Not mappable, e.g. a pipe or a file in /proc
+            data = f.read()
+
+    try:
+        encoding = sniff_encoding(data[:SNIFF_BYTES])
+        if encoding is None:
+            return None, None
+
+        ranged = start_line is not None or end_line is not None
+        indices_are_forward = (start_line or 0) >= 0 and (end_line is None or end_line >= 0)
+
+        # UTF-16 lines cannot be found by searching for newline bytes
+        if ranged and indices_are_forward and encoding != "utf-16":
+            begin = _line_offset(data, start_line or 0)
+            end = len(data) if end_line is None else _line_offset(data, max(end_line - (start_line or 0), 0), begin)
+            # The BOM is only at the start of the file
+            encoding_of_range = "utf-8" if encoding == "utf-8-sig" and begin > 0 else encoding
+            return _decode_lines(data[begin:end], encoding_of_range, errors=TEXT_ERRORS), encoding
+
+        lines = _decode_lines(data[:], encoding, errors=TEXT_ERRORS)
+        if ranged:
+            lines = lines[start_line:end_line]
+        return lines, encoding
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def encode_text_lines(path: str, lines: list, encoding: str = "utf-8") -> bytes:
+    "Encodes lines to be written to `path`. Raises ValueError if `encoding` cannot represent them."
+    text = "".join(lines)
+    try:
+        return text.encode(encoding, errors=TEXT_ERRORS)
+    except UnicodeEncodeError as e:
+        raise ValueError(
+            f'The file "{path}" is encoded as {encoding}, which cannot represent '
+            f'{text[e.start:e.end]!r}. The file was not changed. Use only characters '
+            f'that {encoding} can encode, or convert the file to UTF-8 first.'
+        ) from None
+
+
+def write_text_lines(path: str, lines: list, encoding: str = "utf-8"):
+    """Writes lines to a file in `encoding`. The text is encoded before the
+    file is opened, so a file is never left truncated by text its encoding
+    cannot represent; a ValueError is raised instead."""
+    data = encode_text_lines(path, lines, encoding)
+    with open(path, "wb") as f:
+        f.write(data)
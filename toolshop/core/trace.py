@@ -0,0 +1,263 @@
+"""Structured tracing of tool calls.
+
+When tracing is enabled, every tool call is written as one compact JSON line to
+a rotating file. Records are serialized and written by a background thread so
+the tool call itself only pays for building a small dict.
+"""
+
+import atexit
+import hashlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import uuid
+
+from toolshop.core.logging import logger
+
+
+trace_logger = logging.getLogger('toolshop.trace')
+trace_logger.propagate = False
+trace_logger.setLevel(logging.INFO)
+
+_listener = None
+_include_args = True
+_session_id = None
+_sequence = itertools.count(1)
+
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that defers JSON serialization to the writer thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class _JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, default=repr, separators=(',', ':'))
+
+
+def configure_tracing(
+    path=None,
+    max_bytes: int = 64 * 1024 * 1024,
+    backup_count: int = 5,
+    include_args: bool = True
+):
+    """Write one JSON record per tool call to `path`. Pass `path=None` to
+    disable tracing.
+
+    Args:
+        path (str, optional): The trace file. Rotated files are suffixed with
+            `.1`, `.2`, etc.
+        max_bytes (int): Size at which the trace file is rotated.
+        backup_count (int): Number of rotated files to keep.
+        include_args (bool): Whether to store the raw call arguments. Replay
+            requires them; only a digest is stored otherwise.
+    """
+    global _listener, _include_args, _session_id
+
+    stop_tracing()
+
+    if path is None:
+        return
+
+    path = os.path.expanduser(path)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count
+    )
+    file_handler.setFormatter(_JsonLinesFormatter())
+
+    record_queue = queue.SimpleQueue()
+    trace_logger.addHandler(_TraceQueueHandler(record_queue))
+
+    _listener = logging.handlers.QueueListener(record_queue, file_handler)
+    _listener.start()
+
+    _include_args = include_args
+    _session_id = uuid.uuid4().hex[:12]
+
+
+def stop_tracing():
+    """Flush pending records and stop the background writer."""
+    global _listener
+
+    for h in list(trace_logger.handlers):
+        trace_logger.removeHandler(h)
+
+    if _listener is not None:
+        _listener.stop()
+        for h in _listener.handlers:
+            h.close()
+        _listener = None
+
+
+atexit.register(stop_tracing)
+
+
+def tracing_enabled() -> bool:
+    return _listener is not None
+
+
+def digest(value) -> str:
+    "Short, stable digest of a JSON-serializable value."
+    if not isinstance(value, (str, bytes)):
+        value = json.dumps(value, default=repr, sort_keys=True)
+    if isinstance(value, str):
+        value = value.encode('utf-8', errors='replace')
+    return hashlib.blake2b(value, digest_size=8).hexdigest()
+
+
+def state_snapshot(state):
+    """Copy the parts of `state` whose changes are recorded in the trace."""
+    from toolshop.core.base import State
+
+    if not isinstance(state, State):
+        return None
+
+    return {
+        "read": dict(state.file_read_at),
+        "update": dict(state.file_updated_at),
+    }
+
+
+def state_mutations(before, state) -> list:
+    if before is None:
+        return []
+
+    after = state_snapshot(state)
+    mutations = []
+    for op in ("read", "update"):
+        for path, value in after[op].items():
+            if before[op].get(path) != value:
+                mutations.append({"op": op, "path": path})
+
+    return mutations
+
+
+class ToolCallTrace:
+    """Measures a single tool call and queues its trace record when finished."""
+
+    def __init__(self, tool, args, kwargs):
+        self.tool = tool
+        self.args = args
+        self.kwargs = kwargs
+        self.before = state_snapshot(tool._state)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+
+    def finish(self, result=None, error: Exception = None):
+        trace_tool_call(
+            self.tool, self.args, self.kwargs, result,
+            started_at=self.started_at,
+            duration=time.perf_counter() - self.start,
+            error=f"{type(error).__name__}: {error}" if error else None,
+            mutations=state_mutations(self.before, self.tool._state)
+        )
+
+
+def trace_tool_call(tool, args, kwargs, result, started_at, duration, error=None, mutations=None):
+    """Queue a trace record for a single tool call."""
+    record = {
+        "session": _session_id,
+        "seq": next(_sequence),
+        "ts": started_at,
+        "tool": tool.__name__,
+        "args_digest": digest([list(args), kwargs]),
+        "duration_ms": round(duration * 1000, 3),
+        "error": error,
+        "state_mutations": mutations or [],
+    }
+
+    if _include_args:
+        record["args"] = list(args)
+        record["kwargs"] = kwargs
+
+    if result is not None:
+        result_str = str(result)
+        record["result_size"] = len(result_str)
+        record["result_digest"] = digest(result_str)
+
+    trace_logger.info(record)
+
+
+def read_trace(*paths):
+    """Read trace records from one or more trace files, ordered by time."""
+    records = []
+    for path in paths:
+        with open(os.path.expanduser(path), 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+
+    records.sort(key=lambda r: (r.get("ts", 0), r.get("seq", 0)))
+    return records
+
+
+def replay_trace(records, tools, repeat: int = 1, allow_side_effects: bool = False):
+    """Re-execute recorded tool calls against the given tools.
+
+    Yields one dict per record with the recorded and current timings and
+    whether the current result matches the recorded one. Calls to tools with
+    side effects, e.g. edits and shell commands, are skipped unless
+    `allow_side_effects` is set, since replaying them changes the files and
+    databases the trace was recorded against.
+
+    Args:
+        records (list[dict]): Records returned by `read_trace`.
+        tools (list[Tool]): The tools to replay against, matched by name.
+        repeat (int): Number of times to run each call. The fastest run is
+            reported.
+        allow_side_effects (bool): Whether to replay calls to tools with side
+            effects. Each of them is run once per repeat.
+    """
+    tools_by_name = {t.__name__: t for t in tools}
+
+    for record in records:
+        outcome = {
+            "seq": record.get("seq"),
+            "tool": record["tool"],
+            "recorded_ms": record.get("duration_ms"),
+            "current_ms": None,
+            "result_match": None,
+            "skipped": None,
+            "error": None,
+        }
+
+        tool = tools_by_name.get(record["tool"])
+        if tool is None:
+            outcome["skipped"] = "tool not available"
+        elif "args" not in record:
+            outcome["skipped"] = "arguments were not recorded"
+        elif tool.has_side_effects() and not allow_side_effects:
+            outcome["skipped"] = "tool has side effects"
+
+        if outcome["skipped"]:
+            yield outcome
+            continue
+
+        timings = []
+        result = None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            try:
+                result = tool(*record["args"], **record["kwargs"])
+            except Exception as e:
+                outcome["error"] = f"{type(e).__name__}: {e}"
+                logger.info(f"Replay of {record['tool']} failed: {outcome['error']}")
+            timings.append(time.perf_counter() - start)
+
+        outcome["current_ms"] = round(min(timings) * 1000, 3)
+        if "result_digest" in record and outcome["error"] is None:
+            outcome["result_match"] = (
+                result is not None and digest(str(result)) == record["result_digest"]
+            )
+
+        yield outcome
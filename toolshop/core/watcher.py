@@ -0,0 +1,276 @@
+"""Watches a working tree for changes made outside of the tools.
+
+Shell commands, formatters and `git checkout` change files without going
+through the file tools. A watcher reports the paths they change, so that
+`State` and the caches built on it can be invalidated precisely.
+
+On Linux, changes are reported by inotify as they happen. Elsewhere, or when
+inotify is unavailable, the tree is polled in a background thread.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+
+from toolshop.core.logging import logger
+
+
+# Directories whose contents are not watched. Hidden directories are not
+# watched either.
+IGNORED_DIRS = ("__pycache__", "node_modules")
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def is_ignored_dir(name: str) -> bool:
+    return name.startswith(".") or name in IGNORED_DIRS
+
+
+class FileWatcher(ABC):
+    """Calls `callback(path)` with the absolute path of each file or
+    directory that changes under `root`. `callback(None)` means that changes
+    may have been missed, and everything under `root` should be considered
+    changed.
+
+    A watcher is `precise` when every change is reported by the time `flush`
+    returns, so the absence of an event proves that a file is unchanged.
+    """
+
+    precise = False
+
+    def __init__(self, root: str, callback: Callable[[Optional[str]], None]):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.callback = callback
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watches(self, path: str) -> bool:
+        "Whether changes to `path` are reported."
+        rel_path = os.path.relpath(path, self.root)
+        if rel_path == os.curdir:
+            return True
+        if rel_path.startswith(os.pardir):
+            return False
+        return not any(is_ignored_dir(part) for part in rel_path.split(os.sep)[:-1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="toolshop-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def flush(self):
+        "Reports the changes that have happened but were not reported yet."
+
+    @abstractmethod
+    def _run(self):
+        "Watches the tree until `stop` is called."
+
+    def _report(self, path: Optional[str]):
+        try:
+            self.callback(path)
+        except Exception:
+            logger.exception(f"Error handling a change to {path}")
+
+
+class PollingWatcher(FileWatcher):
+    "Finds changes by comparing the size and mtime of every file every `interval` seconds."
+
+    def __init__(self, root, callback, interval: float = DEFAULT_POLL_INTERVAL):
+        super().__init__(root, callback)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_ignored_dir(entry.name):
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return snapshot
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            snapshot = self._scan()
+            for path, signature in snapshot.items():
+                if self._snapshot.get(path) != signature:
+                    self._report(path)
+            for path in self._snapshot.keys() - snapshot.keys():
+                self._report(path)
+            self._snapshot = snapshot
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def inotify_available() -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(_load_libc(), "inotify_init1")
+    except OSError:
+        return False
+
+
+class InotifyWatcher(FileWatcher):
+    "Reports changes as they happen, using one inotify watch per directory."
+
+    precise = True
+
+    def __init__(self, root, callback):
+        super().__init__(root, callback)
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._lock = threading.Lock()
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _watch_tree(self, top: str):
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_MASK | IN_ONLYDIR)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                # ENOSPC: out of watches, see /proc/sys/fs/inotify/max_user_watches
+                raise OSError(err, f"Cannot watch {path}: {os.strerror(err)}")
+            self._dirs[wd] = path
+
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            stack += [
+                e.path for e in entries
+                if not is_ignored_dir(e.name) and e.is_dir(follow_symlinks=False)
+            ]
+
+    def stop(self):
+        super().stop()
+        with self._lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+    def flush(self):
+        with self._lock:
+            self._read_events()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 0.2)
+            if ready:
+                self.flush()
+
+    def _read_events(self):
+        while self._fd >= 0:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning(f"Too many changes under {self.root} to track. Treating every file as changed.")
+            self._report(None)
+            return
+
+        directory = self._dirs.get(wd)
+        if mask & IN_IGNORED:
+            self._dirs.pop(wd, None)
+            return
+        if directory is None:
+            return
+
+        path = os.path.join(directory, name) if name else directory
+        if mask & IN_ISDIR:
+            if is_ignored_dir(name):
+                return
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._watch_tree(path)
+                except OSError:
+                    logger.exception(f"Cannot watch {path}")
+                    self._report(None)
+
+        self._report(path)
+
+
+def make_watcher(root: str, callback, poll_interval: float = DEFAULT_POLL_INTERVAL) -> FileWatcher:
+    "Creates an inotify watcher if possible, otherwise a polling watcher."
+    if inotify_available():
+        try:
+            return InotifyWatcher(root, callback)
+        except OSError as e:
+            logger.warning(f"Cannot watch {root} with inotify ({e}). Polling for changes instead.")
+    return PollingWatcher(root, callback, interval=poll_interval)
@@ -0,0 +1,609 @@
+"""This module contains tools for searching and navigating source code."""
+
+import ast
+import fnmatch
+import os
+import re
+from array import array
+from typing import NamedTuple
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+from ..core.base import Tool, State
+from ..core.cache import cache_dir, cache_key, load_pickle, save_pickle
+from ..core.logging import logger
+
+
+def make_code_tools(tools: list[str] = None, state: State = None):
+    """Creates a set of code tools with shared state.
+
+    Pass the same `state` that is given to `make_file_tools` so that files
+    edited through the file tools are re-indexed immediately.
+
+    Args:
+        tools (list[str], optional): A list of tool names to include. If None,
+            all tools are included. Defaults to None.
+    """
+    if state is None:
+        state = State()
+
+    symbol_cache = SymbolCache()
+
+    search_code = SearchCode(state=state)
+    outline = Outline(state=state, symbol_cache=symbol_cache)
+    find_symbol = FindSymbol(state=state, symbol_cache=symbol_cache)
+
+    if not tools:
+        tools = ["search_code", "outline", "find_symbol"]
+
+    x = locals()
+    return [x[tool_name] for tool_name in tools]
+
+
+class SearchCode(Tool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indexes = {}
+
+    def call(
+        self,
+        query: str,
+        path: str = ".",
+        regex: bool = False,
+        case_sensitive: bool = True,
+        max_results: int = 100
+    ) -> str:
+        """
+        Searches the text files under `path` for `query` and returns matching
+        lines as `file:line:text`. Uses an index of the tree, so it is much
+        faster than grep or reading the directory. Prefer this tool for
+        finding code.
+
+        Args:
+            query (str): The text to search for, or a regular expression if `regex` is True.
+            path (str): The directory to search. Defaults to the current directory.
+            regex (bool): Whether `query` is a Python regular expression. Defaults to False.
+            case_sensitive (bool): Whether the search is case-sensitive. Defaults to True.
+            max_results (int): Maximum number of matching lines to return. Defaults to 100.
+        """
+        flags = 0 if case_sensitive else re.IGNORECASE
+        if regex:
+            pattern = re.compile(query, flags)
+            literals = _required_literals(query, flags)
+        else:
+            pattern = re.compile(re.escape(query), flags)
+            literals = [query]
+
+        index = self.get_index(path)
+        matches, truncated = index.search(pattern, literals, max_results)
+
+        output = "".join(
+            f"{os.path.join(path, rel_path)}:{line_number}:{line}\n"
+            for rel_path, line_number, line in matches
+        )
+        if truncated:
+            output += f"[Stopped after {max_results} matches. Narrow the query to see more.]\n"
+        elif not matches:
+            output += f"No matches for {query!r} in {path}.\n"
+
+        return output
+
+    def get_index(self, path: str) -> "TrigramIndex":
+        "Returns the index of the tree at `path`, brought up to date."
+        root = os.path.abspath(os.path.expanduser(path))
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f'"{path}" is not a directory')
+
+        index = self._indexes.get(root)
+        if index is None:
+            index = self._indexes[root] = TrigramIndex.load(root)
+
+        if index.refresh(self._state if isinstance(self._state, State) else None):
+            index.save()
+
+        return index
+
+
+class Outline(Tool):
+    def __init__(self, *args, symbol_cache: "SymbolCache" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._symbol_cache = symbol_cache or SymbolCache()
+
+    def call(self, path: str) -> str:
+        """
+        Lists the classes, functions and methods defined in a Python file,
+        with the line range of each. Use the line ranges with `read_file` to
+        read only the code you need, instead of reading the whole file.
+
+        Args:
+            path (str): The path to the Python file.
+        """
+        path = os.path.expanduser(path)
+        symbols, error = self._symbol_cache.get(path, state=_shared_state(self))
+        self._symbol_cache.save()
+
+        if error:
+            return f"Could not parse {path}: {error}\n"
+        if not symbols:
+            return f"No classes or functions are defined in {path}.\n"
+
+        return "".join(
+            f"{s.start_line:>5}-{s.end_line:<5} {'    ' * s.depth}{s.signature}\n"
+            for s in symbols
+        )
+
+
+class FindSymbol(Tool):
+    def __init__(self, *args, symbol_cache: "SymbolCache" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._symbol_cache = symbol_cache or SymbolCache()
+
+    def call(self, name: str, path: str = ".", max_results: int = 50) -> str:
+        """
+        Finds where Python classes, functions and methods named `name` are
+        defined under `path`. Returns `file:start_line-end_line` for each
+        definition, so it can be read with `read_file` or edited with
+        `replace_lines` directly.
+
+        Args:
+            name (str): The name to find, e.g. `get_partial`, `Tool.get_partial` or `Tool.*`. Shell-style wildcards are allowed.
+            path (str): The directory to search. Defaults to the current directory.
+            max_results (int): Maximum number of definitions to return. Defaults to 50.
+        """
+        root = os.path.abspath(os.path.expanduser(path))
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f'"{path}" is not a directory')
+
+        state = _shared_state(self)
+        results = []
+        for rel_path, st in sorted(_walk_files(root, suffixes=(".py",))):
+            symbols, _ = self._symbol_cache.get(os.path.join(root, rel_path), st=st, state=state)
+            for symbol in symbols:
+                if _symbol_matches(symbol.name, name):
+                    results.append((rel_path, symbol))
+
+        self._symbol_cache.save()
+
+        output = "".join(
+            f"{os.path.join(path, rel_path)}:{s.start_line}-{s.end_line}: {s.signature}  [{s.name}]\n"
+            for rel_path, s in results[:max_results]
+        )
+        if len(results) > max_results:
+            output += f"[{len(results) - max_results} more definitions not shown.]\n"
+        elif not results:
+            output += f"No definitions of {name!r} found in {path}.\n"
+
+        return output
+
+
+def _shared_state(tool: Tool):
+    return tool._state if isinstance(tool._state, State) else None
+
+
+def _symbol_matches(qualname: str, pattern: str) -> bool:
+    if any(c in pattern for c in "*?["):
+        return fnmatch.fnmatchcase(qualname, pattern) or fnmatch.fnmatchcase(qualname.rsplit(".", 1)[-1], pattern)
+    return qualname == pattern or qualname.endswith("." + pattern)
+
+
+class Symbol(NamedTuple):
+    kind: str
+    name: str
+    signature: str
+    start_line: int
+    end_line: int
+    depth: int
+
+
+def parse_symbols(source) -> list[Symbol]:
+    """Returns the classes and functions defined in Python source code, in
+    order, with qualified names like `Tool.get_partial`. `start_line`
+    includes decorators."""
+    tree = ast.parse(source)
+    symbols = []
+
+    def visit(node, prefix, depth):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(child, ast.ClassDef):
+                    kind = "class"
+                    bases = [ast.unparse(b) for b in child.bases] + [ast.unparse(k) for k in child.keywords]
+                    signature = f"class {child.name}" + (f"({', '.join(bases)})" if bases else "")
+                else:
+                    kind = "async def" if isinstance(child, ast.AsyncFunctionDef) else "def"
+                    signature = f"{kind} {child.name}({ast.unparse(child.args)})"
+                    if child.returns:
+                        signature += f" -> {ast.unparse(child.returns)}"
+
+                start_line = min([d.lineno for d in child.decorator_list] + [child.lineno])
+                symbols.append(
+                    Symbol(kind, prefix + child.name, signature, start_line, child.end_lineno, depth)
+                )
+                visit(child, prefix + child.name + ".", depth + 1)
+            else:
+                visit(child, prefix, depth)
+
+    visit(tree, "", 0)
+    return symbols
+
+
+SYMBOL_CACHE_FORMAT_VERSION = 1
+MAX_SYMBOL_CACHE_FILES = 50_000
+
+
+class SymbolCache:
+    """Parsed symbols per file, kept on disk between sessions. An entry is
+    reused while the file's size and mtime are unchanged and `State` has not
+    recorded an update to it."""
+
+    def __init__(self):
+        self.path = os.path.join(cache_dir("symbols"), "symbols.pickle")
+        self._entries = None
+        self._dirty = False
+
+    @property
+    def entries(self) -> dict:
+        if self._entries is None:
+            data = load_pickle(self.path)
+            self._entries = {}
+            if data and data.get("format") == SYMBOL_CACHE_FORMAT_VERSION:
+                # State versions are only meaningful within a session
+                for path, (size, mtime_ns, _, symbols, error) in data["entries"].items():
+                    self._entries[path] = (size, mtime_ns, 0, symbols, error)
+        return self._entries
+
+    def get(self, path: str, st=None, state: State = None):
+        "Returns the symbols defined in the file and the parse error, if any."
+        path = os.path.abspath(path)
+        if st is None:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'The file "{path}" does not exist')
+            st = os.stat(path)
+
+        version = state.last_update_version(path) if state else 0
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns and entry[2] >= version:
+            return entry[3], entry[4]
+
+        with open(path, 'rb') as f:
+            source = f.read()
+
+        try:
+            symbols, error = parse_symbols(source), None
+        except (SyntaxError, ValueError) as e:
+            symbols, error = [], str(e)
+
+        self.entries.pop(path, None)
+        self.entries[path] = (st.st_size, st.st_mtime_ns, version, symbols, error)
+        if len(self.entries) > MAX_SYMBOL_CACHE_FILES:
+            del self.entries[next(iter(self.entries))]
+        self._dirty = True
+
+        return symbols, error
+
+    def save(self):
+        if self._dirty:
+            save_pickle(self.path, {"format": SYMBOL_CACHE_FORMAT_VERSION, "entries": self.entries})
+            self._dirty = False
+
+
+# Directories that are never indexed
+IGNORED_DIR_PREFIXES = ('.',)
+IGNORED_DIRS = ('__pycache__', 'node_modules')
+
+# Text files larger than this are not indexed; they are always searched
+MAX_INDEXED_FILE_SIZE = 4 * 1024 * 1024
+MAX_LINE_LENGTH = 300
+INDEX_FORMAT_VERSION = 2
+
+
+class _IndexedFile:
+    __slots__ = ("id", "size", "mtime_ns", "version", "binary", "indexed")
+
+    def __init__(self, id, size, mtime_ns, version, binary, indexed):
+        self.id = id
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.version = version
+        self.binary = binary
+        # False for text files that were too large to index
+        self.indexed = indexed
+
+    def __getstate__(self):
+        return (self.id, self.size, self.mtime_ns, self.version, self.binary, self.indexed)
+
+    def __setstate__(self, state):
+        self.id, self.size, self.mtime_ns, self.version, self.binary, self.indexed = state
+
+
+class TrigramIndex:
+    """An index from lowercase trigrams to the files under `root` containing
+    them. A query only scans the files that contain every trigram of the
+    literal text it requires.
+
+    Each file gets a new integer id whenever it is (re-)indexed, and posting
+    lists are compact arrays of ids. Ids of removed or re-indexed files are
+    filtered out at query time and purged once they outnumber the live ones.
+
+    The index is kept on disk between sessions and updated incrementally:
+    files are re-indexed when their size or mtime changes, or when `State`
+    records an update to them.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files = {}
+        self.paths = {}
+        self.postings = {}
+        self.next_id = 0
+        self.n_dead = 0
+        self.path = os.path.join(cache_dir("trigram"), cache_key(root) + ".pickle")
+        # State version of the last full walk of the tree in this session
+        self.walked_at = None
+
+    @classmethod
+    def load(cls, root: str) -> "TrigramIndex":
+        index = cls(root)
+        data = load_pickle(index.path)
+        if data and data.get("format") == INDEX_FORMAT_VERSION and data.get("root") == root:
+            index.files = data["files"]
+            index.postings = data["postings"]
+            index.next_id = data["next_id"]
+            index.n_dead = data["n_dead"]
+            for rel_path, entry in index.files.items():
+                # State versions are only meaningful within a session
+                entry.version = 0
+                index.paths[entry.id] = rel_path
+        return index
+
+    def save(self):
+        save_pickle(self.path, {
+            "format": INDEX_FORMAT_VERSION,
+            "root": self.root,
+            "files": self.files,
+            "postings": self.postings,
+            "next_id": self.next_id,
+            "n_dead": self.n_dead,
+        })
+
+    def refresh(self, state: State = None) -> bool:
+        """Re-indexes changed files. Returns whether anything changed.
+
+        When `state` is watching the tree, only the paths it reports as
+        changed since the previous refresh are checked. Otherwise every file
+        is stat-ed."""
+        if state is not None and self.walked_at is not None:
+            version = state.version
+            changed_paths = state.changed_paths_since(self.walked_at, self.root)
+            if changed_paths is not None:
+                changed = self._refresh_paths(changed_paths, state)
+                self.walked_at = version
+                return changed
+
+        changed = False
+        seen = set()
+        version = state.version if state is not None else None
+
+        for rel_path, st in _walk_files(self.root):
+            seen.add(rel_path)
+            changed |= self._refresh_file(rel_path, st, state)
+
+        for rel_path in set(self.files) - seen:
+            self._remove(rel_path)
+            changed = True
+
+        if self.n_dead > max(len(self.files), 1000):
+            self._compact()
+
+        self.walked_at = version
+        return changed
+
+    def _refresh_paths(self, paths: set, state: State) -> bool:
+        changed = False
+        prefix = os.path.join(self.root, "")
+
+        for path in paths:
+            if path == self.root:
+                rel_path = ""
+            elif path.startswith(prefix):
+                rel_path = path[len(prefix):]
+            else:
+                continue
+
+            is_dir = os.path.isdir(path)
+            dir_parts = rel_path.split(os.sep) if is_dir and rel_path else rel_path.split(os.sep)[:-1]
+            if any(part.startswith(IGNORED_DIR_PREFIXES) or part in IGNORED_DIRS for part in dir_parts):
+                continue
+
+            # A changed directory may have been created, moved or deleted, so
+            # everything indexed under it is checked
+            if rel_path in self.files:
+                indexed = {rel_path}
+            else:
+                dir_prefix = os.path.join(rel_path, "")
+                indexed = {r for r in self.files if r.startswith(dir_prefix)}
+
+            if is_dir:
+                current = {os.path.join(rel_path, r): st for r, st in _walk_files(path)}
+            else:
+                try:
+                    current = {rel_path: os.stat(path)} if os.path.isfile(path) else {}
+                except OSError:
+                    current = {}
+
+            for file_rel_path, st in current.items():
+                changed |= self._refresh_file(file_rel_path, st, state)
+
+            for file_rel_path in indexed - current.keys():
+                self._remove(file_rel_path)
+                changed = True
+
+        return changed
+
+    def _refresh_file(self, rel_path: str, st, state: State = None) -> bool:
+        "Re-indexes the file if it changed. Returns whether it did."
+        version = state.last_update_version(os.path.join(self.root, rel_path)) if state else 0
+
+        entry = self.files.get(rel_path)
+        if (
+            entry is not None
+            and entry.size == st.st_size
+            and entry.mtime_ns == st.st_mtime_ns
+            and entry.version >= version
+        ):
+            return False
+
+        self._index_file(rel_path, st, version)
+        return True
+
+    def search(self, pattern: re.Pattern, literals: list[str], max_results: int):
+        """Returns the lines matching `pattern` as (path, line number, line)
+        tuples, and whether the results were truncated at `max_results`.
+
+        `literals` are strings that every match must contain. They are used
+        to narrow down the files to scan.
+        """
+        # Checking the whole file first lets files without a match be skipped
+        # at C speed. A line match implies a whole-text match in MULTILINE
+        # mode, except for patterns anchored with \A or \Z.
+        prefilter = None
+        if "\\A" not in pattern.pattern and "\\Z" not in pattern.pattern:
+            prefilter = re.compile(pattern.pattern, pattern.flags | re.MULTILINE)
+
+        matches = []
+        for rel_path in sorted(self._candidates(literals)):
+            try:
+                with open(os.path.join(self.root, rel_path), 'r', encoding='utf-8', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                logger.exception(f"Error searching file: {rel_path}")
+                continue
+
+            if prefilter and not prefilter.search(text):
+                continue
+
+            for line_number, line in enumerate(text.splitlines(), 1):
+                if pattern.search(line):
+                    if len(line) > MAX_LINE_LENGTH:
+                        line = line[:MAX_LINE_LENGTH] + "..."
+                    matches.append((rel_path, line_number, line))
+                    if len(matches) >= max_results:
+                        return matches, True
+
+        return matches, False
+
+    def _candidates(self, literals: list[str]):
+        trigrams = set()
+        for literal in literals:
+            literal = literal.lower()
+            trigrams.update(literal[i:i + 3] for i in range(len(literal) - 2))
+
+        if not trigrams:
+            return [p for p, e in self.files.items() if not e.binary]
+
+        posting_lists = sorted((self.postings.get(t, ()) for t in trigrams), key=len)
+        ids = set(posting_lists[0])
+        for posting in posting_lists[1:]:
+            if not ids:
+                break
+            ids.intersection_update(posting)
+
+        candidates = [self.paths[i] for i in ids if i in self.paths]
+        candidates += [p for p, e in self.files.items() if not e.indexed and not e.binary]
+        return candidates
+
+    def _index_file(self, rel_path: str, st, version: int):
+        self._remove(rel_path)
+
+        binary = False
+        trigrams = None
+        if st.st_size <= MAX_INDEXED_FILE_SIZE:
+            try:
+                with open(os.path.join(self.root, rel_path), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return
+
+            if b"\0" in data[:8192]:
+                binary = True
+            else:
+                # Matches never span lines, so trigrams are taken per unique line
+                trigrams = set()
+                for line in set(data.decode('utf-8', errors='replace').lower().splitlines()):
+                    trigrams.update(line[i:i + 3] for i in range(len(line) - 2))
+
+        file_id = self.next_id
+        self.next_id += 1
+
+        self.files[rel_path] = _IndexedFile(file_id, st.st_size, st.st_mtime_ns, version, binary, trigrams is not None)
+        self.paths[file_id] = rel_path
+
+        postings = self.postings
+        for trigram in trigrams or ():
+            posting = postings.get(trigram)
+            if posting is None:
+                posting = postings[trigram] = array('I')
+            posting.append(file_id)
+
+    def _remove(self, rel_path: str):
+        entry = self.files.pop(rel_path, None)
+        if entry is not None:
+            del self.paths[entry.id]
+            self.n_dead += 1
+
+    def _compact(self):
+        "Drops the ids of removed files from the posting lists."
+        live = self.paths
+        for trigram, posting in list(self.postings.items()):
+            posting = array('I', (i for i in posting if i in live))
+            if posting:
+                self.postings[trigram] = posting
+            else:
+                del self.postings[trigram]
+        self.n_dead = 0
+
+
+def _walk_files(root: str, suffixes: tuple = None):
+    "Yields the relative path and stat of every file under `root` that is not in an ignored directory."
+    prefix_length = len(os.path.join(root, ""))
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith(IGNORED_DIR_PREFIXES) and entry.name not in IGNORED_DIRS:
+                    stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                if suffixes is None or entry.name.endswith(suffixes):
+                    yield entry.path[prefix_length:], entry.stat()
+
+
+def _required_literals(pattern: str, flags: int = 0) -> list[str]:
+    """Literal strings that every match of the regular expression must
+    contain. Returns an empty list when none can be determined, e.g. for
+    top-level alternations."""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return []
+
+    literals = []
+    current = ""
+    for op, arg in parsed:
+        if op is sre_constants.LITERAL:
+            current += chr(arg)
+        else:
+            literals.append(current)
+            current = ""
+    literals.append(current)
+
+    return [literal for literal in literals if len(literal) >= 3]
@@ -1,13 +1,69 @@
+import concurrent.futures
 import csv
+import fnmatch
 import io
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
 import sqlalchemy as sa
-from typing import Tuple, List
+from sqlalchemy.engine.reflection import ObjectKind
+from typing import NamedTuple, Optional, Tuple, List, Iterator
 
-from toolshop.core.base import Tool
+from toolshop.core.base import State, Tool
+from toolshop.core.budget import ResultBudget
+from toolshop.core.cache import cache_dir
+from toolshop.core.logging import logger
+
+
+SQL_ROWS_PER_CHUNK = 1000
+
+# Rows inserted per executemany() call by `LoadTable`
+LOAD_ROWS_PER_CHUNK = 10_000
+
+# Rows used to infer the column types of a table
+SCHEMA_SAMPLE_ROWS = 1000
+
+# Seconds a reflected database schema is reused before it is reflected again
+SCHEMA_CACHE_TTL = 300.0
+
+# Without a `tables` filter, `GetTableSchema` only lists the tables of
+# databases with more tables than this
+MAX_DESCRIBED_TABLES = 50
+
+
+def make_data_tools(tools: list[str] = None, state: State = None):
+    """Creates a set of data tools that share a cache of database schemas.
+
+    Args:
+        tools (list[str], optional): A list of tool names to include. If None,
+            all tools are included. Defaults to None.
+    """
+    if state is None:
+        state = State()
+
+    schema_cache = SchemaCache()
+
+    sql = Sql(state=state)
+    load_table = LoadTable(state=state, schema_cache=schema_cache)
+    get_table_schema = GetTableSchema(state=state, schema_cache=schema_cache)
+    histogram = Histogram(state=state)
+
+    if not tools:
+        tools = ["sql", "load_table", "get_table_schema", "histogram"]
+
+    x = locals()
+    return [x[tool_name] for tool_name in tools]
 
 
 class Sql(Tool):
-    def call(self, sql_query: str, database_uri: str) -> str:
+    _has_side_effects = True
+    _result_budget = ResultBudget(strategy="spill")
+
+    def call(self, sql_query: str, database_uri: str) -> Iterator[str]:
         """Runs the sql query and returns result set as a CSV string. Always try 
         this tool for running sql queries first before trying other methods.
         
@@ -22,20 +78,590 @@ class Sql(Tool):
         """
         engine = sa.create_engine(database_uri)
 
-        # Execute the query and fetch results using a connection
+        # Execute the query and stream the CSV in batches of rows, using a
+        # server-side cursor where the dialect supports one
         with engine.connect() as connection:
-            result = connection.execute(sa.text(sql_query))
-            column_names = result.keys()
-            
+            result = connection.execution_options(
+                stream_results=True,
+                yield_per=SQL_ROWS_PER_CHUNK
+            ).execute(sa.text(sql_query))
+
+            # Statements like CREATE TABLE or INSERT return no rows. They are
+            # rolled back when the connection closes, so they change nothing.
+            if not result.returns_rows:
+                raise ValueError(
+                    "The statement returned no rows. sql only runs queries, and changes "
+                    "made by statements like INSERT or CREATE TABLE are not kept."
+                )
+
             # Use csv module to create CSV formatted string
             output = io.StringIO()
             csv_writer = csv.writer(output)
-            csv_writer.writerow(column_names)
+            csv_writer.writerow(result.keys())
 
-            for row in result:
-                csv_writer.writerow(row)
-        
-        return output.getvalue()
+            for rows in result.partitions():
+                csv_writer.writerows(rows)
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+
+            if output.tell():
+                yield output.getvalue()
+
+
+class LoadTable(Tool):
+    _has_side_effects = True
+
+    def __init__(self, *args, schema_cache: "SchemaCache" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._schema_cache = schema_cache
+
+    def concurrency_key(self, path, table=None, database_path=None, *args, **kwargs):
+        return os.path.abspath(os.path.expanduser(database_path or _default_database_path()))
+
+    def call(self, path: str, table: str = None, database_path: str = None) -> str:
+        """Loads a CSV, TSV, JSONL or Parquet file into a local SQL database
+        table and returns the database_uri to query it with `sql`. Use this
+        instead of python_exec to analyze data files. Files of any size can
+        be loaded, since they are streamed in chunks. An existing table with
+        the same name is replaced.
+
+        Args:
+            path (str): The path to the data file.
+            table (str): The name of the table. Defaults to the name of the file.
+            database_path (str): The SQLite database to load into, or a DuckDB
+                database if it ends with .duckdb. Defaults to a scratch SQLite
+                database shared by all loaded tables, so they can be joined.
+        """
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'The file "{path}" does not exist')
+
+        file_format = _data_file_format(path)
+        table = table or _sanitize_name(os.path.splitext(os.path.basename(path))[0])
+        database_path = os.path.abspath(os.path.expanduser(database_path or _default_database_path()))
+
+        if database_path.endswith(".duckdb"):
+            columns, types, n_rows = _load_duckdb(database_path, table, path, file_format)
+            uri = f"duckdb:///{database_path}"
+        else:
+            columns, types, n_rows = _load_file_into_sqlite(database_path, table, path, file_format)
+            uri = f"sqlite:///{database_path}"
+
+        if self._schema_cache is not None:
+            self._schema_cache.invalidate(uri)
+
+        schema = ", ".join(f"{c} {t}" for c, t in zip(columns, types))
+        return (
+            f"Loaded {n_rows} rows into table {table} ({schema}).\n"
+            f"Query it with sql(database_uri=\"{uri}\").\n"
+        )
+
+
+def _load_file_into_sqlite(database_path: str, table: str, path: str, file_format: str):
+    # Columns found to need TEXT only after the sample, when the file is
+    # loaded again
+    text_columns = set()
+    while True:
+        if file_format == "parquet":
+            columns, rows = _read_parquet(path)
+        elif file_format == "jsonl":
+            columns, rows = _read_jsonl(path)
+        else:
+            columns, rows = _read_csv(path, delimiter="\t" if file_format == "tsv" else None)
+
+        if not columns:
+            rows.close()
+            raise ValueError(f"{path} has no columns. The file is empty or has no header row.")
+
+        # Infer the schema from a sample, then stream the rest
+        sample = list(itertools.islice(rows, SCHEMA_SAMPLE_ROWS))
+        types = [
+            "TEXT" if i in text_columns else _infer_type(row[i] for row in sample)
+            for i in range(len(columns))
+        ]
+
+        try:
+            n_rows = _insert_rows(database_path, table, columns, types, itertools.chain(sample, rows))
+        except _TextInNumericColumn as e:
+            logger.info(f"Loading {path} again with column {columns[e.column]} as TEXT")
+            text_columns.add(e.column)
+            continue
+        finally:
+            rows.close()
+        return columns, types, n_rows
+
+
+def _default_database_path() -> str:
+    return os.path.join(cache_dir("tables"), "tables.db")
+
+
+def _data_file_format(path: str) -> str:
+    name = path.lower()
+    if name.endswith(".gz"):
+        raise ValueError("Compressed files are not supported. Decompress the file first.")
+
+    extension = os.path.splitext(name)[1]
+    formats = {
+        ".csv": "csv", ".tsv": "tsv", ".tab": "tsv",
+        ".jsonl": "jsonl", ".ndjson": "jsonl",
+        ".parquet": "parquet", ".pq": "parquet",
+    }
+    if extension not in formats:
+        raise ValueError(f"Unsupported data file type: {extension}. Use a CSV, TSV, JSONL or Parquet file.")
+    return formats[extension]
+
+
+def _sanitize_name(name: str) -> str:
+    name = re.sub(r"\W+", "_", name.strip()).strip("_")
+    if not name or name[0].isdigit():
+        name = "t_" + name
+    return name
+
+
+def _unique_names(names) -> list:
+    unique = []
+    for i, name in enumerate(names):
+        name = _sanitize_name(str(name)) if name else f"column_{i + 1}"
+        candidate, n = name, 2
+        while candidate in unique:
+            candidate, n = f"{name}_{n}", n + 1
+        unique.append(candidate)
+    return unique
+
+
+def _read_csv(path: str, delimiter: str = None):
+    f = open(path, "r", newline="", encoding="utf-8", errors="replace")
+    if delimiter is None:
+        try:
+            delimiter = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;|\t").delimiter
+        except csv.Error:
+            delimiter = ","
+        f.seek(0)
+
+    reader = csv.reader(f, delimiter=delimiter)
+    header = next(reader, [])
+    columns = _unique_names(header)
+
+    def rows():
+        with f:
+            for row in reader:
+                # Pad or cut rows to the width of the header
+                if len(row) != len(columns):
+                    row = (row + [None] * len(columns))[:len(columns)]
+                yield [None if v == "" else v for v in row]
+
+    return columns, rows()
+
+
+def _read_jsonl(path: str):
+    f = open(path, "r", encoding="utf-8", errors="replace")
+    records = (json.loads(line) for line in f if line.strip())
+
+    # Columns are the keys found in the sample. Keys that first appear later
+    # are dropped.
+    sample = list(itertools.islice(records, SCHEMA_SAMPLE_ROWS))
+    keys = list(dict.fromkeys(k for record in sample for k in record))
+    columns = _unique_names(keys)
+
+    def rows():
+        with f:
+            for record in itertools.chain(sample, records):
+                yield [_json_value(record.get(k)) for k in keys]
+
+    return columns, rows()
+
+
+def _json_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _read_parquet(path: str):
+    # Check if pyarrow is installed, since it is an optional dependency.
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "pyarrow is not installed. Please install it using 'pip install pyarrow'."
+        )
+
+    parquet_file = pq.ParquetFile(path)
+    columns = _unique_names(parquet_file.schema_arrow.names)
+
+    def rows():
+        for batch in parquet_file.iter_batches(batch_size=LOAD_ROWS_PER_CHUNK):
+            for record in zip(*(c.to_pylist() for c in batch.columns)):
+                yield [_json_value(v) for v in record]
+
+    return columns, rows()
+
+
+def _has_leading_zero(value: str) -> bool:
+    "Whether the value is a number written with a leading zero, like a zip code or an id."
+    digits = value.strip().lstrip("+-")
+    return len(digits) > 1 and digits[0] == "0" and digits[1].isdigit()
+
+
+def _infer_type(values) -> str:
+    """The narrowest of INTEGER, REAL and TEXT that fits all the values.
+    Numbers with leading zeros are TEXT, since converting them loses the zeros."""
+    inferred = "INTEGER"
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or isinstance(value, int):
+            continue
+        if isinstance(value, float):
+            inferred = "REAL"
+            continue
+        if not isinstance(value, str) or _has_leading_zero(value):
+            return "TEXT"
+
+        if inferred == "INTEGER":
+            try:
+                int(value)
+                continue
+            except ValueError:
+                inferred = "REAL"
+        try:
+            float(value)
+        except ValueError:
+            return "TEXT"
+    return inferred
+
+
+class _TextInNumericColumn(Exception):
+    "A value after the sample must be stored as text in a column inferred as numeric."
+
+    def __init__(self, column: int):
+        super().__init__(column)
+        self.column = column
+
+
+def _convert_row(row: list, types: list) -> list:
+    converted = []
+    for i, (value, column_type) in enumerate(zip(row, types)):
+        if isinstance(value, str) and column_type != "TEXT":
+            # SQLite would store the value as a number in a numeric column
+            # and drop its zeros, whether it is converted here or not
+            if _has_leading_zero(value):
+                raise _TextInNumericColumn(i)
+            try:
+                value = int(value) if column_type == "INTEGER" else float(value)
+            except ValueError:
+                # Other values that do not match the sample are stored as text
+                pass
+        converted.append(value)
+    return converted
+
+
+def _insert_rows(database_path: str, table: str, columns: list, types: list, rows) -> int:
+    def quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    connection = sqlite3.connect(database_path)
+    try:
+        with connection:
+            connection.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+            connection.execute(
+                f"CREATE TABLE {quote(table)} ({', '.join(f'{quote(c)} {t}' for c, t in zip(columns, types))})"
+            )
+
+            insert = f"INSERT INTO {quote(table)} VALUES ({', '.join('?' * len(columns))})"
+            n_rows = 0
+            while True:
+                chunk = [_convert_row(row, types) for row in itertools.islice(rows, LOAD_ROWS_PER_CHUNK)]
+                if not chunk:
+                    break
+                connection.executemany(insert, chunk)
+                n_rows += len(chunk)
+    finally:
+        connection.close()
+
+    return n_rows
+
+
+def _load_duckdb(database_path: str, table: str, path: str, file_format: str):
+    # Check if duckdb is installed, since it is an optional dependency.
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError(
+            "duckdb is not installed. Please install it using 'pip install duckdb duckdb-engine'."
+        )
+
+    # DuckDB reads the file itself, in parallel and without going through Python
+    readers = {
+        "csv": "read_csv_auto(?)",
+        "tsv": "read_csv_auto(?, delim='\\t')",
+        "jsonl": "read_json_auto(?, format='newline_delimited')",
+        "parquet": "read_parquet(?)",
+    }
+    quoted_table = '"' + table.replace('"', '""') + '"'
+
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+    connection = duckdb.connect(database_path)
+    try:
+        connection.execute(f"CREATE OR REPLACE TABLE {quoted_table} AS SELECT * FROM {readers[file_format]}", [path])
+        n_rows = connection.execute(f"SELECT count(*) FROM {quoted_table}").fetchone()[0]
+        schema = connection.execute(f"DESCRIBE {quoted_table}").fetchall()
+    finally:
+        connection.close()
+
+    return [c[0] for c in schema], [c[1] for c in schema], n_rows
+
+
+class GetTableSchema(Tool):
+    _result_budget = ResultBudget(strategy="spill")
+
+    def __init__(self, *args, schema_cache: "SchemaCache" = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._schema_cache = schema_cache or SchemaCache()
+
+    def call(self, database_uri: str, tables: list[str] = None, schema: str = None) -> str:
+        """Describes the tables and views of a database: their columns,
+        primary and foreign keys, indexes and estimated row counts. Use this
+        instead of querying information_schema or running SELECT * ... LIMIT
+        queries to learn the shape of the data. Works with any database_uri
+        accepted by `sql`.
+
+        Args:
+            database_uri (str): The database connection string which is passed
+                to sqlalchemy.create_engine().
+            tables (list[str]): Names of the tables to describe. Shell-style
+                wildcards are allowed, e.g. ["orders", "customer_*"]. Defaults to
+                all tables, which are only listed if there are many.
+            schema (str): The schema (or dataset) of the tables. Defaults to the
+                default schema of the connection.
+        """
+        described = self._schema_cache.get(database_uri, schema)
+
+        if tables:
+            selected = [t for t in described.values() if any(fnmatch.fnmatch(t.name, p) for p in tables)]
+            if not selected:
+                return f"No tables match {tables}. The tables are: {', '.join(described)}\n"
+        else:
+            selected = list(described.values())
+            if len(selected) > MAX_DESCRIBED_TABLES:
+                return (
+                    f"{len(selected)} tables. Pass `tables` to describe some of them.\n"
+                    + "".join(f"{_table_heading(t)}\n" for t in selected)
+                )
+
+        if not selected:
+            return "The database has no tables.\n"
+
+        return "\n".join(_describe_table(t) for t in selected)
+
+
+class TableSchema(NamedTuple):
+    name: str
+    kind: str
+    # (name, type, nullable, default) tuples
+    columns: list
+    primary_key: list
+    # (columns, referred table, referred columns) tuples
+    foreign_keys: list
+    # (name, columns, unique) tuples
+    indexes: list
+    row_estimate: Optional[int]
+
+
+def _table_heading(table: TableSchema) -> str:
+    heading = table.name if table.kind == "table" else f"{table.name} ({table.kind})"
+    if table.row_estimate is not None:
+        heading += f"  ~{table.row_estimate:,} rows"
+    return heading
+
+
+def _describe_table(table: TableSchema) -> str:
+    lines = [_table_heading(table)]
+    for name, column_type, nullable, default in table.columns:
+        line = f"    {name} {column_type}"
+        if not nullable:
+            line += " NOT NULL"
+        if default is not None:
+            line += f" DEFAULT {default}"
+        if name in table.primary_key and len(table.primary_key) == 1:
+            line += " PRIMARY KEY"
+        lines.append(line)
+
+    if len(table.primary_key) > 1:
+        lines.append(f"    primary key ({', '.join(table.primary_key)})")
+    for columns, referred_table, referred_columns in table.foreign_keys:
+        lines.append(f"    foreign key ({', '.join(columns)}) -> {referred_table} ({', '.join(referred_columns)})")
+    for name, columns, unique in table.indexes:
+        lines.append(f"    {'unique index' if unique else 'index'} {name} ({', '.join(columns)})")
+
+    return "\n".join(lines) + "\n"
+
+
+class SchemaCache:
+    """Reflected database schemas, per database URI and schema. A schema is
+    reflected again when it is older than `ttl` seconds, or after it is
+    invalidated.
+
+    Concurrent requests for the same schema share a single reflection.
+    """
+
+    def __init__(self, ttl: float = SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, uri: str, schema: str = None) -> dict:
+        "The schemas of the tables in the database, by table name."
+        key = (uri, schema)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = concurrent.futures.Future()
+                reflect = True
+            else:
+                reflect = False
+
+        if reflect:
+            self._reflect(key, future)
+        return future.result()
+
+    def invalidate(self, uri: str = None):
+        "Drops the schemas of the database at `uri`, or of every database."
+        with self._lock:
+            for entries in (self._entries, self._pending):
+                for key in list(entries):
+                    if uri is None or key[0] == uri:
+                        del entries[key]
+
+    def _reflect(self, key, future):
+        started_at = time.monotonic()
+        try:
+            tables = reflect_tables(*key)
+        except Exception as e:
+            logger.debug(f"Could not reflect the schema {key[1]} of {key[0]}: {e}")
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            # An invalidation during the reflection may have dropped the
+            # pending future, in which case the result may be stale
+            if self._pending.get(key) is future:
+                self._entries[key] = (started_at, tables)
+                del self._pending[key]
+        future.set_result(tables)
+
+
+def reflect_tables(uri: str, schema: str = None) -> dict:
+    """Reflects the tables and views of a database with a handful of bulk
+    queries, rather than a few queries per table."""
+    engine = sa.create_engine(uri)
+    try:
+        with engine.connect() as connection:
+            inspector = sa.inspect(connection)
+
+            columns = inspector.get_multi_columns(schema=schema, kind=ObjectKind.ANY)
+            views = set(inspector.get_view_names(schema=schema))
+            views.update(_safe_reflect(inspector.get_materialized_view_names, schema=schema) or ())
+
+            primary_keys = _safe_reflect(inspector.get_multi_pk_constraint, schema=schema) or {}
+            foreign_keys = _safe_reflect(inspector.get_multi_foreign_keys, schema=schema) or {}
+            indexes = _safe_reflect(inspector.get_multi_indexes, schema=schema) or {}
+            row_estimates = _safe_reflect(_row_estimates, connection, schema) or {}
+    finally:
+        engine.dispose()
+
+    tables = {}
+    for key in sorted(columns, key=lambda k: k[1]):
+        name = key[1]
+        tables[name] = TableSchema(
+            name=name,
+            kind="view" if name in views else "table",
+            columns=[
+                (c["name"], _type_name(c["type"]), c.get("nullable", True), c.get("default"))
+                for c in columns[key]
+            ],
+            primary_key=(primary_keys.get(key) or {}).get("constrained_columns") or [],
+            foreign_keys=[
+                (
+                    fk["constrained_columns"],
+                    f"{fk['referred_schema']}.{fk['referred_table']}" if fk.get("referred_schema") else fk["referred_table"],
+                    fk["referred_columns"],
+                )
+                for fk in foreign_keys.get(key, [])
+            ],
+            indexes=[(ix["name"], ix["column_names"], bool(ix.get("unique"))) for ix in indexes.get(key, [])],
+            row_estimate=row_estimates.get(name),
+        )
+
+    return tables
+
+
+def _safe_reflect(method, *args, **kwargs):
+    "Calls a reflection method that some dialects do not implement."
+    try:
+        return method(*args, **kwargs)
+    except (NotImplementedError, sa.exc.SQLAlchemyError) as e:
+        logger.debug(f"Reflection with {getattr(method, '__name__', method)} failed: {e}")
+        return None
+
+
+def _type_name(column_type) -> str:
+    try:
+        return str(column_type)
+    except Exception:
+        return type(column_type).__name__
+
+
+def _row_estimates(connection, schema: str = None) -> dict:
+    """Estimated row counts by table name, read from the statistics the
+    database keeps, so that no table is scanned."""
+    dialect = connection.dialect.name
+
+    if dialect == "postgresql":
+        rows = connection.execute(sa.text(
+            "SELECT c.relname, c.reltuples FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relkind IN ('r', 'p', 'm') AND n.nspname = coalesce(:schema, current_schema())"
+        ), {"schema": schema})
+    elif dialect in ("mysql", "mariadb"):
+        rows = connection.execute(sa.text(
+            "SELECT table_name, table_rows FROM information_schema.tables "
+            "WHERE table_schema = coalesce(:schema, database())"
+        ), {"schema": schema})
+    elif dialect == "duckdb":
+        rows = connection.execute(sa.text(
+            "SELECT table_name, estimated_size FROM duckdb_tables() "
+            "WHERE schema_name = coalesce(:schema, current_schema())"
+        ), {"schema": schema})
+    elif dialect == "sqlite":
+        # The largest rowid is found with an index lookup, and equals the row
+        # count of tables that rows were only appended to
+        prefix = f'"{schema}".' if schema else ""
+        names = connection.execute(sa.text(
+            f"SELECT name FROM {prefix}sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )).scalars().all()
+        rows = []
+        for name in names:
+            quoted = name.replace('"', '""')
+            try:
+                rows.append((name, connection.execute(sa.text(f'SELECT max(rowid) FROM {prefix}"{quoted}"')).scalar() or 0))
+            except sa.exc.SQLAlchemyError:
+                # WITHOUT ROWID tables
+                continue
+    else:
+        return {}
+
+    return {name: int(count) for name, count in rows if count is not None and count >= 0}
 
 
 class Histogram(Tool):
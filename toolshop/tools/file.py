@@ -1,10 +1,17 @@
 """This module contains tools for reading and writing files."""
 
+import concurrent.futures
 import pathlib
 import os
-from typing import Optional
+import time
+from typing import Optional, Iterator
 
 from ..core.base import Tool, State
+from ..core.budget import ResultBudget, estimate_tokens
+from ..core.dirtree import DirectoryTree, compile_glob
+from ..core.filecache import FileCache
+from ..core.journal import EditJournal
+from ..core.textfile import display_text, read_text_lines, write_text_lines
 from ..core.logging import logger
 
 
@@ -19,20 +26,44 @@ def make_file_tools(tools: list[str] = None, state: State = None):
         state = State()
     
     read_file = ReadFile(state=state)
+    read_files = ReadFiles(state=state)
     read_directory = ReadDirectory(state=state)
+    find_files = FindFiles(state=state)
     create_file = CreateFile(state=state)
     replace_lines = ReplaceLines(state=state)
     insert_lines = InsertLines(state=state)
     delete_lines = DeleteLines(state=state)
+    checkpoint = Checkpoint(state=state)
+    undo = Undo(state=state)
     
     if not tools:
-        tools = ["read_file", "read_directory", "create_file", "replace_lines", "insert_lines", "delete_lines"]
+        tools = [
+            "read_file", "read_files", "read_directory", "find_files", "create_file",
+            "replace_lines", "insert_lines", "delete_lines", "checkpoint", "undo"
+        ]
     
     x = locals()
     return [x[tool_name] for tool_name in tools]
 
 
-class ReadFile(Tool):
+class FileTool(Tool):
+    """Base class for tools that operate on the single file at `path`."""
+
+    def concurrency_key(self, path, *args, **kwargs):
+        return os.path.abspath(os.path.expanduser(path))
+
+    def file_cache(self) -> Optional[FileCache]:
+        "The file contents cache of the shared state, if there is one."
+        return self._state.file_cache if isinstance(self._state, State) else None
+
+    def edit_journal(self) -> Optional[EditJournal]:
+        "The edit journal of the shared state, if there is one."
+        return self._state.journal if isinstance(self._state, State) else None
+
+
+class ReadFile(FileTool):
+    _result_budget = ResultBudget(strategy="head")
+
     def call(
             self,
             path: str, 
@@ -56,14 +87,92 @@ class ReadFile(Tool):
             path, 
             include_line_numbers=include_line_numbers, 
             start_line=start_line-1 if start_line else None, 
-            end_line=end_line if end_line else None
+            end_line=end_line if end_line else None,
+            cache=self.file_cache()
         )
         self.state.record_file_read(path)
         
         return output
 
 
+# Number of files read at the same time by `ReadFiles`
+READ_FILES_WORKERS = 8
+
+
+class ReadFiles(FileTool):
+    _result_budget = ResultBudget(strategy="head")
+
+    def concurrency_keys(self, files: list, *args, **kwargs):
+        return [self.concurrency_key(spec["path"]) for spec in files if "path" in spec]
+
+    def call(self, files: list[dict], include_line_numbers: bool = True) -> str:
+        """
+        Reads several files, or line ranges of files, in one call. Use this
+        instead of calling `read_file` repeatedly when you know which files
+        you need. Large outputs are shortened so that every file gets a fair
+        share of the output.
+
+        Args:
+            files (list[dict]): The files to read, e.g. `[{"path": "a.py"}, {"path": "b.py", "start_line": 10, "end_line": 40}]`. `start_line` and `end_line` are optional, one-based and inclusive.
+            include_line_numbers (bool): Whether to include line numbers in the returned contents. Defaults to True.
+        """
+        cache = self.file_cache()
+
+        def read(spec):
+            start_line = spec.get("start_line")
+            end_line = spec.get("end_line")
+            return _read_helper(
+                spec["path"],
+                include_line_numbers=include_line_numbers,
+                start_line=start_line - 1 if start_line else None,
+                end_line=end_line if end_line else None,
+                cache=cache
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(READ_FILES_WORKERS, len(files) or 1)) as executor:
+            futures = [executor.submit(read, spec) for spec in files]
+
+        headers, outputs, read_paths = [], [], []
+        for spec, future in zip(files, futures):
+            header = f"===== File: {spec.get('path')}"
+            if spec.get("start_line") or spec.get("end_line"):
+                header += f" (lines {spec.get('start_line') or 1}-{spec.get('end_line') or 'end'})"
+            headers.append(header + " =====\n")
+
+            try:
+                outputs.append(future.result())
+                read_paths.append(spec["path"])
+            except Exception as e:
+                outputs.append(f"Error reading file: {e}\n")
+
+        self.state.record_file_reads(read_paths)
+
+        budgets = _share_budget([estimate_tokens(o) for o in outputs], self.result_budget().max_tokens)
+        return "".join(
+            header + ResultBudget(max_tokens=budget, strategy="head").apply(output, self.__name__) + "\n"
+            for header, output, budget in zip(headers, outputs, budgets)
+        )
+
+
+def _share_budget(sizes: list, budget: Optional[int]) -> list:
+    """Splits a token budget between outputs of the given sizes. Outputs
+    smaller than an equal share are kept whole, and what they leave unused is
+    shared by the larger ones."""
+    if budget is None:
+        return [None] * len(sizes)
+
+    shares = [None] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for n_left, i in zip(range(len(sizes), 0, -1), order):
+        shares[i] = min(sizes[i], remaining // n_left)
+        remaining -= shares[i]
+    return shares
+
+
 class ReadDirectory(Tool):
+    _result_budget = ResultBudget(strategy="spill")
+
     def call(
         self,
         path,
@@ -77,7 +186,7 @@ class ReadDirectory(Tool):
         dirs_suffix_ignorelist=None,
         include_line_numbers=True,
         include_contents=True
-    ):
+    ) -> Iterator[str]:
         """
         Reads the files in a directory.
         """
@@ -137,25 +246,126 @@ class ReadDirectory(Tool):
 
             file_paths += [os.path.join(root, file) for file in files]
 
-        # Gather all file contents into a single string
-        output = ""
+        # Yield the contents file by file so large trees can be streamed
         for file_path in file_paths:
-            try:
-                output += f"===== File: {file_path} =====\n"
-                if include_contents:
-                    output += _read_helper(
+            yield f"===== File: {file_path} =====\n"
+            if include_contents:
+                try:
+                    contents = _read_helper(
                         file_path, 
                         include_line_numbers=include_line_numbers
                     )
-                    output += "\n\n"
-            except Exception:
-                logger.exception(f"Error reading file: {file_path}")
-                output += f"Error reading file: {file_path}\n\n"
+                except Exception:
+                    logger.exception(f"Error reading file: {file_path}")
+                    yield f"Error reading file: {file_path}\n\n"
+                else:
+                    yield contents + "\n\n"
 
-        return output
 
+class FindFiles(Tool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._trees = {}
+
+    def call(
+        self,
+        patterns: list[str],
+        path: str = ".",
+        exclude: list[str] = None,
+        min_size: int = None,
+        max_size: int = None,
+        max_age: float = None,
+        min_age: float = None,
+        sort: str = "path",
+        limit: int = 200,
+        details: bool = False
+    ) -> str:
+        """
+        Finds the files under `path` matching glob patterns, e.g. "*.py" or
+        "src/**/test_*.py". `**` matches any number of directories, and a
+        pattern without `/` matches file names in any directory. Much faster
+        than find or read_directory.
+
+        Args:
+            patterns (list[str]): Glob patterns relative to `path`.
+            path (str): The directory to search. Defaults to the current directory.
+            exclude (list[str]): Glob patterns of files to leave out.
+            min_size (int): Only files of at least this many bytes.
+            max_size (int): Only files of at most this many bytes.
+            max_age (float): Only files modified in the last N minutes.
+            min_age (float): Only files modified over N minutes ago.
+            sort (str): "path", "size" (largest first) or "mtime" (newest first).
+            limit (int): Maximum number of files to return. Defaults to 200.
+            details (bool): Whether to show the size and mtime of each file.
+        """
+        if sort not in ("path", "size", "mtime"):
+            raise ValueError(f'sort must be "path", "size" or "mtime", not {sort!r}')
+
+        tree = self.get_tree(path)
+        paths = tree.match([compile_glob(pattern) for pattern in patterns])
+        if exclude:
+            excluded = [compile_glob(pattern) for pattern in exclude]
+            paths = [p for p in paths if not any(glob.matches(p) for glob in excluded)]
+
+        needs_stat = details or sort != "path" or any(
+            value is not None for value in (min_size, max_size, max_age, min_age)
+        )
+        if needs_stat:
+            now = time.time()
+            stats = {}
+            for rel_path in paths:
+                try:
+                    st = os.stat(os.path.join(tree.root, rel_path))
+                except OSError:
+                    continue
+                if (
+                    (min_size is not None and st.st_size < min_size)
+                    or (max_size is not None and st.st_size > max_size)
+                    or (max_age is not None and now - st.st_mtime > max_age * 60)
+                    or (min_age is not None and now - st.st_mtime < min_age * 60)
+                ):
+                    continue
+                stats[rel_path] = st
+            paths = list(stats)
+
+        if sort == "size":
+            paths.sort(key=lambda p: (-stats[p].st_size, p))
+        elif sort == "mtime":
+            paths.sort(key=lambda p: (-stats[p].st_mtime_ns, p))
+        else:
+            paths.sort()
+
+        if not paths:
+            return f"No files under {path} match the patterns.\n"
+
+        output = []
+        for rel_path in paths[:limit]:
+            line = os.path.join(path, rel_path)
+            if details:
+                st = stats[rel_path]
+                line += f"  {st.st_size} bytes  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st.st_mtime))}"
+            output.append(line + "\n")
+        if len(paths) > limit:
+            output.append(f"[Showing {limit} of {len(paths)} matching files. Narrow the patterns to see the rest.]\n")
+
+        return "".join(output)
+
+    def get_tree(self, path: str) -> DirectoryTree:
+        "Returns the directory tree at `path`, brought up to date."
+        root = os.path.abspath(os.path.expanduser(path))
+        if not os.path.isdir(root):
+            raise NotADirectoryError(f'"{path}" is not a directory')
+
+        tree = self._trees.get(root)
+        if tree is None:
+            tree = self._trees[root] = DirectoryTree(root)
+        tree.refresh(self._state if isinstance(self._state, State) else None)
+        return tree
+
+
+class CreateFile(FileTool):
+    _has_side_effects = True
 
-class CreateFile(Tool):
     def call(self, path: str, contents: str) -> str:
         """Creates a new file with the given contents. Fails if the file already exists.
 
@@ -177,11 +387,17 @@ class CreateFile(Tool):
         # Write the contents
         with open(path, "w") as f:
             f.write(contents)
+
+        self.state.record_file_update(path)
+        journal = self.edit_journal()
+        if journal is not None:
+            journal.record_create(path)
+
         return f'Successfully wrote "{path}"'
 
 
-class ReplaceLines(Tool):
-    _return_result_to_agent = False
+class ReplaceLines(FileTool):
+    _has_side_effects = True
 
     def call(
         self,
@@ -197,6 +413,7 @@ class ReplaceLines(Tool):
         indentation in your `text` given the context of the surrounding code. 
         Consider the line that will follow your inserted text when choosing
         `end_line`. NOT THREAD-SAFE. Perform all file modifications in a sequential manner.
+        Returns a diff with the new line numbers.
 
         Args:
             path (str): The name of the file to write to.
@@ -206,14 +423,16 @@ class ReplaceLines(Tool):
         """
 
         self.state.raise_error_if_this_file_has_not_been_read_since_it_was_last_updated(path)
-        result = _edit_helper(path, text, start_line - 1, end_line)
-        self.state.record_file_update(path)
+        result = _edit_helper(
+            path, text, start_line - 1, end_line, cache=self.file_cache(), journal=self.edit_journal()
+        )
+        self.state.record_file_edit(path)
 
         return result
 
 
-class InsertLines(Tool):
-    _return_result_to_agent = False
+class InsertLines(FileTool):
+    _has_side_effects = True
 
     def call(
         self,
@@ -231,6 +450,7 @@ class InsertLines(Tool):
         When using `insert_lines()`, always consider the broader
         code context in the lines before and after your replacement. Use appropriate
         indentation in your `text` given the context of the surrounding code.
+        Returns a diff with the new line numbers.
 
         Args:
             path (str): The name of the file to write to.
@@ -240,17 +460,19 @@ class InsertLines(Tool):
         """
         self.state.raise_error_if_this_file_has_not_been_read_since_it_was_last_updated(path)
         if insert_line == -1:
-            result = _edit_helper(path, text, -1, -1)
+            result = _edit_helper(path, text, -1, -1, cache=self.file_cache(), journal=self.edit_journal())
         else:
-            result = _edit_helper(path, text, insert_line - 1, insert_line - 1)
-        self.state.record_file_update(path)
+            result = _edit_helper(
+                path, text, insert_line - 1, insert_line - 1, cache=self.file_cache(), journal=self.edit_journal()
+            )
+        self.state.record_file_edit(path)
 
         return result
 
 
-class DeleteLines(Tool):
-    _return_result_to_agent = False
-    
+class DeleteLines(FileTool):
+    _has_side_effects = True
+
     def call(
         self,
         path: str, 
@@ -270,23 +492,76 @@ class DeleteLines(Tool):
             end_line (int): The end line number of the range to delete.
 
         Returns:
-            str: The contents of the file after the deletion. Use this return 
-                value to verify that your intended changes were correctly apply.
+            str: A diff of the deletion that shows the new line numbers around
+                it. Use this return value to verify that your intended changes
+                were correctly applied.
         """
 
         self.state.raise_error_if_this_file_has_not_been_read_since_it_was_last_updated(path)
-        result = _edit_helper(path, "", start_line - 1, end_line)
-        self.state.record_file_update(path)
+        result = _edit_helper(
+            path, "", start_line - 1, end_line, cache=self.file_cache(), journal=self.edit_journal()
+        )
+        self.state.record_file_edit(path)
 
         return result
 
 
+class Checkpoint(Tool):
+    _has_side_effects = True
+
+    def call(self, name: str = None) -> str:
+        """Marks a checkpoint in the history of the edits made with the file
+        tools. Create one before a risky change, so that `undo` can restore
+        the files to this point instantly.
+
+        Args:
+            name (str): A name for the checkpoint. Defaults to a generated name.
+        """
+        if not isinstance(self._state, State):
+            raise ValueError("Checkpoints require a shared state.")
+
+        name = self._state.journal.checkpoint(name)
+        return f'Created checkpoint "{name}".'
+
+
+class Undo(Tool):
+    _run_exclusively = True
+
+    def call(self, checkpoint: str = None, paths: list[str] = None) -> str:
+        """Undoes the edits made with the file tools since a checkpoint, or the
+        last edit if no checkpoint is given. Files created since the checkpoint
+        are deleted. Much faster than git or rewriting files.
+
+        Args:
+            checkpoint (str): The name of the checkpoint to go back to.
+            paths (list[str]): Only undo the edits to these files. Defaults to all files.
+        """
+        if not isinstance(self._state, State):
+            raise ValueError("Undo requires a shared state.")
+
+        restored = self._state.journal.undo(checkpoint, paths, cache=self._state.file_cache)
+        if not restored:
+            return "There are no edits to undo."
+
+        lines = []
+        for path, n_edits in restored.items():
+            # The agent's view of the file is out of date
+            self._state.record_file_update(path)
+            if n_edits is None:
+                lines.append(f"- {path}: deleted")
+            else:
+                lines.append(f"- {path}: {n_edits} edit(s) undone")
+
+        return "\n".join(lines) + "\nRead the files again before editing them.\n"
+
+
 def _read_helper(
     path: str, 
     start_line: int = None, 
     end_line: int = None, 
     include_line_numbers: bool = True,
-    error_if_missing: bool = True
+    error_if_missing: bool = True,
+    cache: FileCache = None
 ) -> Optional[str]:
     
     path = os.path.expanduser(path)
@@ -298,19 +573,44 @@ def _read_helper(
         else:
             return None
 
-    with open(path, "r") as f:
-        lines = f.readlines()
-        if include_line_numbers:
-            lines = [f"{i+1:<4}|{line}" for i, line in enumerate(lines)]
-        if start_line and end_line:
-            lines = lines[start_line:end_line]
-        
-        output = "".join(lines)
-        return output
-
-
-def _edit_helper(path: str, text: str, start_line: int, end_line: int):
-    """start_line and end_line use pythonic indexing, so the end_line is not inclusive."""
+    first_line = 0
+    if start_line is not None or end_line is not None:
+        first_line = start_line or 0
+        cached = cache.peek(path) if cache is not None else None
+        if cached is not None:
+            lines = cached[0] and cached[0][start_line:end_line]
+        else:
+            # Only the requested lines are decoded
+            lines, _ = read_text_lines(path, start_line, end_line)
+    elif cache is not None:
+        lines = cache.get_lines(path)
+    else:
+        lines, _ = read_text_lines(path)
+
+    if lines is None:
+        return f"[{path} is a binary file of {os.path.getsize(path)} bytes. Its contents are not shown.]\n"
+
+    if include_line_numbers:
+        lines = [f"{i+1:<4}|{line}" for i, line in enumerate(lines, start=first_line)]
+
+    output = display_text("".join(lines))
+    return output
+
+
+def _edit_helper(
+    path: str,
+    text: str,
+    start_line: int,
+    end_line: int,
+    cache: FileCache = None,
+    journal: EditJournal = None
+):
+    """start_line and end_line use pythonic indexing, so the end_line is not inclusive.
+
+    Returns a unified diff of the change, computed from the edited lines in
+    memory rather than by re-reading the file. With a `cache`, the lines are
+    taken from it and the edited lines are written through to it. With a
+    `journal`, the edit is recorded so that it can be undone."""
     path = os.path.expanduser(path)
 
     # Raise error if the file does not exist
@@ -324,17 +624,59 @@ def _edit_helper(path: str, text: str, start_line: int, end_line: int):
     if not end_line:
         end_line = start_line
 
-    with open(path, "r") as f:
-        lines = f.readlines()
-        if start_line < 0:
-            start_line = len(lines) + start_line + 1
+    if cache is not None:
+        lines, encoding = cache.get(path)
+    else:
+        lines, encoding = read_text_lines(path)
 
-        lines[start_line:end_line] = text.splitlines(True)
+    if lines is None:
+        raise ValueError(f'The file "{path}" is a binary file and cannot be edited.')
+    lines = list(lines)
 
-    with open(path, "w") as f:
-        f.writelines(lines)
-    
-    with open(path, "r") as f:
-        result = f.read()
+    if start_line < 0:
+        start_line = len(lines) + start_line + 1
+    start_line = min(start_line, len(lines))
+
+    new_lines = text.splitlines(True)
+    removed_lines = lines[start_line:end_line]
+    lines[start_line:end_line] = new_lines
+
+    write_text_lines(path, lines, encoding)
+
+    if cache is not None:
+        cache.put_lines(path, lines, encoding)
+    if journal is not None:
+        journal.record_edit(path, start_line, removed_lines, len(new_lines))
+
+    return _edit_diff(path, lines, removed_lines, start_line, len(new_lines))
+
+
+# Number of unchanged lines shown around an edit
+EDIT_DIFF_CONTEXT_LINES = 3
+
+
+def _edit_diff(path: str, lines: list, removed_lines: list, start_line: int, n_added: int) -> str:
+    """Formats an edit as a unified diff hunk. Unchanged and added lines are
+    prefixed with their line number in the edited file, as `ReadFile` does."""
+    def show(line):
+        return line if line.endswith("\n") else line + "\n"
+
+    before = max(start_line - EDIT_DIFF_CONTEXT_LINES, 0)
+    after = min(start_line + n_added + EDIT_DIFF_CONTEXT_LINES, len(lines))
+
+    old_count = after - before - n_added + len(removed_lines)
+    new_count = after - before
+    old_start = before + 1 if old_count else before
+    new_start = before + 1 if new_count else before
+
+    output = [
+        f"--- {path}\n",
+        f"+++ {path}\n",
+        f"@@ -{old_start},{old_count} +{new_start},{new_count} @@\n",
+    ]
+    output += [f" {i+1:<4}|{show(lines[i])}" for i in range(before, start_line)]
+    output += [f"-    |{show(line)}" for line in removed_lines]
+    output += [f"+{i+1:<4}|{show(lines[i])}" for i in range(start_line, start_line + n_added)]
+    output += [f" {i+1:<4}|{show(lines[i])}" for i in range(start_line + n_added, after)]
 
-    return result
\ No newline at end of file
+    return display_text("".join(output))
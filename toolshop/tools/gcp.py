@@ -66,6 +66,7 @@ class GetBigQueryTableSchema(Tool):
 
 class AuthenticateToGCP(Tool):
     _require_confirmation = True
+    _run_exclusively = True
 
     def call(self):
         """
@@ -1,23 +1,30 @@
-def all_tools(framework='marvin'):
-    from toolshop.tools.terminal import Shell, PythonExec, Browse
-    from toolshop.tools.data import Sql, Histogram
+def all_tools(framework='marvin', state=None):
+    from toolshop.tools.terminal import Shell, PythonExec, Browse, make_job_tools
+    from toolshop.tools.data import make_data_tools
     from toolshop.tools.file import make_file_tools
+    from toolshop.tools.code import make_code_tools
+    from toolshop.tools.testing import RunTests
     from toolshop.core.meta import EnableResultToFile
     from toolshop.core.base import State
     from toolshop.tools.gcp import AuthenticateToGCP
 
-    state = State()
+    if state is None:
+        state = State()
 
     tools = [
         Shell(state=state),
         PythonExec(state=state),
         Browse(state=state),
-        Sql(state=state),
-        Histogram(state=state),
         EnableResultToFile(state=state),
         AuthenticateToGCP(state=state),
+        *make_job_tools(state=state),
+        *make_data_tools(state=state),
         *make_file_tools(state=state),
+        *make_code_tools(state=state),
+        RunTests(state=state),
     ]
     
     if framework == 'marvin':
         return [t.to_marvin() for t in tools]
+    else:
+        return tools
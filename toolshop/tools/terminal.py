@@ -1,12 +1,42 @@
+import atexit
+import collections
 import httpx
+import os
+import signal
 import subprocess
-from typing import List
+import sys
+import threading
+import time
+import weakref
+from typing import List, Iterator
 
 from toolshop.core.logging import logger
-from toolshop.core.base import Tool
+from toolshop.core.base import State, Tool
+from toolshop.core.budget import ResultBudget
+
+
+# Lines of output kept per background job. Older lines are dropped.
+JOB_OUTPUT_LINES = 5000
+
+# Longer lines of job output are cut, so the ring buffer stays bounded
+MAX_JOB_LINE_LENGTH = 2000
+
+# Lines of new output returned by poll_job
+JOB_POLL_LINES = 100
+
+# Seconds a killed job has to exit before it is killed with SIGKILL
+JOB_KILL_GRACE_PERIOD = 5.0
+
+# Seconds to wait for the remaining output of a job after it exits
+JOB_OUTPUT_DRAIN_TIMEOUT = 1.0
+
+# poll_job waits at most this many seconds for jobs to finish
+MAX_JOB_WAIT = 300.0
 
 
 class PythonExec(Tool): 
+    _run_exclusively = True
+
     def call(self, code: str, vars: List[str]):
         """
         Executes python code on your local machine using exec().  Returns 
@@ -27,7 +57,9 @@ class PythonExec(Tool):
 
 
 class Shell(Tool):
-    def call(self, command: str):
+    _run_exclusively = True
+
+    def call(self, command: str) -> Iterator[str]:
         """
         Execute the given shell command and return output. If you 
         get errors, try using the --help flag on the command you 
@@ -37,59 +69,442 @@ class Shell(Tool):
             command (str): A shell command to execute.
 
         """
-        output = shell_helper(
+        yield from iter_shell_output(
             command, 
             log_lines=True,
             include_exit_code=True
         )
 
-        return output
-
 
 def shell_helper(
     command: str, 
     log_lines: bool = False, 
     include_exit_code: bool = False
 ):
+    return "".join(
+        iter_shell_output(
+            command,
+            log_lines=log_lines,
+            include_exit_code=include_exit_code
+        )
+    )
+
+
+def iter_shell_output(
+    command: str, 
+    log_lines: bool = False, 
+    include_exit_code: bool = False
+) -> Iterator[str]:
+    """Runs the command and yields its output line by line, so callers can
+    stream large outputs without holding them in memory."""
     # Create the subprocess with both stdout and stderr being piped
     process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-    output = ''
-
-    # Stream stdout
-    for line in iter(process.stdout.readline, b''):
-        decoded_line = line.decode()
-        if log_lines:
-            if decoded_line[-1] == '\n':
-                decoded_line = decoded_line[:-1]
-                
-            logger.info(decoded_line)
-        output += decoded_line
+    try:
+        # Stream stdout
+        for line in iter(process.stdout.readline, b''):
+            decoded_line = line.decode()
+            if log_lines:
+                logger.info(decoded_line[:-1] if decoded_line[-1] == '\n' else decoded_line)
+            yield decoded_line
 
-    process.stdout.close()
+        process.stdout.close()
 
-    # Capture stderr
-    error = process.stderr.read().decode()
-    if error:
-        if log_lines:
-            logger.info(error)
-        output += error
+        # Capture stderr
+        error = process.stderr.read().decode()
+        if error:
+            if log_lines:
+                logger.info(error)
+            yield error
 
-    process.stderr.close()
+        process.stderr.close()
 
-    # Wait for the process to finish and get the exit code
-    return_code = process.wait()
+        # Wait for the process to finish and get the exit code
+        return_code = process.wait()
+    finally:
+        # The consumer stopped early, e.g. when the output was cut by a
+        # budget, so the process is killed instead of being left running
+        if process.returncode is None:
+            process.kill()
+            process.stdout.close()
+            process.stderr.close()
+            process.wait()
 
     if include_exit_code:
         # Add explicit exit code notice to the output
         exit_message = f"[exit code {return_code}]"
         logger.info(exit_message)
-        output += exit_message + '\n'
+        yield exit_message + '\n'
+
+
+def make_job_tools(tools: list[str] = None, state: State = None):
+    """Creates the background job tools, sharing a `JobManager`.
+
+    Args:
+        tools (list[str], optional): A list of tool names to include. If None,
+            all tools are included. Defaults to None.
+    """
+    if state is None:
+        state = State()
+
+    job_manager = JobManager()
+
+    start_job = StartJob(state=state, job_manager=job_manager)
+    poll_job = PollJob(state=state, job_manager=job_manager)
+    tail_job = TailJob(state=state, job_manager=job_manager)
+    kill_job = KillJob(state=state, job_manager=job_manager)
+
+    if not tools:
+        tools = ["start_job", "poll_job", "tail_job", "kill_job"]
+
+    x = locals()
+    return [x[tool_name] for tool_name in tools]
+
+
+class Job:
+    """A shell command running in the background, in its own process group.
+
+    Output (stdout and stderr interleaved) is kept in a ring buffer of the
+    last `JOB_OUTPUT_LINES` lines. Lines are numbered from 1, so readers can
+    tell which lines they have seen and how many were dropped.
+    """
+
+    def __init__(self, job_id: int, command: str, cwd: str = None):
+        self.id = job_id
+        self.command = command
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.exit_code = None
+        # Resource usage of the finished job, from wait4()
+        self.rusage = None
+        self.lines = collections.deque(maxlen=JOB_OUTPUT_LINES)
+        self.n_lines = 0
+        # Number of lines returned by poll_job so far
+        self.n_polled = 0
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+        self.started_at = time.monotonic()
+        self.ended_at = None
+        self.process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=self.cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        self.pid = self.process.pid
+
+        # Output is read separately from waiting for the exit, since processes
+        # left running in the background keep the pipe open
+        self._reader = threading.Thread(target=self._read_output, name=f"toolshop-job-{job_id}-output", daemon=True)
+        self._reader.start()
+        threading.Thread(target=self._wait, name=f"toolshop-job-{job_id}-wait", daemon=True).start()
+
+    @property
+    def running(self) -> bool:
+        return self.exit_code is None
+
+    @property
+    def duration(self) -> float:
+        return (self.ended_at or time.monotonic()) - self.started_at
+
+    def _read_output(self):
+        with self.process.stdout:
+            for line in iter(self.process.stdout.readline, b""):
+                line = line.decode(errors="replace")
+                if len(line) > MAX_JOB_LINE_LENGTH:
+                    line = line[:MAX_JOB_LINE_LENGTH] + "...\n"
+                with self._lock:
+                    self.lines.append(line)
+                    self.n_lines += 1
+
+    def _wait(self):
+        # The job's process is reaped here rather than by Popen, to get the
+        # resource usage of the shell and the children it waited for
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(self.pid, 0)
+            exit_code = os.waitstatus_to_exitcode(status)
+            self.process.returncode = exit_code
+        else:
+            exit_code, rusage = self.process.wait(), None
+
+        # Let the reader catch up with the last output, unless processes left
+        # in the background keep the pipe open
+        self._reader.join(JOB_OUTPUT_DRAIN_TIMEOUT)
+
+        with self._lock:
+            self.ended_at = time.monotonic()
+            self.rusage = rusage
+            self.exit_code = exit_code
+        self.finished.set()
+
+    def output_since(self, line_number: int):
+        """The lines after `line_number` that are still buffered, and the
+        number of lines after it that were dropped."""
+        with self._lock:
+            first_buffered = self.n_lines - len(self.lines)
+            skip = max(line_number - first_buffered, 0)
+            lines = list(self.lines)[skip:]
+            return lines, max(first_buffered - line_number, 0)
+
+    def tail(self, n_lines: int) -> list:
+        with self._lock:
+            return list(self.lines)[-n_lines:] if n_lines > 0 else []
+
+    @property
+    def has_processes(self) -> bool:
+        """Whether any process of the job is left. Processes started in the
+        background keep running after the shell exits."""
+        if not hasattr(os, "killpg"):
+            return self.running
+        try:
+            os.killpg(self.pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def send_signal(self, signum: int):
+        "Sends `signum` to every process of the job."
+        if hasattr(os, "killpg"):
+            # The process group outlives the shell as long as it has members,
+            # so its id cannot be reused until they have all exited
+            try:
+                os.killpg(self.pid, signum)
+            except ProcessLookupError:
+                pass
+        elif self.running:
+            self.process.terminate()
+
+    def wait_for_processes(self, timeout: float) -> bool:
+        "Waits until the shell and every process of the job exited. Whether they did."
+        deadline = time.monotonic() + timeout
+        if not self.finished.wait(timeout):
+            return False
+        while self.has_processes:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def resource_usage(self) -> str:
+        if self.rusage is not None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            max_rss = self.rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            return f"cpu {self.rusage.ru_utime + self.rusage.ru_stime:.1f}s, max rss {_format_bytes(max_rss)}"
+
+        usage = _process_group_usage(self.pid)
+        if usage is None:
+            return ""
+        cpu_seconds, rss, n_processes = usage
+        return f"cpu {cpu_seconds:.1f}s, rss {_format_bytes(rss)}, {n_processes} processes"
+
+    def status(self) -> str:
+        state = "running" if self.running else f"exited with code {self.exit_code}"
+        usage = self.resource_usage()
+        return (
+            f"[job {self.id}] {state} after {self.duration:.1f}s"
+            + (f" ({usage})" if usage else "")
+            + f", {self.n_lines} lines of output: {self.command}"
+        )
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def _process_group_usage(pgid: int):
+    """The CPU seconds, resident memory and number of the running processes
+    in the process group, read from /proc. None where /proc is unavailable."""
+    if not os.path.isdir("/proc"):
+        return None
+
+    ticks_per_second = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    cpu_ticks = rss_pages = n_processes = 0
 
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+
+        # The fields after the command name, which may contain spaces
+        fields = stat.rsplit(b")", 1)[-1].split()
+        if int(fields[2]) != pgid:
+            continue
+        cpu_ticks += int(fields[11]) + int(fields[12])
+        rss_pages += int(fields[21])
+        n_processes += 1
+
+    return cpu_ticks / ticks_per_second, rss_pages * page_size, n_processes
+
+
+# The job managers whose jobs are killed when Python exits
+_job_managers = weakref.WeakSet()
+
+
+@atexit.register
+def _kill_all_jobs():
+    for job_manager in list(_job_managers):
+        job_manager.kill_all()
+
+
+class JobManager:
+    "The background jobs of a session. Running jobs are killed when Python exits."
+
+    def __init__(self):
+        self.jobs = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+        _job_managers.add(self)
+
+    def start(self, command: str, cwd: str = None) -> Job:
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+        job = self.jobs[job_id] = Job(job_id, command, cwd=cwd)
+        logger.info(f"Started job {job_id} (pid {job.pid}): {command}")
+        return job
+
+    def get(self, job_id: int) -> Job:
+        if job_id not in self.jobs:
+            raise ValueError(f"There is no job {job_id}. The jobs are: {sorted(self.jobs) or 'none'}")
+        return self.jobs[job_id]
+
+    def kill(self, job_id: int, grace_period: float = JOB_KILL_GRACE_PERIOD) -> Job:
+        "Terminates the job, and kills it if it is still running after `grace_period` seconds."
+        job = self.get(job_id)
+        job.send_signal(signal.SIGTERM)
+        if not job.wait_for_processes(grace_period):
+            job.send_signal(getattr(signal, "SIGKILL", signal.SIGTERM))
+            job.wait_for_processes(grace_period)
+        return job
+
+    def kill_all(self):
+        for job in list(self.jobs.values()):
+            if job.running or job.has_processes:
+                self.kill(job.id, grace_period=1.0)
+
+
+class StartJob(Tool):
+    _run_exclusively = True
+
+    def __init__(self, *args, job_manager: JobManager = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._job_manager = job_manager or JobManager()
+
+    def call(self, command: str, cwd: str = None) -> str:
+        """
+        Starts a shell command in the background and returns its job id
+        immediately. Use this instead of shell for commands that take long,
+        like test suites, builds and servers, and keep working while they run.
+        Check on the job with poll_job, read its output with tail_job and stop
+        it with kill_job.
+
+        Args:
+            command (str): A shell command to execute.
+            cwd (str): The directory to run the command in. Defaults to the current directory.
+        """
+        job = self._job_manager.start(command, cwd=cwd)
+        return f"Started job {job.id} (pid {job.pid}): {command}\n"
+
+
+class PollJob(Tool):
+    def __init__(self, *args, job_manager: JobManager = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._job_manager = job_manager or JobManager()
+
+    def call(self, job_id: int = None, wait: float = 0) -> str:
+        """
+        Returns the status, exit code, resource usage and new output of a
+        background job, or the status of every job.
+
+        Args:
+            job_id (int): The job to check. Defaults to all jobs.
+            wait (float): Seconds to wait for the job to finish before returning.
+                Defaults to 0. Use this instead of sleeping in the shell.
+        """
+        if job_id is None:
+            jobs = list(self._job_manager.jobs.values())
+            if wait > 0 and jobs:
+                deadline = time.monotonic() + min(wait, MAX_JOB_WAIT)
+                for job in jobs:
+                    job.finished.wait(max(deadline - time.monotonic(), 0))
+            return "".join(f"{job.status()}\n" for job in jobs) or "No jobs were started.\n"
+
+        job = self._job_manager.get(job_id)
+        if wait > 0:
+            job.finished.wait(min(wait, MAX_JOB_WAIT))
+
+        lines, n_dropped = job.output_since(job.n_polled)
+        job.n_polled += n_dropped + len(lines)
+        if len(lines) > JOB_POLL_LINES:
+            n_dropped += len(lines) - JOB_POLL_LINES
+            lines = lines[-JOB_POLL_LINES:]
+
+        output = job.status() + "\n"
+        if n_dropped:
+            output += f"[{n_dropped} lines of new output not shown. Use tail_job to read more.]\n"
+        return output + "".join(lines)
+
+
+class TailJob(Tool):
+    def __init__(self, *args, job_manager: JobManager = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._job_manager = job_manager or JobManager()
+
+    def call(self, job_id: int, lines: int = 50) -> str:
+        """
+        Returns the last lines of the output of a background job.
+
+        Args:
+            job_id (int): The job to read.
+            lines (int): Number of lines to return. Defaults to 50.
+        """
+        job = self._job_manager.get(job_id)
+        tail = job.tail(min(lines, JOB_OUTPUT_LINES))
+        return job.status() + "\n" + "".join(tail)
+
+
+class KillJob(Tool):
+    _has_side_effects = True
+
+    def __init__(self, *args, job_manager: JobManager = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._job_manager = job_manager or JobManager()
+
+    def call(self, job_id: int) -> str:
+        """
+        Stops a background job and every process it started.
+
+        Args:
+            job_id (int): The job to stop.
+        """
+        job = self._job_manager.get(job_id)
+        if not job.has_processes:
+            return f"Job {job_id} already exited with code {job.exit_code}.\n"
+
+        shell_exited = not job.running
+        self._job_manager.kill(job_id)
+        if shell_exited:
+            return job.status() + "\nStopped the processes the job left running in the background.\n"
+        return job.status() + "\n"
 
-    return output
 
 class Browse(Tool):
+    _result_budget = ResultBudget(strategy="head")
+
     def call(self, url: str):
         """
         Fetch the contents of a webpage.
@@ -99,10 +514,21 @@ class Browse(Tool):
 
         """
 
+        self._log_request(url)
+        return self._response_text(httpx.get(url))
+
+    async def acall(self, url: str):
+        self._log_request(url)
+        async with httpx.AsyncClient() as client:
+            response = await client.get(url)
+        return self._response_text(response)
+
+    def _log_request(self, url: str):
         logger.info("=== browse() ===")
         logger.info(f"url: {url}")
-        response = httpx.get(url)
 
+    def _response_text(self, response) -> str:
+        "The text of the response, shared by the sync and async paths."
         logger.info("response:")
         logger.info(response.text)
         logger.info("================")
@@ -0,0 +1,553 @@
+"""This module contains tools for running the tests affected by changes.
+
+Test files are selected with an import graph of the Python files under the
+root: a test file depends on the files it imports, directly or transitively,
+and on the conftest.py and pytest configuration files that apply to it. The
+outcome of each test file is cached under a digest of all of its
+dependencies, so a test file is only run again once one of them changed,
+in this session or a later one. Files edited through the tools are always
+re-hashed, even when their size and mtime did not change.
+
+The selected files are split into groups, balanced by their last durations,
+and each group runs in its own pytest worker process, like pytest-xdist
+with `--dist loadfile`. Workers run the project's pytest, found with
+`pytest_command`, rather than the interpreter toolshop is installed in. Imports made dynamically, e.g. with importlib, are
+not seen; use `run_all` after changes that may affect them.
+"""
+
+import ast
+import concurrent.futures
+import fnmatch
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from typing import List, NamedTuple
+
+from ..core.base import Tool, State
+from ..core.cache import cache_dir, cache_key, load_pickle, save_pickle
+from ..core.logging import logger
+from .code import _walk_files
+
+
+TEST_FILE_PATTERNS = ("test_*.py", "*_test.py")
+
+# Files at the root that configure pytest, and so affect every test
+PYTEST_CONFIG_FILES = ("pyproject.toml", "setup.cfg", "pytest.ini", "tox.ini")
+
+# Directories, relative to the root, that absolute imports are resolved from,
+# besides the directory pytest inserts into sys.path for each test file
+SOURCE_ROOTS = ("", "src")
+
+DEFAULT_TEST_TIMEOUT = 600.0
+MAX_TEST_WORKERS = 8
+
+# Virtual environments, relative to the root, whose pytest runs the tests
+PROJECT_VENV_DIRS = (".venv", "venv", "env")
+
+# Duration assumed for a test file that has never run, to balance the workers
+DEFAULT_TEST_FILE_DURATION = 1.0
+
+# Failures listed in the result, and lines of output shown for each
+MAX_REPORTED_FAILURES = 20
+MAX_FAILURE_LINES = 30
+
+TEST_CACHE_FORMAT_VERSION = 1
+
+
+class _SourceFile(NamedTuple):
+    size: int
+    mtime_ns: int
+    # `State` version of the last update through the tools when it was read
+    version: int
+    digest: str
+    # (level, module, names) of each import statement
+    imports: tuple
+
+
+class TestFileResult(NamedTuple):
+    path: str
+    # Digest of the test file and all of its dependencies when it ran
+    digest: str
+    n_tests: int
+    # (test name, output) of each failed test
+    failures: list
+    duration_s: float
+
+    @property
+    def passed(self) -> bool:
+        return not self.failures
+
+
+class TestReport(NamedTuple):
+    n_test_files: int
+    # The results of the test files that ran
+    results: list
+    # Cached results of failing test files whose dependencies did not change
+    still_failing: list
+    n_workers: int
+    duration_s: float
+
+    @property
+    def passed(self) -> bool:
+        return all(r.passed for r in self.results) and not self.still_failing
+
+
+def parse_imports(source: bytes) -> tuple:
+    "The (level, module, names) of each import statement in the source."
+    imports = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            imports += [(0, alias.name, ()) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            imports.append((node.level, node.module or "", tuple(alias.name for alias in node.names)))
+    return tuple(imports)
+
+
+def _venv_python(venv_dir: str):
+    for rel_path in ("bin/python", "Scripts/python.exe"):
+        python = os.path.join(venv_dir, rel_path)
+        if os.path.isfile(python) and os.access(python, os.X_OK):
+            return python
+    return None
+
+
+def pytest_command(root: str) -> list:
+    """The command that runs pytest for the project at `root`.
+
+    In order: `$TOOLSHOP_PYTEST`, e.g. "uv run pytest"; the python of a
+    virtual environment in the project; the active virtual environment;
+    `pytest` on the PATH; and lastly the interpreter running toolshop, which
+    only has the project's dependencies when they share an environment.
+    """
+    command = os.environ.get("TOOLSHOP_PYTEST")
+    if command:
+        return shlex.split(command)
+
+    venv_dirs = [os.path.join(root, name) for name in PROJECT_VENV_DIRS]
+    if os.environ.get("VIRTUAL_ENV"):
+        venv_dirs.append(os.environ["VIRTUAL_ENV"])
+    for venv_dir in venv_dirs:
+        python = _venv_python(venv_dir)
+        if python is not None:
+            return [python, "-m", "pytest"]
+
+    pytest = shutil.which("pytest")
+    if pytest is not None:
+        return [pytest]
+    return [sys.executable, "-m", "pytest"]
+
+
+def is_test_file(rel_path: str) -> bool:
+    name = os.path.basename(rel_path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in TEST_FILE_PATTERNS)
+
+
+class TestRunner:
+    """Runs the test files under `root` that are affected by changes since
+    they last ran, and keeps the import graph and the results on disk
+    between sessions."""
+
+    # Not a test class, despite its name
+    __test__ = False
+
+    def __init__(self, root: str = ".", state: State = None):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.state = state
+        self.path = os.path.join(cache_dir("tests"), f"{cache_key(self.root)}.pickle")
+        self.files = {}
+        self.results = {}
+        self._dependencies = {}
+
+        data = load_pickle(self.path)
+        if data and data.get("format") == TEST_CACHE_FORMAT_VERSION and data.get("root") == self.root:
+            # State versions are only meaningful within a session
+            self.files = {path: entry._replace(version=0) for path, entry in data["files"].items()}
+            self.results = data["results"]
+
+    def save(self):
+        save_pickle(self.path, {
+            "format": TEST_CACHE_FORMAT_VERSION,
+            "root": self.root,
+            "files": self.files,
+            "results": self.results,
+        })
+
+    def refresh(self):
+        "Re-reads the Python files that changed and rebuilds the import graph."
+        seen = set()
+        imports_changed = False
+        for rel_path, st in self._source_files():
+            seen.add(rel_path)
+            imports_changed |= self._refresh_file(rel_path, st)
+
+        for rel_path in set(self.files) - seen:
+            del self.files[rel_path]
+            imports_changed = True
+
+        if imports_changed or not self._dependencies:
+            self._dependencies = {path: self._resolve_imports(path) for path in self.files}
+
+    def _source_files(self):
+        for rel_path, st in _walk_files(self.root, suffixes=(".py",)):
+            yield rel_path, st
+        for name in PYTEST_CONFIG_FILES:
+            try:
+                yield name, os.stat(os.path.join(self.root, name))
+            except OSError:
+                pass
+
+    def _refresh_file(self, rel_path: str, st) -> bool:
+        "Re-reads the file if it changed. Returns whether its imports changed."
+        path = os.path.join(self.root, rel_path)
+        version = self.state.last_update_version(path) if self.state is not None else 0
+
+        entry = self.files.get(rel_path)
+        if (
+            entry is not None
+            and entry.size == st.st_size
+            and entry.mtime_ns == st.st_mtime_ns
+            and entry.version >= version
+        ):
+            return False
+
+        try:
+            with open(path, "rb") as f:
+                source = f.read()
+        except OSError:
+            return False
+
+        imports = ()
+        if rel_path.endswith(".py"):
+            try:
+                imports = parse_imports(source)
+            except (SyntaxError, ValueError):
+                pass
+
+        digest = hashlib.blake2b(source, digest_size=16).hexdigest()
+        self.files[rel_path] = _SourceFile(st.st_size, st.st_mtime_ns, version, digest, imports)
+        return entry is None or entry.imports != imports
+
+    def _module_files(self, base: str, dotted: str) -> list:
+        """The files of the module `dotted` under the directory `base` and of
+        the packages containing it, or [] if there is no such module."""
+        parts = dotted.split(".") if dotted else []
+        files = []
+        for i in range(1, len(parts) + 1):
+            init = os.path.join(base, *parts[:i], "__init__.py")
+            if init in self.files:
+                files.append(init)
+
+        module = os.path.join(base, *parts) + ".py" if parts else None
+        if module in self.files:
+            files.append(module)
+        elif os.path.join(base, *parts, "__init__.py") not in self.files:
+            return []
+        return files
+
+    def _import_base_dir(self, rel_path: str) -> str:
+        "The directory pytest inserts into sys.path to import the file."
+        directory = os.path.dirname(rel_path)
+        while directory and os.path.join(directory, "__init__.py") in self.files:
+            directory = os.path.dirname(directory)
+        return directory
+
+    def _resolve_imports(self, rel_path: str) -> frozenset:
+        "The files under the root that the file imports directly."
+        entry = self.files[rel_path]
+        resolved = set()
+        for level, module, names in entry.imports:
+            if level:
+                base = os.path.dirname(rel_path)
+                for _ in range(level - 1):
+                    base = os.path.dirname(base)
+                bases = [base]
+            else:
+                bases = list(SOURCE_ROOTS) + [self._import_base_dir(rel_path)]
+
+            for base in bases:
+                # `from package import module` imports a submodule
+                for name in names:
+                    resolved.update(self._module_files(base, f"{module}.{name}" if module else name))
+
+                dotted = module
+                while dotted:
+                    files = self._module_files(base, dotted)
+                    if files:
+                        resolved.update(files)
+                        break
+                    dotted = dotted.rpartition(".")[0]
+                if level and not module:
+                    init = os.path.join(base, "__init__.py")
+                    if init in self.files:
+                        resolved.add(init)
+
+        resolved.discard(rel_path)
+        return frozenset(resolved)
+
+    def dependencies(self, rel_path: str) -> set:
+        """The files the test file depends on: itself, the files it imports
+        transitively, the conftest.py files that apply to it and what they
+        import, and the pytest configuration files."""
+        pending = [rel_path]
+        directory = os.path.dirname(rel_path)
+        while True:
+            conftest = os.path.join(directory, "conftest.py")
+            if conftest in self.files:
+                pending.append(conftest)
+            if not directory:
+                break
+            directory = os.path.dirname(directory)
+        pending += [name for name in PYTEST_CONFIG_FILES if name in self.files]
+
+        seen = set()
+        while pending:
+            path = pending.pop()
+            if path not in seen:
+                seen.add(path)
+                pending.extend(self._dependencies.get(path, ()))
+        return seen
+
+    def digest(self, rel_path: str) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for path in sorted(self.dependencies(rel_path)):
+            h.update(f"{path}\0{self.files[path].digest}\0".encode("utf-8", errors="surrogatepass"))
+        return h.hexdigest()
+
+    def test_files(self, paths: List[str] = None) -> list:
+        "The test files under the root, or under `paths`."
+        test_files = sorted(path for path in self.files if is_test_file(path))
+        if not paths:
+            return test_files
+
+        selected = set()
+        for path in paths:
+            rel_path = os.path.relpath(os.path.abspath(os.path.expanduser(path)), self.root)
+            if rel_path == ".":
+                return test_files
+            prefix = os.path.join(rel_path, "")
+            selected.update(p for p in test_files if p == rel_path or p.startswith(prefix))
+        return sorted(selected)
+
+    def run(
+        self,
+        paths: List[str] = None,
+        run_all: bool = False,
+        workers: int = None,
+        timeout: float = DEFAULT_TEST_TIMEOUT,
+    ) -> TestReport:
+        """Runs the test files whose dependencies changed since they last ran,
+        or every test file if `run_all` is set."""
+        start = time.monotonic()
+        self.refresh()
+
+        test_files = self.test_files(paths)
+        digests = {path: self.digest(path) for path in test_files}
+        selected, still_failing = [], []
+        for path in test_files:
+            cached = self.results.get(path)
+            if run_all or cached is None or cached.digest != digests[path]:
+                selected.append(path)
+            elif not cached.passed:
+                still_failing.append(cached)
+
+        n_workers = min(workers or os.cpu_count() or 1, MAX_TEST_WORKERS, len(selected))
+        results = []
+        if selected:
+            results, unreported = self._run_in_workers(selected, digests, n_workers, timeout)
+            # Files whose worker failed to start or timed out have no outcome
+            # to reuse, so they run again next time
+            for result in results:
+                if result.path not in unreported:
+                    self.results[result.path] = result
+            self.save()
+
+        return TestReport(len(test_files), results, still_failing, n_workers, time.monotonic() - start)
+
+    def _balance(self, test_files: list, n_workers: int) -> list:
+        "Splits the test files into groups of about the same total duration."
+        def duration(path):
+            cached = self.results.get(path)
+            return cached.duration_s if cached is not None else DEFAULT_TEST_FILE_DURATION
+
+        groups = [[] for _ in range(n_workers)]
+        loads = [0.0] * n_workers
+        for path in sorted(test_files, key=duration, reverse=True):
+            i = loads.index(min(loads))
+            groups[i].append(path)
+            loads[i] += duration(path)
+        return [group for group in groups if group]
+
+    def _run_in_workers(self, test_files: list, digests: dict, n_workers: int, timeout: float) -> list:
+        groups = self._balance(test_files, n_workers)
+        with tempfile.TemporaryDirectory() as report_dir:
+            with concurrent.futures.ThreadPoolExecutor(len(groups)) as executor:
+                futures = [
+                    executor.submit(self._run_worker, group, os.path.join(report_dir, f"worker-{i}.xml"), timeout)
+                    for i, group in enumerate(groups)
+                ]
+                outcomes = [future.result() for future in futures]
+
+        results, unreported = [], set()
+        for group, (by_file, output, reported) in zip(groups, outcomes):
+            if not reported:
+                unreported.update(group)
+            for path in group:
+                n_tests, failures, duration = by_file.get(path, (0, [], 0.0))
+                if path not in by_file and output is not None:
+                    # The worker did not get to the file, e.g. because it timed out
+                    failures = [(path, output)]
+                results.append(TestFileResult(path, digests[path], n_tests, failures, duration))
+        return sorted(results, key=lambda r: r.path), unreported
+
+    def _run_worker(self, test_files: list, report_path: str, timeout: float):
+        """Runs the test files in a pytest process. Returns the results per
+        file, the output of the process if some files have none, and whether
+        pytest wrote its report."""
+        command = [
+            *pytest_command(self.root), "-q", "-p", "no:cacheprovider",
+            "--continue-on-collection-errors", "-o", "junit_family=xunit1",
+            f"--junitxml={report_path}", *test_files,
+        ]
+        # The root is importable whichever way pytest is started, as it is
+        # with `python -m pytest`
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [self.root, env.get("PYTHONPATH")]))
+
+        logger.debug(f"Running {len(test_files)} test files in a worker: {shlex.join(command)}")
+        started = True
+        try:
+            process = subprocess.run(
+                command, cwd=self.root, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, errors="replace", timeout=timeout,
+            )
+            output, returncode = process.stdout, process.returncode
+        except subprocess.TimeoutExpired as e:
+            output, returncode = f"Timed out after {timeout} seconds.\n{e.stdout or ''}", None
+        except OSError as e:
+            output, returncode, started = f"Could not run {command[0]}: {e}", None, False
+
+        reported = os.path.exists(report_path)
+        by_file = _parse_junit_report(report_path) if reported else {}
+        # pytest exits with 5 when no tests were collected
+        if returncode in (0, 5):
+            return by_file, None, reported
+        if not started or (returncode is not None and not reported):
+            output += (
+                "\nThe tests could not be run. Set $TOOLSHOP_PYTEST to the command that runs "
+                "the project's tests, e.g. \".venv/bin/python -m pytest\"."
+            )
+        return by_file, _tail(output, MAX_FAILURE_LINES), reported
+
+
+def _tail(text, n_lines: int) -> str:
+    if isinstance(text, bytes):
+        text = text.decode("utf-8", errors="replace")
+    lines = text.splitlines()
+    return "\n".join(lines[-n_lines:])
+
+
+def _parse_junit_report(path: str) -> dict:
+    "The number of tests, the failures and the duration of each test file in a JUnit XML report."
+    by_file = {}
+    try:
+        testcases = list(ET.parse(path).iter("testcase"))
+    except ET.ParseError:
+        return by_file
+
+    for testcase in testcases:
+        file = testcase.get("file")
+        if not file:
+            continue
+        n_tests, failures, duration = by_file.get(file, (0, [], 0.0))
+        duration += float(testcase.get("time") or 0)
+        n_tests += 1
+
+        for child in testcase:
+            if child.tag in ("failure", "error"):
+                classname = testcase.get("classname", "")
+                name = testcase.get("name", "")
+                if classname and "." in classname:
+                    # Tests in classes are named module.Class
+                    test_class = classname.rpartition(".")[2]
+                    if test_class[:1].isupper():
+                        name = f"{test_class}::{name}"
+                output = child.text or child.get("message") or ""
+                failures.append((f"{file}::{name}", _tail(output, MAX_FAILURE_LINES)))
+                break
+
+        by_file[file] = (n_tests, failures, duration)
+    return by_file
+
+
+def format_test_report(report: TestReport) -> str:
+    n_run = len(report.results)
+    if not n_run and not report.still_failing:
+        return (
+            f"No test files are affected by changes since they last passed "
+            f"({report.n_test_files} test files).\n"
+        )
+
+    n_tests = sum(r.n_tests for r in report.results)
+    failures = [f for r in report.results for f in r.failures]
+    output = (
+        f"Ran {n_run} of {report.n_test_files} test files ({n_tests} tests) in "
+        f"{report.n_workers} worker{'s' if report.n_workers != 1 else ''} in {report.duration_s:.1f}s: "
+        f"{len(failures)} failed.\n"
+    )
+    if report.still_failing:
+        output += (
+            f"{len(report.still_failing)} test files that failed before were not run again, "
+            f"because nothing they depend on changed: "
+            f"{', '.join(r.path for r in report.still_failing)}\n"
+        )
+
+    for name, failure_output in failures[:MAX_REPORTED_FAILURES]:
+        output += f"\nFAILED {name}\n" + "".join(f"    {line}\n" for line in failure_output.splitlines())
+    if len(failures) > MAX_REPORTED_FAILURES:
+        output += f"\n[{len(failures) - MAX_REPORTED_FAILURES} more failures not shown]\n"
+    return output
+
+
+class RunTests(Tool):
+    _run_exclusively = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._runners = {}
+
+    def runner(self, root: str = ".") -> TestRunner:
+        root = os.path.abspath(os.path.expanduser(root))
+        if root not in self._runners:
+            state = self._state if isinstance(self._state, State) else None
+            self._runners[root] = TestRunner(root, state=state)
+        return self._runners[root]
+
+    def call(
+        self,
+        paths: List[str] = None,
+        run_all: bool = False,
+        workers: int = None,
+        root: str = None,
+    ) -> str:
+        """
+        Runs only the pytest test files affected by changes since they last
+        ran: those that import a changed file, directly or indirectly. Test
+        files run in parallel worker processes, and results are cached, so
+        use this instead of running pytest in the shell after each fix.
+
+        Args:
+            paths (list[str]): Test files or directories to limit the run to.
+                Defaults to every test under the root.
+            run_all (bool): Runs the selected test files even if they are
+                unaffected by changes. Defaults to False.
+            workers (int): Number of worker processes. Defaults to the number of CPUs.
+            root (str): The root of the repository. Defaults to the current directory.
+        """
+        report = self.runner(root or ".").run(paths, run_all=run_all, workers=workers)
+        return format_test_report(report)